@@ -1,19 +1,78 @@
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, HTTPException, File, Form, UploadFile
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 import json
-from loc_to_cor import batch_coordinates, GeocodeError
-from typing import  Dict, Any
+import asyncio
+from contextlib import asynccontextmanager
+from loc_to_cor import batch_coordinates_async, GeocodeError
+from geocode_cache import get_default_cache
+from route_cache import get_segment_cache
+from travel_matrix import get_matrix_cache
+from travel_model import get_travel_model, save_travel_model
+from road_network import get_road_network
+from result_cache import get_result_cache
+from http_client import aclose_clients, provider_health
+from typing import  Dict, Any, Optional
 import logging
 import time
-import urllib.request
-from core_optimize import optimize_assignments
+import math
+from core_optimize import PlanChangeError, apply_plan_changes_async, optimize_assignments, optimize_assignments_async
+from plan_store import PlanConflict, PlanNotFound, get_plan_store
+from jobs import JobManager, JobQueueFull
+from csv_ingest import CSVFormatError, KINDS, ingest_csv
+from problem_store import get_problem_store
+from geometry import FORMATS as GEOMETRY_FORMATS, shape_route
+from decompose import decomposition_settings, shutdown_process_pool
+from batch import aiter_lines, payload_kwargs, run_batch
+from profiling import ProfilingDisabled, get_profiler, profile_requested
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, StageTimings, bind_timings, cache_collector, timed
 
-app = FastAPI()
+# Upper bound on one /api/optimize request (provider solve + enrichment)
+OPTIMIZE_TIMEOUT_S = float(os.environ.get("OPTIMIZE_TIMEOUT_S") or 120)
+
+# Largest CSV accepted by /api/problems/{kind}, in data rows
+UPLOAD_MAX_ROWS = int(os.environ.get("UPLOAD_MAX_ROWS") or 500_000)
+
+# Requests in flight per /api/batch/optimize call (clients may ask for fewer)
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS") or 4)
+
+# Background optimization jobs: JOB_WORKERS concurrent solves, results kept JOB_RESULT_TTL_S after finishing
+job_manager = JobManager(
+    workers=int(os.environ.get("JOB_WORKERS") or 2),
+    result_ttl_s=float(os.environ.get("JOB_RESULT_TTL_S") or 3600),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING") or 100),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Drop the keep-alive provider pools opened on this loop
+    await aclose_clients()
+    shutdown_process_pool()
+    save_travel_model()
+
+
+# NDJSON streams: the compressor would hold records back until its buffer fills
+_UNCOMPRESSED_PATHS = {"/api/optimize/stream", "/api/batch/optimize"}
+
+
+class _StreamAwareGZip(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in _UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app = FastAPI(lifespan=lifespan)
+# Route-heavy optimize responses compress ~5-10x; SSE streams are excluded by the middleware
+app.add_middleware(_StreamAwareGZip, minimum_size=int(os.environ.get("GZIP_MIN_BYTES") or 1024))
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from backend/
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "frontend"))
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(message)s')
@@ -27,6 +86,41 @@ app.mount(
 )
 # app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "frontend")), name="static")
 
+def _cache_stats(get_cache):
+    def stats():
+        cache = get_cache()
+        return cache.stats() if cache is not None else None
+    return stats
+
+
+REGISTRY.add_collector(cache_collector("cache_stat", "Counters and sizes of the in-process caches.", {
+    "geocode": _cache_stats(get_default_cache),
+    "route_segment": _cache_stats(get_segment_cache),
+    "travel_matrix": _cache_stats(get_matrix_cache),
+    "result": _cache_stats(get_result_cache),
+}))
+
+
+def _observe_request(endpoint: str, status: int, t0: float) -> None:
+    REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=str(status))
+
+
+def _profile_decision(request: Request, profile: Optional[str]):
+    """(profile, sampled) for this request; 403 if a profile is asked for while profiling is disabled."""
+    try:
+        return get_profiler().should_profile(profile_requested(request.headers.get("x-profile"), profile))
+    except ProfilingDisabled as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+
+async def _maybe_profiled(endpoint: str, request: Request, profile: Optional[str], make_coro):
+    """Await `make_coro()`, under cProfile when asked for or sampled; returns (result, profile id or None)."""
+    run_profiled, sampled = _profile_decision(request, profile)
+    if not run_profiled:
+        return await make_coro(), None
+    return await get_profiler().run(endpoint, request.headers.get("x-request-id"), make_coro, sampled=sampled)
+
 @app.get("/", response_class=HTMLResponse)
 def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "name": "Ayush"})
@@ -50,64 +144,512 @@ def get_config():
 
 
 @app.post("/api/geocode")
-async def geocode(payload: dict):
+async def geocode(payload: dict, request: Request, profile: Optional[str] = None):
     """
     Batch geocode a list of free-text addresses via TomTom Search API.
-    payload: { "addresses": ["..."], "country": "IN" }
+    payload: { "addresses": ["..."], "country": "IN", "use_batch_api"?: bool }
+    With X-Profile: 1 or ?profile=1 (server needs PROFILING_ENABLED) the call is profiled; the
+    X-Profile-Id response header names the stored profile (see /api/profiles).
     """
     addresses = payload.get("addresses") or []
     country = (payload.get("country") or "").strip()
+    use_batch_api = payload.get("use_batch_api")
 
+    t0 = time.perf_counter()
     if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+        _observe_request("geocode", 400, t0)
         raise HTTPException(status_code=400, detail="Invalid addresses; expected list of strings")
 
-    t0 = time.time()
     try:
-        results = batch_coordinates(addresses, country=country or None)
+        results, profile_id = await _maybe_profiled("geocode", request, profile, lambda: batch_coordinates_async(
+            addresses,
+            country=country or None,
+            use_batch_api=bool(use_batch_api) if use_batch_api is not None else None,
+        ))
+    except HTTPException as e:
+        _observe_request("geocode", e.status_code, t0)
+        raise
     except GeocodeError as e:
         # This would only occur if env var missing; keep behavior similar to your original
+        _observe_request("geocode", 500, t0)
         raise HTTPException(status_code=500, detail=str(e))
 
     ok_count = sum(1 for r in results if isinstance(r.get("lat"), (int, float)) and isinstance(r.get("lng"), (int, float)))
+    _observe_request("geocode", 200, t0)
     logger.info("POST /api/geocode count=%s ok=%s country=%s ms=%d",
-                len(addresses), ok_count, country, int((time.time()-t0)*1000))
+                len(addresses), ok_count, country, int((time.perf_counter()-t0)*1000))
+    if profile_id:
+        return JSONResponse({"results": results}, headers={"X-Profile-Id": profile_id})
     return {"results": results}
 
 
+@app.get("/api/geocode/cache")
+def geocode_cache_stats():
+    """Hit/miss counters and size of the persistent geocode cache."""
+    cache = get_default_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/api/routes/cache")
+def route_cache_stats():
+    """Hit/miss counters and size of the TomTom route-segment cache."""
+    cache = get_segment_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/api/providers/health")
+def providers_health():
+    """Circuit-breaker state and recent call latency percentiles per provider."""
+    return provider_health()
+
+
+@app.get("/api/routes/matrix-cache")
+def matrix_cache_stats():
+    """Hit/miss counters and size of the TomTom travel-matrix cell cache."""
+    cache = get_matrix_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/api/routes/travel-model")
+def travel_model_stats():
+    """Calibrated regions and observation count of the fallback travel-time model, with its prior."""
+    return get_travel_model().stats()
+
+
+@app.get("/api/routes/road-network")
+def road_network_stats():
+    """Size of the offline road graph used by routing_provider "local" (loads it on first call)."""
+    network = get_road_network()
+    if network is None:
+        return {"enabled": False}
+    return {"enabled": True, **network.stats()}
+
+
+@app.get("/api/optimize/cache")
+def result_cache_stats():
+    """Hit/miss/coalesced counters of the optimization result cache."""
+    cache = get_result_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+def _check_geometry(options: Dict[str, Any]) -> None:
+    """Validate options.geometry, coercing its numeric fields in place so shape_route can't fail on them."""
+    geometry = options.get("geometry")
+    if geometry is None:
+        return
+    if not isinstance(geometry, dict) or str(geometry.get("format") or "geojson").lower() not in GEOMETRY_FORMATS:
+        raise HTTPException(status_code=400, detail="options.geometry.format must be one of " + ", ".join(GEOMETRY_FORMATS))
+    for name in ("tolerance_m", "zoom", "tolerance_px"):
+        if geometry.get(name) is None:
+            continue
+        try:
+            value = float(geometry[name])
+        except (TypeError, ValueError):
+            value = math.nan
+        if not math.isfinite(value) or value < 0:
+            raise HTTPException(status_code=400, detail=f"options.geometry.{name} must be a non-negative number")
+        geometry[name] = value
+    if geometry.get("precision") is not None:
+        precision = geometry["precision"]
+        if isinstance(precision, str) and precision.strip().isdigit():
+            precision = int(precision)
+        if isinstance(precision, bool) or not isinstance(precision, int) or not 1 <= precision <= 10:
+            raise HTTPException(status_code=400, detail="options.geometry.precision must be an integer from 1 to 10")
+        geometry["precision"] = precision
+
+
+def _check_decompose(options: Dict[str, Any]) -> None:
+    try:
+        decomposition_settings(options, 0)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"options.decompose: {e}")
+
+
+def _optimize_kwargs(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an /api/optimize payload onto optimize_assignments keyword arguments."""
+    options = payload.get("options") or {}
+    _check_geometry(options)
+    _check_decompose(options)
+    kwargs = payload_kwargs(payload)
+    problem_id = payload.get("problem_id")
+    if problem_id:
+        stored = get_problem_store().get(str(problem_id))
+        if stored is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired problem id")
+        if not stored.complete:
+            raise HTTPException(status_code=400, detail="Problem is missing its vehicles or shipments upload")
+        kwargs["problem"] = stored.problem()
+    return kwargs
+
+
+@app.post("/api/problems/{kind}")
+async def upload_problem_table(kind: str, file: UploadFile = File(...), problem_id: Optional[str] = Form(None)):
+    """
+    Upload one CSV (`kind` = vehicles | shipments, same headers as the templates) as multipart `file`.
+    The file is stream-parsed and validated row by row; invalid rows are skipped and listed in `errors`.
+    Pass the returned `problem_id` with the second upload, then to /api/optimize instead of rows.
+    """
+    if kind not in KINDS:
+        raise HTTPException(status_code=404, detail="Unknown table; expected vehicles or shipments")
+    store = get_problem_store()
+    if problem_id and store.get(problem_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired problem id")
+    t0 = time.time()
+    try:
+        half, report = await asyncio.to_thread(ingest_csv, file.file, kind, max_rows=UPLOAD_MAX_ROWS)
+    except CSVFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
+    preview = report.pop("preview")
+    try:
+        stored = store.attach(problem_id, kind, half, report)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown or expired problem id")
+    logger.info("POST /api/problems/%s -> problem=%s rows=%s rejected=%s ms=%d",
+                kind, stored.id, report["rows"], report["rejected"], int((time.time()-t0)*1000))
+    return {**stored.summary(), "kind": kind, **report, "preview": preview}
+
+
+@app.get("/api/problems/{problem_id}")
+def get_problem(problem_id: str):
+    stored = get_problem_store().get(problem_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired problem id")
+    return {**stored.summary(), "reports": {k: {kk: vv for kk, vv in r.items() if kk != "errors"} for k, r in stored.reports.items()}}
+
+
+@app.delete("/api/problems/{problem_id}")
+def delete_problem(problem_id: str):
+    if not get_problem_store().delete(problem_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired problem id")
+    return {"deleted": problem_id}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of request, stage, provider and cache metrics."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.post("/api/optimize")
-async def optimize(payload: Dict[str, Any]):
+async def optimize(payload: Dict[str, Any], request: Request, timings: bool = False, profile: Optional[str] = None):
     """
     Accepts parsed CSV data and constraints, returns optimized assignments.
     Expected payload keys:
       - vehicles: { headers: [...], rows: [[...], ...] }
       - shipments: { headers: [...], rows: [[...], ...] }
-      - zones: [ { type: 'nogo'|'fence', polygon: [[lat,lng], ...] } ]
-      - options: { vehicle_restrictions: { long_vehicle: bool, max_length_m: number }, use_road_routes?: bool }
+      - problem_id?: string (from /api/problems/{kind} uploads; replaces vehicles/shipments)
+      - zones: [ { type: 'nogo'|'fence', polygon: [[lat,lng], ...], id? } ]
+        (stops, vehicle starts/ends and route geometry are checked against them; findings come back as
+        `zone_violations` with the count in summary.zone_violations)
+      - options: { vehicle_restrictions: { long_vehicle: bool, max_length_m: number }, use_road_routes?: bool,
+                   geometry?: { zoom?, tolerance_px?, tolerance_m?, format?: 'geojson'|'polyline', precision? },
+                   keep_plan?: bool (keep the solved plan for /api/plans/{plan_id}/changes),
+                   decompose?: bool | { parts?, method?: 'kmeans'|'sweep', repair?: bool, target_shipments? } }
       - nb_api_key?: string (optional override)
       - tt_api_key?: string (optional override)
+    With ?timings=1 the response also carries `timings: {stage: {ms, calls}}` for this request, up to
+    serialization (which the stage histogram still records).
+    With X-Profile: 1 or ?profile=1 (server needs PROFILING_ENABLED) the solve and serialization are
+    profiled; the X-Profile-Id response header names the stored profile (see /api/profiles).
     """
-    t0 = time.time()
-    vehicles_in = payload.get("vehicles") or {}
-    shipments_in = payload.get("shipments") or {}
-    zones = payload.get("zones") or []
-    options = payload.get("options") or {}
-    nb_api_key = (payload.get("nb_api_key") or "").strip() or None
-    tt_api_key = (payload.get("tt_api_key") or "").strip() or None
-    use_road_routes = bool(options.get("use_road_routes", True))
+    t0 = time.perf_counter()
+    try:
+        kwargs = _optimize_kwargs(payload)
+    except HTTPException as e:
+        _observe_request("optimize", e.status_code, t0)
+        raise
+    stage_timings = bind_timings(StageTimings())
+
+    async def run():
+        result = await asyncio.wait_for(
+            optimize_assignments_async(**kwargs, timings=stage_timings),
+            timeout=OPTIMIZE_TIMEOUT_S,
+        )
+        if timings:
+            result = {**result, "timings": stage_timings.as_dict()}
+        # Serialized here (with JSONResponse's settings) rather than by FastAPI so the cost is its own stage
+        with timed("serialization"):
+            return result, json.dumps(result, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
 
     try:
-        result = optimize_assignments(
-            vehicles_in=vehicles_in,
-            shipments_in=shipments_in,
-            zones=zones,
-            options=options,
-            nb_api_key=nb_api_key,
-            tt_api_key=tt_api_key,
-            use_road_routes=use_road_routes,
+        (result, body), profile_id = await _maybe_profiled("optimize", request, profile, run)
+    except HTTPException as e:
+        _observe_request("optimize", e.status_code, t0)
+        raise
+    except asyncio.TimeoutError:
+        _observe_request("optimize", 504, t0)
+        raise HTTPException(status_code=504, detail=f"Optimization exceeded {OPTIMIZE_TIMEOUT_S:.0f}s")
+    except Exception as e:
+        _observe_request("optimize", 500, t0)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    _observe_request("optimize", 200, t0)
+    summary = result.get("summary") or {}
+    logger.info("POST /api/optimize assignments=%s unassigned=%s cache=%s ms=%d",
+                len(result.get("assignments") or []), summary.get("unassigned"),
+                (result.get("cache") or {}).get("source"), int((time.perf_counter()-t0)*1000))
+    headers = {"X-Profile-Id": profile_id} if profile_id else None
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _ndjson(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, allow_nan=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+@app.post("/api/optimize/stream")
+async def optimize_stream(payload: Dict[str, Any]):
+    """
+    Same payload as /api/optimize, answered as NDJSON so routes can be drawn as they are ready:
+      {"type": "summary", summary, vehicles, notice?, ...}         once solved
+      {"type": "assignment", index, assignment}                     per vehicle, in completion order
+      {"type": "done", summary, cache, ...}                         final totals (after enrichment)
+    On failure the stream ends with {"type": "error", status, detail}. Cached results are sent at once.
+    """
+    kwargs = _optimize_kwargs(payload)
+    geometry = kwargs["options"].get("geometry")
+    queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    def stream(kind: str, data: Dict[str, Any]) -> None:
+        if kind == "assignment":
+            a = data["assignment"]
+            if geometry:
+                # The assignment still feeds the cache with full geometry; shape a copy for the wire
+                a = {**a, "route": shape_route(a.get("route"), geometry)[0]}
+            data = {"index": data["index"], "assignment": a}
+        # Encoded now: the assignment dicts keep changing after this call
+        queue.put_nowait({"type": kind, "line": _ndjson({"type": kind, **data}), "index": data.get("index")})
+
+    async def run() -> Dict[str, Any]:
+        try:
+            return await asyncio.wait_for(optimize_assignments_async(**kwargs, stream=stream), timeout=OPTIMIZE_TIMEOUT_S)
+        finally:
+            queue.put_nowait(None)
+
+    async def gen():
+        t0 = time.perf_counter()
+        task = asyncio.create_task(run())
+        sent_summary, sent = False, set()
+        try:
+            while (item := await queue.get()) is not None:
+                sent_summary = sent_summary or item["type"] == "summary"
+                if item["index"] is not None:
+                    sent.add(item["index"])
+                yield item["line"]
+            try:
+                result = task.result()
+            except asyncio.TimeoutError:
+                yield _ndjson({"type": "error", "status": 504, "detail": f"Optimization exceeded {OPTIMIZE_TIMEOUT_S:.0f}s"})
+                _observe_request("optimize_stream", 504, t0)
+                return
+            except Exception as e:
+                yield _ndjson({"type": "error", "status": 500, "detail": str(e)})
+                _observe_request("optimize_stream", 500, t0)
+                return
+            rest = {k: v for k, v in result.items() if k != "assignments"}
+            if not sent_summary:
+                yield _ndjson({"type": "summary", **rest, "vehicles": len(result.get("assignments") or [])})
+            for i, a in enumerate(result.get("assignments") or []):
+                if i not in sent:
+                    yield _ndjson({"type": "assignment", "index": i, "assignment": a})
+            yield _ndjson({"type": "done", **rest})
+            _observe_request("optimize_stream", 200, t0)
+            logger.info("POST /api/optimize/stream assignments=%s streamed=%s cache=%s ms=%d",
+                        len(result.get("assignments") or []), len(sent),
+                        (result.get("cache") or {}).get("source"), int((time.perf_counter()-t0)*1000))
+        finally:
+            if not task.done():
+                task.cancel()  # client went away
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+
+def _batch_kwargs(payload: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return _optimize_kwargs(payload)
+    except HTTPException as e:
+        raise ValueError(e.detail)
+
+
+@app.post("/api/batch/optimize")
+async def batch_optimize(file: UploadFile = File(...), workers: int = BATCH_MAX_WORKERS, no_cache: bool = False, summary_only: bool = False):
+    """
+    Replay a JSONL file (multipart `file`) of /api/optimize payloads, or {id, payload} wrappers, at most
+    `workers` (capped by BATCH_MAX_WORKERS) at a time. Answers NDJSON, one record per input line in
+    input order, then a stats record with latency percentiles and throughput (see batch.run_batch).
+    ?no_cache=1 forces fresh solves; ?summary_only=1 drops routes and stops from the records.
+    """
+    workers = max(1, min(int(workers), BATCH_MAX_WORKERS))
+
+    async def gen():
+        t0 = time.perf_counter()
+        async for record in run_batch(
+            aiter_lines(file.file), workers=workers, timeout_s=OPTIMIZE_TIMEOUT_S, no_cache=no_cache,
+            summary_only=summary_only, kwargs_for=_batch_kwargs,
+        ):
+            yield _ndjson(record)
+            if record["type"] == "stats":
+                _observe_request("batch", 200, t0)
+                logger.info("POST /api/batch/optimize requests=%s failed=%s workers=%s rps=%s ms=%d",
+                            record["requests"], record["failed"], workers, record["throughput_rps"],
+                            int((time.perf_counter()-t0)*1000))
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/api/plans/{plan_id}/changes")
+async def change_plan(plan_id: str, payload: Dict[str, Any]):
+    """
+    Incrementally re-optimize a plan kept with options.keep_plan. Payload keys (all optional):
+      - add_shipments: { headers: [...], rows: [[...], ...] } (same format as /api/optimize shipments)
+      - remove_shipments: [shipment id, ...]   (cancelled orders)
+      - remove_vehicles: [vehicle id, ...]     (taken out of service; their shipments are reinserted)
+      - revision?: int (reject with 409 if the plan has changed since)
+      - options?: overrides for this change (geometry, repair_budget_s, ...)
+      - tt_api_key?: string (optional override)
+    Only vehicles whose stop sequence changed are re-routed; see `changed_vehicles` in the response.
+    """
+    t0 = time.perf_counter()
+    options = payload.get("options") or {}
+    revision = payload.get("revision")
+    try:
+        _check_geometry(options)
+        if revision is not None and (isinstance(revision, bool) or not isinstance(revision, int)):
+            raise HTTPException(status_code=400, detail="revision must be an integer")
+    except HTTPException as e:
+        _observe_request("plan_change", e.status_code, t0)
+        raise
+    try:
+        result = await asyncio.wait_for(
+            apply_plan_changes_async(
+                plan_id,
+                add_shipments=payload.get("add_shipments"),
+                remove_shipments=payload.get("remove_shipments"),
+                remove_vehicles=payload.get("remove_vehicles"),
+                options=options,
+                tt_api_key=payload.get("tt_api_key"),
+                revision=revision,
+            ),
+            timeout=OPTIMIZE_TIMEOUT_S,
         )
+    except PlanNotFound:
+        _observe_request("plan_change", 404, t0)
+        raise HTTPException(status_code=404, detail="Unknown or expired plan id")
+    except PlanChangeError as e:
+        _observe_request("plan_change", 400, t0)
+        raise HTTPException(status_code=400, detail=str(e))
+    except PlanConflict as e:
+        _observe_request("plan_change", 409, t0)
+        raise HTTPException(status_code=409, detail=str(e))
+    except asyncio.TimeoutError:
+        _observe_request("plan_change", 504, t0)
+        raise HTTPException(status_code=504, detail=f"Plan update exceeded {OPTIMIZE_TIMEOUT_S:.0f}s")
     except Exception as e:
+        _observe_request("plan_change", 500, t0)
         raise HTTPException(status_code=500, detail=str(e))
+    _observe_request("plan_change", 200, t0)
+    logger.info("POST /api/plans/%s/changes -> revision=%s changed=%s ms=%d",
+                plan_id, result.get("plan_revision"), len(result.get("changed_vehicles") or []),
+                int((time.perf_counter()-t0)*1000))
+    return result
+
+
+@app.get("/api/plans/{plan_id}")
+def get_plan(plan_id: str):
+    """A kept plan's counts and current full result."""
+    plan = get_plan_store().get(plan_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired plan id")
+    return {**plan.summary(), "result": plan.result}
+
+
+@app.delete("/api/plans/{plan_id}")
+def delete_plan(plan_id: str):
+    if not get_plan_store().delete(plan_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired plan id")
+    return {"deleted": plan_id}
+
+
+@app.get("/api/profiles")
+def list_profiles():
+    """Stored request profiles, newest first (without their reports)."""
+    profiler = get_profiler()
+    return {"enabled": profiler.enabled, "sample_percent": profiler.sample_percent, "profiles": profiler.store.list()}
+
+
+@app.get("/api/profiles/{request_id}")
+def get_profile(request_id: str, format: str = "text"):
+    """A stored profile as a pstats text report, or with ?format=pstats as a file for snakeviz/pstats."""
+    entry = get_profiler().store.get(request_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or evicted profile")
+    if format == "pstats":
+        return Response(entry["pstats"], media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{request_id}.prof"'})
+    return Response(entry["report"], media_type="text/plain; charset=utf-8")
+
+
+@app.post("/api/jobs/optimize", status_code=202)
+def submit_optimize_job(payload: Dict[str, Any]):
+    """
+    Queue an optimization (same payload as /api/optimize) and return its job id immediately.
+    Poll GET /api/jobs/{id}, stream GET /api/jobs/{id}/events, then fetch GET /api/jobs/{id}/result.
+    """
+    kwargs = _optimize_kwargs(payload)
+    try:
+        job = job_manager.submit(lambda progress: optimize_assignments(**kwargs, progress=progress))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    logger.info("POST /api/jobs/optimize -> job=%s", job.id)
+    return {"job_id": job.id, "status": job.status}
+
+
+def _get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job id")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    return _get_job(job_id).snapshot()
+
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = _get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error or "Optimization failed")
+    if job.status != "succeeded":
+        return JSONResponse(status_code=202, content=job.snapshot())
+    return job.result
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events: one `data:` line per progress event until the job finishes."""
+    job = _get_job(job_id)
+
+    async def gen():
+        seen = 0
+        while True:
+            events = await job.wait_events(seen, 15.0)
+            if not events:
+                yield ": keep-alive\n\n"
+            for ev in events:
+                yield f"event: {ev['stage']}\ndata: {json.dumps(ev)}\n\n"
+            seen += len(events)
+            if job.done and seen >= len(job.events):
+                return
 
-    # optional log timing, counts, flags here
-    _ = int((time.time() - t0) * 1000)
-    return result
\ No newline at end of file
+    return StreamingResponse(gen(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
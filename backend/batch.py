@@ -0,0 +1,228 @@
+"""
+Batch replay of optimize requests from JSONL, for what-if runs and regression checks.
+
+Each input line is an /api/optimize payload, or {"id": ..., "payload": {...}} to carry a label
+through to the output. Requests run through optimize_assignments_async with at most `workers` in
+flight, and one result line per input comes back in input order. Memory stays bounded: input is read
+as the window frees up, and at most 2 x `workers` requests (running or finished but waiting on an
+earlier line) are held at once. A final stats record reports latency percentiles and throughput.
+
+CLI:
+    python backend/batch.py requests.jsonl -o results.jsonl --workers 4 [--no-cache] [--summary-only]
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, IO, List, Optional, Union
+
+from core_optimize import optimize_assignments_async
+
+KwargsFn = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def payload_kwargs(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an /api/optimize payload onto optimize_assignments keyword arguments (without problem_id)."""
+    options = payload.get("options") or {}
+    return {
+        "vehicles_in": payload.get("vehicles") or {},
+        "shipments_in": payload.get("shipments") or {},
+        "zones": payload.get("zones") or [],
+        "options": options,
+        "nb_api_key": (payload.get("nb_api_key") or "").strip() or None,
+        "tt_api_key": (payload.get("tt_api_key") or "").strip() or None,
+        "use_road_routes": bool(options.get("use_road_routes", True)),
+    }
+
+
+def _cli_kwargs(payload: Dict[str, Any]) -> Dict[str, Any]:
+    if payload.get("problem_id"):
+        raise ValueError("problem_id payloads refer to uploads on a running server; replay them through /api/batch/optimize")
+    return payload_kwargs(payload)
+
+
+def _percentile(sorted_ms: List[float], q: float) -> Optional[float]:
+    if not sorted_ms:
+        return None
+    return round(sorted_ms[min(len(sorted_ms) - 1, max(0, math.ceil(q * len(sorted_ms)) - 1))], 1)
+
+
+class BatchStats:
+    """Latency and outcome counters for one batch run."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.started = time.perf_counter()
+        self.latencies_ms: List[float] = []
+        self.ok = 0
+        self.failed = 0
+
+    def add(self, ok: bool, ms: Optional[float]) -> None:
+        """Count one request; `ms` is None for lines rejected before running, kept out of the latencies."""
+        if ms is not None:
+            self.latencies_ms.append(ms)
+        if ok:
+            self.ok += 1
+        else:
+            self.failed += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        wall_s = time.perf_counter() - self.started
+        lat = sorted(self.latencies_ms)
+        n = len(lat)
+        return {
+            "type": "stats",
+            "requests": self.ok + self.failed,
+            "ok": self.ok,
+            "failed": self.failed,
+            "workers": self.workers,
+            "wall_s": round(wall_s, 3),
+            "throughput_rps": round(n / wall_s, 3) if wall_s > 0 else None,  # requests actually run
+            "latency_ms": {
+                "mean": round(sum(lat) / n, 1) if n else None,
+                "p50": _percentile(lat, 0.50),
+                "p90": _percentile(lat, 0.90),
+                "p99": _percentile(lat, 0.99),
+                "max": round(lat[-1], 1) if n else None,
+            },
+        }
+
+
+def _summarize(result: Dict[str, Any]) -> Dict[str, Any]:
+    out = {k: result[k] for k in ("summary", "cache", "notice", "provider_error") if k in result}
+    out["assignments"] = len(result.get("assignments") or [])
+    return out
+
+
+async def run_batch(
+    lines: AsyncIterator[Union[str, bytes]],
+    *,
+    workers: int = 4,
+    timeout_s: Optional[float] = None,
+    no_cache: bool = False,
+    summary_only: bool = False,
+    kwargs_for: KwargsFn = payload_kwargs,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield one record per non-blank input line, in input order, then a stats record:
+      {"type": "result", line, id?, ok: true, ms, result | summary}
+      {"type": "result", line, id?, ok: false, ms?, error}
+      {"type": "stats", requests, ok, failed, workers, wall_s, throughput_rps, latency_ms: {...}}
+    `ms` is the request's own run time, not time spent queued, and is absent for lines rejected up
+    front. `kwargs_for` maps a payload onto optimize_assignments_async arguments and may raise to
+    reject a line. With `no_cache` every request solves afresh; `summary_only` replaces each result
+    with its summary and counts.
+    """
+    workers = max(1, int(workers))
+    stats = BatchStats(workers)
+    sem = asyncio.Semaphore(workers)
+    window: Deque[asyncio.Task] = deque()
+
+    async def run_one(line_no: int, raw: Union[str, bytes]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"type": "result", "line": line_no}
+        try:
+            entry = json.loads(raw)
+            if not isinstance(entry, dict):
+                raise ValueError("line is not a JSON object")
+            payload = entry.get("payload") if isinstance(entry.get("payload"), dict) else entry
+            if "id" in entry:
+                record["id"] = entry["id"]
+            kwargs = kwargs_for(payload)
+            if no_cache:
+                kwargs["options"] = {**kwargs["options"], "no_cache": True}
+        except Exception as e:
+            stats.add(False, None)
+            return {**record, "ok": False, "error": f"invalid request: {e}"}
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(optimize_assignments_async(**kwargs), timeout=timeout_s)
+            except asyncio.TimeoutError:
+                record.update(ok=False, error=f"timed out after {timeout_s:g}s")
+            except Exception as e:
+                record.update(ok=False, error=str(e) or type(e).__name__)
+            else:
+                record["ok"] = True
+                if summary_only:
+                    record["summary"] = _summarize(result)
+                else:
+                    record["result"] = result
+            record["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        stats.add(record["ok"], record["ms"])
+        return record
+
+    line_no = 0
+    try:
+        async for raw in lines:
+            line_no += 1
+            if not raw.strip():
+                continue
+            window.append(asyncio.create_task(run_one(line_no, raw)))
+            # Emit finished heads; block on the oldest once the window is full
+            while window and (window[0].done() or len(window) >= 2 * workers):
+                yield await window.popleft()
+        while window:
+            yield await window.popleft()
+    finally:
+        for task in window:
+            task.cancel()
+    yield stats.as_dict()
+
+
+async def aiter_lines(fileobj: IO) -> AsyncIterator[Union[str, bytes]]:
+    """Lines of a blocking file object, each read in a worker thread."""
+    while True:
+        line = await asyncio.to_thread(fileobj.readline)
+        if not line:
+            return
+        yield line
+
+
+def _dumps(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+async def _main(args: argparse.Namespace) -> int:
+    from decompose import shutdown_process_pool
+    from http_client import aclose_clients
+
+    src = open(args.input, "rb") if args.input != "-" else sys.stdin.buffer
+    out = open(args.output, "w", encoding="utf-8") if args.output and args.output != "-" else sys.stdout
+    failed = 0
+    try:
+        async for record in run_batch(
+            aiter_lines(src), workers=args.workers, timeout_s=args.timeout, no_cache=args.no_cache,
+            summary_only=args.summary_only, kwargs_for=_cli_kwargs,
+        ):
+            if record["type"] == "stats":
+                failed = record["failed"]
+                print(_dumps(record), file=sys.stderr)
+            else:
+                out.write(_dumps(record) + "\n")
+                out.flush()
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+        await aclose_clients()
+        shutdown_process_pool()
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a JSONL file of /api/optimize payloads.")
+    parser.add_argument("input", help="JSONL of optimize payloads ('-' for stdin)")
+    parser.add_argument("-o", "--output", help="results JSONL (default stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="requests in flight (default 4)")
+    parser.add_argument("--timeout", type=float, default=None, help="per-request timeout in seconds")
+    parser.add_argument("--no-cache", action="store_true", help="solve every request afresh")
+    parser.add_argument("--summary-only", action="store_true", help="write summaries instead of full results")
+    return asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
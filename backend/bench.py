@@ -0,0 +1,383 @@
+"""
+Scale benchmarks for the optimize and geocode paths, against local provider stubs by default.
+
+`run` generates seeded fleets (synth.py), starts the NextBillion/TomTom stand-ins (provider_stubs.py)
+and measures, per fleet size:
+  optimize/<V>x<S>   optimize_assignments end to end, with per-stage times (metrics.StageTimings)
+  http/<V>x<S>       POST /api/optimize through the ASGI app, `--concurrency` requests in flight
+and per address count:
+  geocode/<N>        batch_coordinates (per-address and batch API); per-address calls are paced by
+                     GEOCODE_RATE_PER_SEC (5/s), as against TomTom
+  http-geocode/<N>   POST /api/geocode
+Every case reports latency percentiles, throughput and peak traced memory (one extra tracemalloc run,
+so timed runs are not slowed by tracing). Result, segment and geocode caches are disabled unless
+--with-caches. `compare` diffs two reports, e.g. from two commits.
+
+    python backend/bench.py run --sizes 20x150,200x2000 --latency-ms 60 -o bench.json
+    python backend/bench.py compare base.json bench.json --fail-above 1.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from batch import _percentile
+from provider_stubs import running_stubs
+from synth import generate_addresses, generate_fleet, optimize_payload
+
+REPORT_VERSION = 1
+DEFAULT_SIZES = "20x150,50x500,200x2000"
+DEFAULT_ADDRESSES = "100"
+# The prototype plan's end-to-end goal for 20 vehicles / 150 points
+TARGET_MS = {"20x150": 10_000}
+_CACHE_SWITCHES = ("RESULT_CACHE_DISABLED", "ROUTE_CACHE_DISABLED", "GEOCODE_CACHE_DISABLED")
+
+Case = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class BenchError(Exception):
+    pass
+
+
+def _parse_sizes(text: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        try:
+            nv, ns = (int(x) for x in part.lower().split("x"))
+        except ValueError:
+            raise BenchError(f"bad size {part!r}; expected <vehicles>x<shipments>, e.g. 20x150")
+        sizes.append((nv, ns))
+    return sizes
+
+
+def _latency(ms: List[float]) -> Dict[str, Optional[float]]:
+    lat = sorted(ms)
+    return {
+        "mean": round(sum(lat) / len(lat), 1) if lat else None,
+        "p50": _percentile(lat, 0.50),
+        "p90": _percentile(lat, 0.90),
+        "p99": _percentile(lat, 0.99),
+        "max": round(lat[-1], 1) if lat else None,
+    }
+
+
+def _git_meta() -> Dict[str, Any]:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def git(*args: str) -> Optional[str]:
+        try:
+            out = subprocess.run(["git", *args], cwd=root, capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return out.stdout.strip() if out.returncode == 0 else None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+@contextmanager
+def _env(values: Dict[str, Optional[str]]) -> Iterator[None]:
+    saved = {k: os.environ.get(k) for k in values}
+    for k, v in values.items():
+        if v is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = v
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+async def _measure(name: str, params: Dict[str, Any], case: Case, *, runs: int, concurrency: int, memory: bool) -> Dict[str, Any]:
+    """Run `case` `runs` times with `concurrency` in flight; each call returns {ok, stages?} and is timed here."""
+    await case()  # warm-up: imports, pools, JIT-ish first-call costs stay out of the numbers
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    failures: List[str] = []
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one() -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                out = await case()
+            except Exception as e:
+                failures.append(str(e) or type(e).__name__)
+                return
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            if not out.get("ok", True):
+                failures.append(out.get("error") or "failed")
+            for stage, v in (out.get("stages") or {}).items():
+                stages.setdefault(stage, []).append(v["ms"])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(runs)))
+    wall_s = time.perf_counter() - t0
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            await case()
+            peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        finally:
+            tracemalloc.stop()
+
+    out = {
+        "name": name,
+        "params": params,
+        "runs": runs,
+        "failed": len(failures),
+        "concurrency": concurrency,
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(runs / wall_s, 3) if wall_s > 0 else None,
+        "latency_ms": _latency(latencies),
+        "stages_ms": {s: round(sum(v) / len(v), 1) for s, v in sorted(stages.items())},
+        "peak_traced_mb": peak_mb,
+    }
+    if failures:
+        out["errors"] = sorted(set(failures))[:5]
+    return out
+
+
+def _optimize_case(vehicles: Dict[str, Any], shipments: Dict[str, Any], options: Dict[str, Any]) -> Case:
+    from core_optimize import optimize_assignments_async
+    from metrics import StageTimings
+
+    async def case() -> Dict[str, Any]:
+        timings = StageTimings()
+        result = await optimize_assignments_async(
+            vehicles_in=vehicles, shipments_in=shipments, zones=[], options=options, timings=timings,
+        )
+        return {"ok": "provider_error" not in result, "error": result.get("provider_error"), "stages": timings.as_dict()}
+
+    return case
+
+
+def _geocode_case(addresses: List[str], use_batch_api: bool) -> Case:
+    from loc_to_cor import batch_coordinates_async
+
+    async def case() -> Dict[str, Any]:
+        results = await batch_coordinates_async(addresses, use_batch_api=use_batch_api)
+        failed = sum(1 for r in results if r.get("error"))
+        return {"ok": not failed, "error": f"{failed} addresses failed" if failed else None}
+
+    return case
+
+
+def _http_case(client: Any, path: str, body: Dict[str, Any]) -> Case:
+    async def case() -> Dict[str, Any]:
+        r = await client.post(path, json=body)
+        ok = r.status_code == 200
+        if ok and path == "/api/optimize":
+            ok = "provider_error" not in r.json()
+        elif ok:
+            ok = not any(x.get("error") for x in r.json().get("results") or [])
+        return {"ok": ok, "error": None if ok else f"HTTP {r.status_code}"}
+
+    return case
+
+
+async def _run_cases(args: argparse.Namespace, stubs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    import httpx
+    from app import app
+
+    options = {"no_cache": not args.with_caches, **json.loads(args.options or "{}")}
+    results: List[Dict[str, Any]] = []
+
+    def report(res: Dict[str, Any]) -> None:
+        lat = res["latency_ms"]
+        print(f"{res['name']:<24} p50={lat['p50']}ms p90={lat['p90']}ms rps={res['throughput_rps']} "
+              f"peak={res['peak_traced_mb']}MB failed={res['failed']}", file=sys.stderr)
+        results.append(res)
+
+    def provider_requests(before: Dict[str, int]) -> Dict[str, int]:
+        return {k: s.stats()["requests"] - before.get(k, 0) for k, s in stubs.items()}
+
+    def counts() -> Dict[str, int]:
+        return {k: s.stats()["requests"] for k, s in stubs.items()}
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for nv, ns in _parse_sizes(args.sizes):
+            size = f"{nv}x{ns}"
+            vehicles, shipments = generate_fleet(nv, ns, seed=args.seed)
+            params = {"vehicles": nv, "shipments": ns, "seed": args.seed}
+            if "optimize" in args.cases:
+                before = counts()
+                res = await _measure(f"optimize/{size}", params, _optimize_case(vehicles, shipments, options),
+                                     runs=args.runs, concurrency=1, memory=args.memory)
+                res["provider_requests"] = provider_requests(before)
+                if size in TARGET_MS:
+                    res["target_ms"] = TARGET_MS[size]
+                report(res)
+            if "http" in args.cases:
+                body = optimize_payload(vehicles, shipments, options)
+                res = await _measure(f"http/{size}", params, _http_case(client, "/api/optimize", body),
+                                     runs=args.runs * args.concurrency, concurrency=args.concurrency, memory=False)
+                report(res)
+        for n in [int(x) for x in args.addresses.split(",") if x.strip()]:
+            addresses = generate_addresses(n, seed=args.seed)
+            params = {"addresses": n, "seed": args.seed, "rate_per_sec": float(os.getenv("GEOCODE_RATE_PER_SEC") or 5.0)}
+            if not stubs:
+                break  # geocoding has no offline fallback; never send these to the real TomTom
+            if "geocode" in args.cases:
+                for use_batch in (False, True):
+                    name = f"geocode{'-batch' if use_batch else ''}/{n}"
+                    report(await _measure(name, {**params, "batch_api": use_batch}, _geocode_case(addresses, use_batch),
+                                          runs=args.runs, concurrency=1, memory=args.memory))
+            if "http" in args.cases:
+                report(await _measure(f"http-geocode/{n}", params, _http_case(client, "/api/geocode", {"addresses": addresses}),
+                                      runs=args.runs * args.concurrency, concurrency=args.concurrency, memory=False))
+    return results
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    args.cases = {c.strip() for c in args.cases.split(",") if c.strip()}
+    unknown = args.cases - {"optimize", "http", "geocode"}
+    if unknown:
+        raise BenchError("unknown cases: " + ", ".join(sorted(unknown)))
+    env: Dict[str, Optional[str]] = {k: None if args.with_caches else "1" for k in _CACHE_SWITCHES}
+    stub_config = dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed)
+
+    async def main() -> List[Dict[str, Any]]:
+        from decompose import shutdown_process_pool
+        from http_client import aclose_clients
+
+        try:
+            if args.providers == "off":
+                # Never reach real providers: local solver and straight-line routes
+                with _env({"NEXTBILLION_API_KEY": None, "TOMTOM_API_KEY": None}):
+                    return await _run_cases(args, {})
+            with running_stubs(**stub_config) as stubs:
+                if args.solver == "local":
+                    with _env({"NEXTBILLION_API_KEY": None}):
+                        return await _run_cases(args, stubs)
+                return await _run_cases(args, stubs)
+        finally:
+            await aclose_clients()
+            shutdown_process_pool()
+
+    with _env(env):
+        results = asyncio.run(main())
+    return {
+        "version": REPORT_VERSION,
+        "meta": {
+            **_git_meta(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                "sizes": args.sizes, "addresses": args.addresses, "runs": args.runs, "concurrency": args.concurrency,
+                "seed": args.seed, "providers": args.providers, "solver": args.solver, "with_caches": args.with_caches,
+                "options": args.options, **({} if args.providers == "off" else stub_config),
+            },
+        },
+        "results": results,
+        "process": {"max_rss_mb": _max_rss_mb()},
+    }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], fail_above: Optional[float] = None) -> Tuple[List[str], bool]:
+    """
+    Lines comparing p50/p90 latency, throughput and peak memory of cases present in both reports,
+    and whether any p50 or peak memory grew by more than `fail_above` (a ratio, e.g. 1.25).
+    """
+    old = {r["name"]: r for r in base.get("results") or []}
+    lines = [f"base {base.get('meta', {}).get('commit') or '?'} -> new {new.get('meta', {}).get('commit') or '?'}"]
+    regressed = False
+
+    def cell(a: Any, b: Any) -> Tuple[str, Optional[float]]:
+        if a is None or b is None:
+            return f"{a} -> {b}", None
+        ratio = b / a if a else None
+        return f"{a:g} -> {b:g}" + (f" ({ratio:.2f}x)" if ratio is not None else ""), ratio
+
+    for r in new.get("results") or []:
+        o = old.get(r["name"])
+        if o is None:
+            lines.append(f"{r['name']:<24}  (new)")
+            continue
+        p50, p50_ratio = cell(o["latency_ms"]["p50"], r["latency_ms"]["p50"])
+        p90, _ = cell(o["latency_ms"]["p90"], r["latency_ms"]["p90"])
+        rps, _ = cell(o["throughput_rps"], r["throughput_rps"])
+        mem, mem_ratio = cell(o.get("peak_traced_mb"), r.get("peak_traced_mb"))
+        flag = ""
+        if fail_above and any(x is not None and x > fail_above for x in (p50_ratio, mem_ratio)):
+            regressed = True
+            flag = "  REGRESSION"
+        lines.append(f"{r['name']:<24} p50 ms {p50:<26} p90 ms {p90:<26} rps {rps:<24} peak MB {mem}{flag}")
+    return lines, regressed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Scale benchmarks for optimize, geocode and the HTTP endpoints.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="run the benchmark cases and write a JSON report")
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help=f"fleet sizes as VxS (default {DEFAULT_SIZES})")
+    p.add_argument("--addresses", default=DEFAULT_ADDRESSES, help=f"geocode batch sizes (default {DEFAULT_ADDRESSES})")
+    p.add_argument("--cases", default="optimize,http,geocode", help="comma-separated subset of optimize,http,geocode")
+    p.add_argument("--runs", type=int, default=3, help="timed runs per case (x concurrency for http)")
+    p.add_argument("--concurrency", type=int, default=4, help="requests in flight for the http cases")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--providers", choices=("stubs", "off"), default="stubs",
+                   help="stub servers, or none at all (local solver, straight routes, no geocode cases)")
+    p.add_argument("--solver", choices=("provider", "local"), default="provider", help="local: skip the NextBillion stub")
+    p.add_argument("--latency-ms", type=float, default=50.0, help="stub response delay")
+    p.add_argument("--jitter-ms", type=float, default=20.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--options", help="JSON merged into every optimize request's options")
+    p.add_argument("--with-caches", action="store_true", help="leave result/segment/geocode caches on")
+    p.add_argument("--no-memory", dest="memory", action="store_false", help="skip the traced peak-memory run")
+    p.add_argument("-o", "--output", help="report path (default stdout)")
+
+    c = sub.add_parser("compare", help="compare two reports")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--fail-above", type=float, help="exit 1 if a p50 or peak-memory ratio exceeds this")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "compare":
+            with open(args.base, encoding="utf-8") as f:
+                base = json.load(f)
+            with open(args.new, encoding="utf-8") as f:
+                new = json.load(f)
+            lines, regressed = compare(base, new, args.fail_above)
+            print("\n".join(lines))
+            return 1 if regressed else 0
+        report = run(args)
+    except BenchError as e:
+        parser.error(str(e))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,49 +1,102 @@
 from __future__ import annotations
 import os
-import json
-import urllib.request
-import urllib.error
-from typing import Any, Dict, List, Optional
+import asyncio
+import copy
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from http_client import get_client, provider_url, run_sync, ProviderHTTPError, ProviderTransportError
+from result_cache import canonical_key, get_result_cache
+from problem import Problem
+from geometry import shape_routes
+from plan_store import Plan, PlanConflict, PlanNotFound, get_plan_store, routes_from_result
+from metrics import (
+    CACHE_LOOKUPS,
+    PROVIDER_CALL_SECONDS,
+    PROVIDER_ERRORS,
+    SOLVER_FALLBACKS,
+    StageTimings,
+    bind_timings,
+    record,
+    timed,
+)
 from utils import (
-    _map_shipment_row,
+    _iso,
     _mock_optimize,
     _build_nextbillion_payload,
-    _enrich_routes_with_tomtom,
+    _build_vehicle_params,
+    _enrich_routes_with_tomtom_async,
 )
+from vrp_solver import node_coordinates, repair_pdp, solve_pdp
+from travel_matrix import TravelMatrix, travel_matrix_async
+from zones import ZoneIndex
+from decompose import decomposition_settings, partition, repair_boundaries, run_in_pool, solve_part, stitch
 
 class ProviderError(Exception):
     pass
 
 
+class PlanChangeError(ValueError):
+    """A plan change names shipments or vehicles the plan doesn't have, or removes every vehicle."""
+    pass
+
+
+# Row-level input findings returned with a result; the rest are only counted in the progress event
+MAX_REPORTED_ISSUES = 100
+
+
+# progress(stage, data): optional hook for callers that report per-stage progress (see jobs.py)
+ProgressFn = Callable[[str, Dict[str, Any]], None]
+
+
+def _noop_progress(stage: str, data: Dict[str, Any]) -> None:
+    pass
+
+
+# stream(kind, data): optional hook for callers that send partial results (see /api/optimize/stream).
+# kind "summary": the solved result minus its assignments (plus their count as `vehicles`), before enrichment;
+# kind "assignment": {index, assignment} as each vehicle's enrichment completes.
+# Not called for cached or coalesced results; the final result always carries everything.
+StreamFn = Callable[[str, Dict[str, Any]], None]
+
+
 def _nextbillion_optimize(
     nb_api_key: str,
     nb_payload: Dict[str, Any],
     *,
     timeout: float = 30.0,
-    endpoint: str = "https://api.nextbillion.io/route-optimization",
+    endpoint: Optional[str] = None,
 ) -> Dict[str, Any]:
-    """Calls NextBillion; retries with alternate header casing on 401."""
-    data = json.dumps(nb_payload).encode("utf-8")
+    """Blocking wrapper around _nextbillion_optimize_async."""
+    return run_sync(_nextbillion_optimize_async(nb_api_key, nb_payload, timeout=timeout, endpoint=endpoint))
 
-    def _call(header_name: str) -> Dict[str, Any]:
-        req = urllib.request.Request(endpoint, data=data, method="POST")
-        req.add_header("Content-Type", "application/json")
-        req.add_header(header_name, nb_api_key)
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            return json.loads(resp.read().decode("utf-8"))
 
+async def _nextbillion_optimize_async(
+    nb_api_key: str,
+    nb_payload: Dict[str, Any],
+    *,
+    timeout: float = 30.0,
+    endpoint: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Calls NextBillion (NEXTBILLION_BASE_URL unless `endpoint` is given). Retries, the adaptive timeout and
+    the circuit breaker are the client's (see http_client.ProviderClient); an open breaker fails at once.
+    """
+    client = get_client("nextbillion")
+    endpoint = endpoint or provider_url("nextbillion", "/route-optimization")
     try:
-        try:
-            return _call("x-api-key")
-        except urllib.error.HTTPError as he:
-            body = he.read().decode("utf-8", errors="ignore") if hasattr(he, "read") else str(he)
-            if getattr(he, "code", None) == 401:
-                return _call("X-API-KEY")
-            raise ProviderError(f"NextBillion HTTP {getattr(he, 'code', '?')}: {body}") from he
-    except urllib.error.URLError as e:
+        return await client.post_json(endpoint, nb_payload, headers={"x-api-key": nb_api_key}, timeout=timeout, op="optimize")
+    except ProviderHTTPError as he:
+        raise ProviderError(f"NextBillion HTTP {he.status_code}: {he.body}") from he
+    except ProviderTransportError as e:
         raise ProviderError(f"NextBillion transport error: {e}") from e
 
 
+def _map_inputs(vehicles_in: Dict[str, Any], shipments_in: Dict[str, Any]) -> Problem:
+    # Parsed and validated once; solvers, payload builder and enrichment all read the same columns
+    return Problem.from_tables(vehicles_in, shipments_in)
+
+
 def optimize_assignments(
     *,
     vehicles_in: Dict[str, Any],
@@ -53,52 +106,451 @@ def optimize_assignments(
     nb_api_key: Optional[str] = None,
     tt_api_key: Optional[str] = None,
     use_road_routes: bool = True,
+    progress: Optional[ProgressFn] = None,
+    problem: Optional[Problem] = None,
+    timings: Optional[StageTimings] = None,
+    stream: Optional[StreamFn] = None,
+) -> Dict[str, Any]:
+    """Blocking wrapper around optimize_assignments_async for thread/CLI callers."""
+    return run_sync(optimize_assignments_async(
+        vehicles_in=vehicles_in,
+        shipments_in=shipments_in,
+        zones=zones,
+        options=options,
+        nb_api_key=nb_api_key,
+        tt_api_key=tt_api_key,
+        use_road_routes=use_road_routes,
+        progress=progress,
+        problem=problem,
+        timings=timings,
+        stream=stream,
+    ))
+
+
+async def optimize_assignments_async(
+    *,
+    vehicles_in: Dict[str, Any],
+    shipments_in: Dict[str, Any],
+    zones: List[Dict[str, Any]],
+    options: Dict[str, Any],
+    nb_api_key: Optional[str] = None,
+    tt_api_key: Optional[str] = None,
+    use_road_routes: bool = True,
+    progress: Optional[ProgressFn] = None,
+    problem: Optional[Problem] = None,
+    timings: Optional[StageTimings] = None,
+    stream: Optional[StreamFn] = None,
 ) -> Dict[str, Any]:
     """
     Pure function: maps inputs, calls provider or mock, and (optionally) enriches with TomTom.
-    """
-    v_headers = vehicles_in.get("headers") or []
-    v_rows = vehicles_in.get("rows") or []
-    s_headers = shipments_in.get("headers") or []
-    s_rows = shipments_in.get("rows") or []
+    Provider calls are awaited on the pooled async clients; CPU-bound mapping and the mock
+    solver run in a worker thread so the event loop stays responsive.
+    `progress`, if given, is called as each stage (mapping, solve, enrich per vehicle) completes.
 
-    # Vehicles are already dict-shaped in your pipeline; pass through
-    vehicles: List[Dict[str, Any]] = [
-        {h: (row[i] if i < len(row) else None) for i, h in enumerate(v_headers)}
-        for row in v_rows
-    ]
+    Results are cached on a hash of the mapped inputs, zones, options and which keys are set (never
+    the keys themselves); identical concurrent calls share one computation. The response carries
+    `cache: {hit, source}`. Pass options.no_cache to force a fresh solve.
 
-    # Shipments are mapped via your utility
-    shipments: List[Dict[str, Any]] = [_map_shipment_row(s_headers, r) for r in s_rows]
+    `problem`, if given (e.g. a stored upload), is used as-is and vehicles_in/shipments_in are ignored.
+    `timings`, if given, receives per-stage durations (also exported as optimize_stage_seconds).
+    options.geometry (see geometry.shape_routes) simplifies/encodes route geometry after the cache,
+    so one cached solve serves every output format.
+    `stream`, if given, receives the solved summary and then each assignment as it is enriched (StreamFn).
+    With options.keep_plan the result is also kept as a plan for apply_plan_changes_async and carries
+    `plan_id` / `plan_revision` (absent if the solver's stops can't be mapped back onto the inputs).
+    options.decompose (see decompose.decomposition_settings) splits large instances into regions solved
+    in parallel; summary.decomposition then describes the split.
+    """
+    progress = progress or _noop_progress
+    bind_timings(timings)
+    if problem is None:
+        with timed("mapping"):
+            problem = await asyncio.to_thread(_map_inputs, vehicles_in, shipments_in)
+    progress("mapping", {"vehicles": problem.n_vehicles, "shipments": problem.n_shipments, "issues": len(problem.issues)})
 
     # Keys: request override → env
     nb_key = (nb_api_key or "").strip() or os.getenv("NEXTBILLION_API_KEY")
     tt_key = (tt_api_key or "").strip() or os.getenv("TOMTOM_API_KEY")
 
-    # Try provider → fallback to mock
-    using_mock = False
+    async def compute() -> Dict[str, Any]:
+        result = await _solve_and_enrich(problem, zones, options, nb_key, tt_key, use_road_routes, progress, stream)
+        if problem.issues:
+            result["input_issues"] = problem.issues[:MAX_REPORTED_ISSUES]
+        return result
+
+    cache = get_result_cache()
+    if cache is None or options.get("no_cache"):
+        result = await compute()
+        result["cache"] = {"hit": False, "source": "bypass"}
+        CACHE_LOOKUPS.inc(result="bypass")
+        return await _finish(result, problem, zones, options, use_road_routes)
+
+    with timed("cache_key"):
+        key = await asyncio.to_thread(
+            canonical_key,
+            problem=problem.fingerprint(),
+            zones=zones,
+            options=options,
+            use_road_routes=bool(use_road_routes),
+            provider=bool(nb_key),
+            road_key=bool(tt_key),
+        )
+    # A mock fallback after a provider error is transient; don't pin it in the cache
+    result, source = await cache.get_or_compute(key, compute, cacheable=lambda r: "provider_error" not in r)
+    CACHE_LOOKUPS.inc(result=source)
+    if source != "miss":
+        progress("cache", {"source": source})
+    result["cache"] = {"hit": source != "miss", "source": source}
+    return await _finish(result, problem, zones, options, use_road_routes)
+
+
+async def _finish(result: Dict[str, Any], problem: Problem, zones: List[Dict[str, Any]], options: Dict[str, Any], use_road_routes: bool) -> Dict[str, Any]:
+    if options.get("keep_plan"):
+        plan = await asyncio.to_thread(get_plan_store().create, problem, result, zones, options, bool(use_road_routes))
+        if plan is not None:
+            result["plan_id"], result["plan_revision"] = plan.id, plan.revision
+    return _shape(result, options)
+
+
+def _shape(result: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    if not options.get("geometry"):
+        return result
+    with timed("geometry"):
+        return shape_routes(result, options["geometry"])
+
+
+def _fallback_solver(options: Dict[str, Any]) -> str:
+    """options.solver → env LOCAL_SOLVER → "local". "mock" selects the old nearest-vehicle assignment."""
+    name = str(options.get("solver") or os.getenv("LOCAL_SOLVER") or "local").strip().lower()
+    return "mock" if name == "mock" else "local"
+
+
+def _local_solver_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    opts = {k: options[k] for k in ("avg_speed_kmh", "service_time_s", "candidate_vehicles", "granular_neighbours", "seed") if options.get(k) is not None}
+    opts["time_budget_s"] = options.get("time_budget_s") or float(os.getenv("LOCAL_SOLVER_BUDGET_S") or 2.0)
+    opts["repair_budget_s"] = options.get("repair_budget_s") or float(os.getenv("PLAN_REPAIR_BUDGET_S") or 0.5)
+    return opts
+
+
+def _travel_matrix_source(options: Dict[str, Any]) -> str:
+    """options.travel_matrix → env SOLVER_TRAVEL_MATRIX → "haversine". "tomtom" gives the local solver road travel."""
+    name = str(options.get("travel_matrix") or os.getenv("SOLVER_TRAVEL_MATRIX") or "haversine").strip().lower()
+    return "tomtom" if name == "tomtom" else "haversine"
+
+
+async def _road_matrix(problem: Problem, options: Dict[str, Any], tt_key: Optional[str]) -> Optional[TravelMatrix]:
+    """
+    TomTom travel matrix over the local solver's nodes, departing at the earliest shift start; None when
+    not selected, without a key, or above TOMTOM_MATRIX_MAX_NODES (1000) nodes (decompose those instead).
+    """
+    if not tt_key or _travel_matrix_source(options) != "tomtom":
+        return None
+    lat, lng = node_coordinates(problem)
+    if len(lat) > int(os.getenv("TOMTOM_MATRIX_MAX_NODES") or 1000):
+        return None
+    starts = problem.shift_ts[:, 0]
+    starts = starts[~np.isnan(starts)]
+    with timed("travel_matrix"):
+        return await travel_matrix_async(
+            lat, lng, key=tt_key,
+            vehicle_params=_build_vehicle_params(options.get("vehicle_restrictions") or {}),
+            depart_at=_iso(float(starts.min())) if starts.size else None,
+        )
+
+
+async def _solve(
+    problem: Problem,
+    zones: List[Dict[str, Any]],
+    zone_index: ZoneIndex,
+    options: Dict[str, Any],
+    nb_key: Optional[str],
+    in_process_pool: bool = False,
+    tt_key: Optional[str] = None,
+) -> Tuple[Dict[str, Any], str]:
+    """
+    (result, solver name) for one problem; local/mock solves run in the process pool or a worker thread.
+    The local solver plans on a TomTom travel matrix when options.travel_matrix selects one (summary.travel_matrix).
+    """
+    # Try provider → fallback to the local solver (or the nearest-vehicle mock if selected)
+    using_fallback = False
     if nb_key:
+        with timed("payload_build"):
+            nb_payload = _build_nextbillion_payload(problem, zones, options)
+        t0 = time.perf_counter()
         try:
-            nb_payload = _build_nextbillion_payload(vehicles, shipments, zones, options)
-            result = _nextbillion_optimize(nb_key, nb_payload)
+            result = await _nextbillion_optimize_async(nb_key, nb_payload)
         except ProviderError as e:
+            PROVIDER_ERRORS.inc(provider="nextbillion")
             result = {"provider_error": str(e)}
-            using_mock = True
+            using_fallback = True
+        finally:
+            elapsed = time.perf_counter() - t0
+            PROVIDER_CALL_SECONDS.observe(elapsed, provider="nextbillion", call="optimize")
+            record("nextbillion", elapsed)
     else:
-        using_mock = True
+        using_fallback = True
         result = {}
 
-    if using_mock:
-        result = _mock_optimize(vehicles, shipments)
-        result["notice"] = "Mock optimization used (NEXTBILLION_API_KEY missing or provider returned error)."
+    solver = "nextbillion"
+    if using_fallback:
+        solver = _fallback_solver(options)
+        SOLVER_FALLBACKS.inc(solver=solver, reason="provider_error" if nb_key else "no_key")
+        road = await _road_matrix(problem, options, tt_key) if solver == "local" else None
+        matrix = (road.distance_m, road.time_s) if road is not None else None
+        with timed("solve"):
+            if in_process_pool:
+                result = await run_in_pool(solve_part, problem, _local_solver_options(options), zone_index, solver, matrix)
+            elif solver == "mock":
+                result = await asyncio.to_thread(_mock_optimize, problem)
+            else:
+                result = await asyncio.to_thread(solve_pdp, problem, _local_solver_options(options), zone_index, matrix)
+        if road is not None:
+            result.setdefault("summary", {})["travel_matrix"] = road.stats
+        if solver == "mock":
+            result["notice"] = "Mock optimization used (NEXTBILLION_API_KEY missing or provider returned error)."
+        else:
+            result["notice"] = "Local solver used (NEXTBILLION_API_KEY missing or provider returned error)."
         if nb_key:
             result.setdefault("provider_error", "Provider call failed; check server logs for details.")
+    return result, solver
+
+
+async def _solve_decomposed(
+    problem: Problem,
+    zones: List[Dict[str, Any]],
+    zone_index: ZoneIndex,
+    options: Dict[str, Any],
+    nb_key: Optional[str],
+    settings: Dict[str, Any],
+    tt_key: Optional[str] = None,
+) -> Tuple[Dict[str, Any], str]:
+    """
+    Solve geographic regions concurrently (see decompose.py) and stitch them into one result. Provider
+    regions are concurrent requests; local ones run in the process pool. When every region was solved
+    locally, shipments left over at region edges get one more insertion pass across the whole fleet,
+    with local search on vehicles serving boundary shipments.
+    """
+    t0 = time.perf_counter()
+    with timed("decompose"):
+        regions, boundary = await asyncio.to_thread(partition, problem, settings["parts"], settings["method"])
+        subs = await asyncio.to_thread(lambda: [problem.select(v, s) for v, s in regions])
+    outcomes = await asyncio.gather(*(_solve(sub, zones, zone_index, options, nb_key, True, tt_key) for sub in subs))
+    solvers = sorted({name for _, name in outcomes})
+    part_ms = [(r.get("summary") or {}).get("solve_ms") for r, _ in outcomes]
+    result = stitch(problem, regions, [r for r, _ in outcomes])
+
+    repair_ms = None
+    if settings["repair"] and solvers == ["local"]:
+        routes = routes_from_result(problem, result)
+        if routes is not None:
+            on_route = {n // 2 for stops in routes for n in stops}
+            edge = set(boundary)
+            pending = [s for s in range(problem.n_shipments) if s not in on_route]
+            touched = [v for v, stops in enumerate(routes) if any(n // 2 in edge for n in stops)]
+            with timed("boundary_repair"):
+                fixed = await run_in_pool(
+                    repair_boundaries, problem, routes, pending, touched, _local_solver_options(options), zone_index,
+                )
+            fixed["summary"].pop("spatial_index", None)
+            repair_ms = fixed["summary"].pop("solve_ms", None)
+            result = {**result, **fixed}
+
+    summary = result.setdefault("summary", {})
+    summary["solver"] = "+".join(solvers)
+    summary["solve_ms"] = int((time.perf_counter() - t0) * 1000)
+    part_matrices = [(r.get("summary") or {}).get("travel_matrix") for r, _ in outcomes]
+    if any(part_matrices):
+        summary["travel_matrix"] = {
+            k: sum(m[k] for m in part_matrices if m) for k in ("cached", "fetched", "estimated", "calls", "failed_calls")
+        }
+    summary["decomposition"] = {
+        "method": settings["method"],
+        "parts": len(regions),
+        "vehicles": [len(v) for v, _ in regions],
+        "shipments": [len(s) for _, s in regions],
+        "part_ms": part_ms,
+        "boundary_shipments": len(boundary),
+        "repair_ms": repair_ms,
+    }
+    return result, "+".join(solvers)
+
+
+async def _solve_and_enrich(
+    problem: Problem,
+    zones: List[Dict[str, Any]],
+    options: Dict[str, Any],
+    nb_key: Optional[str],
+    tt_key: Optional[str],
+    use_road_routes: bool,
+    progress: ProgressFn,
+    stream: Optional[StreamFn] = None,
+) -> Dict[str, Any]:
+    with timed("zone_index"):
+        zone_index = ZoneIndex(zones)
+    decomposition = decomposition_settings(options, problem.n_shipments)
+    if decomposition is not None:
+        result, solver = await _solve_decomposed(problem, zones, zone_index, options, nb_key, decomposition, tt_key)
+    else:
+        result, solver = await _solve(problem, zones, zone_index, options, nb_key, tt_key=tt_key)
+    progress("solve", {"solver": solver, "assignments": len(result.get("assignments") or [])})
+    on_assignment = None
+    if stream is not None:
+        stream("summary", {**{k: v for k, v in result.items() if k != "assignments"}, "vehicles": len(result.get("assignments") or [])})
+        on_assignment = lambda i, a: stream("assignment", {"index": i, "assignment": a})
 
     # Optional enrichment via your utility (swallow errors)
     if use_road_routes:
         try:
-            result = _enrich_routes_with_tomtom(result, zones, options, tt_key)
+            with timed("enrich"):
+                result = await _enrich_routes_with_tomtom_async(
+                    result, zones, options, tt_key, progress=progress, problem=problem, on_assignment=on_assignment,
+                    zone_index=zone_index,
+                )
         except Exception:
             pass
 
+    await _check_zones(result, zone_index)
     return result
+
+
+async def _check_zones(result: Dict[str, Any], zone_index: ZoneIndex) -> None:
+    """Attach zone_violations (see ZoneIndex.check_result) and summary.zone_violations when zones were given."""
+    if not len(zone_index):
+        return
+    with timed("zone_check"):
+        count, found = await asyncio.to_thread(zone_index.check_result, result)
+    result["zone_violations"] = found
+    if isinstance(result.get("summary"), dict):
+        result["summary"]["zone_violations"] = count
+
+
+def _plan_edit(
+    plan: Plan,
+    add_shipments: Optional[Dict[str, Any]],
+    remove_shipments: List[Any],
+    remove_vehicles: List[Any],
+) -> Tuple[Problem, List[List[int]], List[int], List[int], List[int]]:
+    """
+    Apply a change set to a plan's problem: (new problem, routes remapped onto it without removed
+    shipments, shipments to insert, vehicles that lost stops, old vehicle row of each new vehicle row).
+    New shipments are appended after the kept ones.
+    """
+    problem = plan.problem
+    drop_s = {str(x) for x in remove_shipments}
+    drop_v = {str(x) for x in remove_vehicles}
+    unknown = sorted(drop_s - {str(problem.shipment_id(s)) for s in range(problem.n_shipments)})
+    unknown += sorted(drop_v - {str(vid) for vid in problem.vehicle_ids})
+    if unknown:
+        raise PlanChangeError("Unknown shipment or vehicle ids: " + ", ".join(unknown[:20]))
+    keep_s = [s for s in range(problem.n_shipments) if str(problem.shipment_id(s)) not in drop_s]
+    keep_v = [v for v in range(problem.n_vehicles) if str(problem.vehicle_ids[v]) not in drop_v]
+    if not keep_v:
+        raise PlanChangeError("A plan needs at least one vehicle in service")
+
+    new_problem = problem.select(keep_v, keep_s)
+    if add_shipments and add_shipments.get("rows"):
+        new_problem = Problem.concat([new_problem, Problem.from_tables({}, add_shipments)])
+    s_map = {old: new for new, old in enumerate(keep_s)}
+    v_map = {old: new for new, old in enumerate(keep_v)}
+
+    routes: List[List[int]] = [[] for _ in keep_v]
+    lost: List[int] = []
+    pending: List[int] = []
+    for v_old, stops in enumerate(plan.routes):
+        kept = [2 * s_map[n // 2] + n % 2 for n in stops if n // 2 in s_map]
+        if v_old not in v_map:
+            pending.extend(n // 2 for n in kept if n % 2 == 0)  # stranded by a retired vehicle
+            continue
+        routes[v_map[v_old]] = kept
+        if len(kept) != len(stops):
+            lost.append(v_map[v_old])
+    on_route = {n // 2 for stops in plan.routes for n in stops}
+    # Previously unassigned shipments get another chance alongside the new ones
+    pending.extend(s_map[s] for s in keep_s if s not in on_route)
+    pending.extend(range(len(keep_s), new_problem.n_shipments))
+    return new_problem, routes, pending, lost, keep_v
+
+
+def _plan_assignment(plan: Plan, v_old: int) -> Optional[Dict[str, Any]]:
+    assignments = plan.result.get("assignments") or []
+    if len(assignments) == plan.problem.n_vehicles:
+        return assignments[v_old]
+    vid = plan.problem.vehicle_ids[v_old]
+    return next((a for a in assignments if a.get("vehicle_id") == vid), None)
+
+
+async def apply_plan_changes_async(
+    plan_id: str,
+    *,
+    add_shipments: Optional[Dict[str, Any]] = None,
+    remove_shipments: Optional[List[Any]] = None,
+    remove_vehicles: Optional[List[Any]] = None,
+    options: Optional[Dict[str, Any]] = None,
+    tt_api_key: Optional[str] = None,
+    revision: Optional[int] = None,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, Any]:
+    """
+    Incrementally re-optimize a kept plan: insert `add_shipments` ({headers, rows} like /api/optimize),
+    drop `remove_shipments` (shipment ids) and take `remove_vehicles` (vehicle ids) out of service, their
+    shipments being reinserted elsewhere. Uses cheapest feasible insertion plus local search on the
+    affected routes only (options.repair_budget_s, default 0.5s), and re-enriches only vehicles whose stop
+    sequence changed; the rest keep their previous geometry, legs and ETAs.
+
+    `options` override the plan's original options for this change (e.g. geometry). Pass `revision` to
+    fail with PlanConflict instead of overwriting a concurrent change. Raises PlanNotFound for an unknown
+    plan and PlanChangeError for unknown ids. The result has the optimize shape plus plan_id,
+    plan_revision and changed_vehicles.
+    """
+    progress = progress or _noop_progress
+    store = get_plan_store()
+    plan = store.get(plan_id)
+    if plan is None:
+        raise PlanNotFound(plan_id)
+    base_revision = plan.revision
+    if revision is not None and int(revision) != base_revision:
+        raise PlanConflict(f"plan is at revision {base_revision}, not {revision}")
+    opts = {**plan.options, **(options or {})}
+    zone_index = ZoneIndex(plan.zones)
+
+    with timed("mapping"):
+        problem, routes, pending, lost, keep_v = await asyncio.to_thread(
+            _plan_edit, plan, add_shipments, list(remove_shipments or []), list(remove_vehicles or []),
+        )
+    progress("mapping", {"vehicles": problem.n_vehicles, "shipments": problem.n_shipments, "pending": len(pending)})
+    with timed("solve"):
+        result, new_routes, changed = await asyncio.to_thread(
+            repair_pdp, problem, routes, pending, lost, _local_solver_options(opts), zone_index,
+        )
+    changed |= set(lost)
+    progress("solve", {"solver": "repair", "changed": len(changed)})
+
+    assignments = result["assignments"]
+    for v in range(problem.n_vehicles):
+        previous = _plan_assignment(plan, keep_v[v]) if v not in changed else None
+        if previous is not None:
+            assignments[v] = copy.deepcopy(previous)
+        else:
+            changed.add(v)
+    tt_key = (tt_api_key or "").strip() or os.getenv("TOMTOM_API_KEY")
+    if plan.use_road_routes and changed:
+        try:
+            with timed("enrich"):
+                await _enrich_routes_with_tomtom_async(
+                    {"assignments": [assignments[v] for v in sorted(changed)]}, plan.zones, opts, tt_key,
+                    progress=progress, problem=problem, zone_index=zone_index,
+                )
+        except Exception:
+            pass
+    # Enriched plans total their per-vehicle metrics; otherwise the solver's straight-line totals stand
+    if assignments and all("metrics" in a for a in assignments):
+        result["summary"]["total_distance_km"] = round(sum(a["metrics"]["distance_m"] for a in assignments) / 1000.0, 3)
+        result["summary"]["total_time_min"] = int(sum(a["metrics"]["time_s"] for a in assignments) / 60)
+    result["summary"]["solver"] = "repair"
+    result["changed_vehicles"] = [assignments[v].get("vehicle_id") for v in sorted(changed)]
+    result["notice"] = f"Plan updated incrementally; {len(changed)} of {len(assignments)} vehicles re-routed."
+    await _check_zones(result, zone_index)
+
+    plan = await asyncio.to_thread(store.update, plan_id, base_revision, problem=problem, routes=new_routes, result=result)
+    result["plan_id"], result["plan_revision"] = plan.id, plan.revision
+    return _shape(result, opts)
@@ -0,0 +1,204 @@
+"""
+Streaming CSV ingestion for uploaded vehicle and shipment files.
+
+Rows are read one at a time from the (spooled) upload, validated, and folded into columnar
+Problem chunks of CHUNK_ROWS rows, so raw strings for at most one chunk are alive at a time.
+Invalid rows are skipped and reported with their line number; the rest become the stored problem.
+"""
+import csv
+import io
+import math
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from problem import Problem, SHIPMENT_COLUMNS, VEHICLE_COLUMNS
+
+CHUNK_ROWS = 5000
+MAX_REPORTED_ERRORS = 500
+PREVIEW_ROWS = 1000  # matches the frontend table's render limit
+
+
+class CSVFormatError(ValueError):
+    """The file as a whole is unusable (encoding, header row)."""
+    pass
+
+
+def _check_float(lo: float, hi: float) -> Callable[[str], Optional[str]]:
+    def check(v: str) -> Optional[str]:
+        try:
+            x = float(v)
+        except ValueError:
+            return "not a number"
+        if math.isnan(x) or not lo <= x <= hi:
+            return f"must be between {lo:g} and {hi:g}"
+        return None
+    return check
+
+
+def _check_int(min_value: Optional[int] = None) -> Callable[[str], Optional[str]]:
+    def check(v: str) -> Optional[str]:
+        try:
+            x = int(v)
+        except ValueError:
+            return "not an integer"
+        if min_value is not None and x < min_value:
+            return f"must be >= {min_value}"
+        return None
+    return check
+
+
+def _check_time(v: str) -> Optional[str]:
+    try:
+        datetime.fromisoformat(v.replace("Z", "+00:00"))
+    except ValueError:
+        return "not an ISO-8601 timestamp"
+    return None
+
+
+_LAT = _check_float(-90, 90)
+_LNG = _check_float(-180, 180)
+
+# column key -> (required, validator); keys are those of VEHICLE_COLUMNS / SHIPMENT_COLUMNS
+_VEHICLE_RULES: Dict[str, Tuple[bool, Optional[Callable[[str], Optional[str]]]]] = {
+    "id": (True, None),
+    "description": (False, None),
+    "capacity": (False, _check_int(0)),
+    "start_lat": (True, _LAT),
+    "start_lng": (True, _LNG),
+    "end_lat": (False, _LAT),
+    "end_lng": (False, _LNG),
+    "shift_start": (False, _check_time),
+    "shift_end": (False, _check_time),
+    "max_tasks": (False, _check_int(0)),
+}
+_SHIPMENT_RULES: Dict[str, Tuple[bool, Optional[Callable[[str], Optional[str]]]]] = {
+    "pickup_id": (False, None),
+    "pickup_lat": (True, _LAT),
+    "pickup_lng": (True, _LNG),
+    "pickup_start": (False, _check_time),
+    "pickup_end": (False, _check_time),
+    "delivery_id": (False, None),
+    "delivery_lat": (True, _LAT),
+    "delivery_lng": (True, _LNG),
+    "delivery_start": (False, _check_time),
+    "delivery_end": (False, _check_time),
+    "quantity": (False, _check_int(0)),
+    "priority": (False, _check_int()),
+    "description": (False, None),
+}
+# Pairs whose start must not be after their end
+_WINDOWS = {
+    "vehicles": [("shift_start", "shift_end")],
+    "shipments": [("pickup_start", "pickup_end"), ("delivery_start", "delivery_end")],
+}
+
+KINDS = {
+    "vehicles": (VEHICLE_COLUMNS, _VEHICLE_RULES),
+    "shipments": (SHIPMENT_COLUMNS, _SHIPMENT_RULES),
+}
+
+
+def _row_errors(kind: str, cells: Dict[str, str], rules) -> List[Tuple[str, str]]:
+    errors = []
+    for key, (required, check) in rules.items():
+        v = cells.get(key, "")
+        if not v:
+            if required:
+                errors.append((key, "required"))
+            continue
+        msg = check(v) if check is not None else None
+        if msg:
+            errors.append((key, msg))
+    if kind == "shipments" and not (cells.get("pickup_id") or cells.get("delivery_id")):
+        errors.append(("pickup_id", "pickup or delivery id required"))
+    for a, b in _WINDOWS[kind]:
+        if cells.get(a) and cells.get(b) and not any(k in (a, b) for k, _ in errors):
+            ta = datetime.fromisoformat(cells[a].replace("Z", "+00:00"))
+            tb = datetime.fromisoformat(cells[b].replace("Z", "+00:00"))
+            try:
+                if ta > tb:
+                    errors.append((b, f"before {KINDS[kind][0][a]}"))
+            except TypeError:
+                errors.append((b, f"mixes timezone-aware and naive times with {KINDS[kind][0][a]}"))
+    return errors
+
+
+def ingest_csv(fileobj: BinaryIO, kind: str, *, max_rows: Optional[int] = None) -> Tuple[Problem, Dict[str, Any]]:
+    """
+    Stream-parse one uploaded CSV (`kind` "vehicles" or "shipments") into a Problem holding only that
+    table, plus a report: {rows, accepted, rejected, errors: [{line, column, message}], errors_truncated,
+    headers, preview}. Raises CSVFormatError for a bad encoding or missing header columns.
+    """
+    columns, rules = KINDS[kind]
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        return _ingest(csv.reader(text), kind, columns, rules, max_rows)
+    except UnicodeDecodeError as e:
+        raise CSVFormatError("file is not UTF-8 encoded") from e
+    finally:
+        text.detach()  # leave the upload's file open for its owner to close
+
+
+def _ingest(reader, kind: str, columns: Dict[str, str], rules, max_rows: Optional[int]) -> Tuple[Problem, Dict[str, Any]]:
+    header_row = next(reader, None)
+    headers = [h.strip() for h in (header_row or [])]
+    missing = [h for h in columns.values() if h not in headers]
+    if missing:
+        raise CSVFormatError("missing columns: " + ", ".join(missing))
+    pos = {key: headers.index(h) for key, h in columns.items()}
+    ordered = list(columns.values())
+
+    parts: List[Problem] = []
+    chunk: List[List[str]] = []
+    errors: List[Dict[str, Any]] = []
+    preview: List[List[str]] = []
+    rows = accepted = rejected = error_count = 0
+
+    def flush() -> None:
+        if not chunk:
+            return
+        table = {"headers": ordered, "rows": chunk}
+        parts.append(Problem.from_tables(table, {}) if kind == "vehicles" else Problem.from_tables({}, table))
+        chunk.clear()
+
+    try:
+        for raw in reader:
+            if not any(c.strip() for c in raw):
+                continue  # blank line
+            rows += 1
+            if max_rows is not None and rows > max_rows:
+                raise CSVFormatError(f"more than {max_rows} rows")
+            if len(raw) > len(headers):
+                problems = [("*", f"{len(raw)} cells, header has {len(headers)}")]
+            else:
+                cells = {key: (raw[i].strip() if i < len(raw) else "") for key, i in pos.items()}
+                problems = _row_errors(kind, cells, rules)
+            if problems:
+                rejected += 1
+                error_count += len(problems)
+                for key, msg in problems:
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"line": reader.line_num, "column": columns.get(key, key), "message": msg})
+                continue
+            accepted += 1
+            row = [cells[key] for key in columns]
+            if len(preview) < PREVIEW_ROWS:
+                preview.append(row)
+            chunk.append(row)
+            if len(chunk) >= CHUNK_ROWS:
+                flush()
+    except csv.Error as e:
+        raise CSVFormatError(f"malformed CSV at line {reader.line_num}: {e}") from e
+    flush()
+
+    problem = Problem.concat(parts)
+    report = {
+        "rows": rows,
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors,
+        "errors_truncated": error_count > len(errors),
+        "headers": ordered,
+        "preview": preview,
+    }
+    return problem, report
@@ -0,0 +1,303 @@
+"""
+Geographic decomposition for large instances: split vehicles and shipments into regional
+sub-problems, solve them side by side and stitch the answers back into one result.
+
+Shipments are clustered on the midpoint of their pickup and delivery (k-means, or angular sectors
+around the depots for "sweep"); each cluster then gets a share of the fleet proportional to its
+shipments, nearest depots first. Local sub-solves are CPU-bound and independent, so they run in a
+process pool and wall time scales with cores rather than instance size.
+"""
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+from problem import Problem
+from utils import _mock_optimize
+from vrp_solver import repair_pdp, solve_pdp
+from zones import ZoneIndex
+
+T = TypeVar("T")
+
+METHODS = ("kmeans", "sweep")
+DEFAULT_TARGET_SHIPMENTS = 400
+# A shipment whose second-nearest cluster centre is within this factor of its own sits on a boundary
+_BOUNDARY_RATIO = 1.25
+
+
+def _xy(lat: np.ndarray, lng: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Equirectangular projection in degrees-of-latitude units; plenty for clustering."""
+    ok = ~(np.isnan(lat) | np.isnan(lng))
+    lat0 = math.radians(float(np.mean(lat[ok]))) if ok.any() else 0.0
+    return lng * math.cos(lat0), lat
+
+
+def _shipment_points(problem: Problem) -> Tuple[np.ndarray, np.ndarray]:
+    plat, plng, dlat, dlng = problem.pickup_lat, problem.pickup_lng, problem.delivery_lat, problem.delivery_lng
+    lat = np.where(np.isnan(plat), dlat, np.where(np.isnan(dlat), plat, (plat + dlat) / 2))
+    lng = np.where(np.isnan(plng), dlng, np.where(np.isnan(dlng), plng, (plng + dlng) / 2))
+    return lat, lng
+
+
+def _vehicle_points(problem: Problem) -> Tuple[np.ndarray, np.ndarray]:
+    start_ok = ~(np.isnan(problem.start_lat) | np.isnan(problem.start_lng))
+    return np.where(start_ok, problem.start_lat, problem.end_lat), np.where(start_ok, problem.start_lng, problem.end_lng)
+
+
+def _nearest_two(pts: np.ndarray, centers: np.ndarray, chunk: int = 4096) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(nearest centre, distance to it, distance to the second nearest) per point, in row chunks."""
+    n = len(pts)
+    label = np.empty(n, dtype=int)
+    d1 = np.empty(n)
+    d2 = np.full(n, np.inf)
+    c2 = (centers ** 2).sum(axis=1)
+    for lo in range(0, n, chunk):
+        p = pts[lo:lo + chunk]
+        d = np.maximum((p ** 2).sum(axis=1)[:, None] - 2 * p @ centers.T + c2[None, :], 0.0)
+        if centers.shape[0] > 1:
+            two = np.argpartition(d, 1, axis=1)[:, :2]
+            a, b = np.take_along_axis(d, two, axis=1).T
+            swap = b < a
+            label[lo:lo + chunk] = np.where(swap, two[:, 1], two[:, 0])
+            d1[lo:lo + chunk] = np.sqrt(np.minimum(a, b))
+            d2[lo:lo + chunk] = np.sqrt(np.maximum(a, b))
+        else:
+            label[lo:lo + chunk] = 0
+            d1[lo:lo + chunk] = np.sqrt(d[:, 0])
+    return label, d1, d2
+
+
+def _kmeans(pts: np.ndarray, k: int, *, iters: int = 25, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means with k-means++ seeding; returns one label per point."""
+    rng = np.random.default_rng(seed)
+    centers = [pts[rng.integers(len(pts))]]
+    d2 = ((pts - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = float(d2.sum())
+        nxt = pts[rng.choice(len(pts), p=d2 / total)] if total > 0 else pts[rng.integers(len(pts))]
+        centers.append(nxt)
+        d2 = np.minimum(d2, ((pts - nxt) ** 2).sum(axis=1))
+    c = np.array(centers)
+    labels = None
+    for _ in range(iters):
+        new = _nearest_two(pts, c)[0]
+        if labels is not None and np.array_equal(new, labels):
+            break
+        labels = new
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=pts[:, 0], minlength=k), np.bincount(labels, weights=pts[:, 1], minlength=k)], axis=1)
+        nonempty = counts > 0
+        c[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return labels
+
+
+def _sweep(x: np.ndarray, y: np.ndarray, k: int, cx: float, cy: float) -> np.ndarray:
+    """k angular sectors of equal size around (cx, cy), starting at the widest empty gap."""
+    ang = np.arctan2(y - cy, x - cx)
+    order = np.argsort(ang, kind="stable")
+    sorted_ang = ang[order]
+    gaps = np.diff(np.concatenate([sorted_ang, sorted_ang[:1] + 2 * math.pi]))
+    start = (int(np.argmax(gaps)) + 1) % len(order)
+    order = np.roll(order, -start)
+    labels = np.empty(len(order), dtype=int)
+    labels[order] = np.arange(len(order)) * k // len(order)
+    return labels
+
+
+def _quotas(sizes: Sequence[int], total: int) -> List[int]:
+    """Split `total` vehicles in proportion to cluster `sizes` (largest remainder, at least one each)."""
+    k = len(sizes)
+    n = max(1, sum(sizes))
+    base = [1] * k
+    spare = total - k
+    raw = [spare * s / n for s in sizes]
+    add = [int(r) for r in raw]
+    left = spare - sum(add)
+    for j in sorted(range(k), key=lambda j: raw[j] - add[j], reverse=True)[:left]:
+        add[j] += 1
+    return [b + a for b, a in zip(base, add)]
+
+
+def partition(problem: Problem, parts: int, method: str = "kmeans") -> Tuple[List[Tuple[List[int], List[int]]], List[int]]:
+    """
+    Split `problem` into at most `parts` regions as ([(vehicle rows, shipment rows)], boundary shipment
+    rows). Every vehicle and shipment lands in exactly one region; shipments without coordinates go
+    to the first one. Fewer regions come back if there are fewer vehicles or located shipments.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown decomposition method {method!r}; expected one of {', '.join(METHODS)}")
+    s_lat, s_lng = _shipment_points(problem)
+    v_lat, v_lng = _vehicle_points(problem)
+    located = np.flatnonzero(~(np.isnan(s_lat) | np.isnan(s_lng)))
+    k = max(1, min(int(parts), problem.n_vehicles, len(located)))
+    if k == 1:
+        return [(list(range(problem.n_vehicles)), list(range(problem.n_shipments)))], []
+
+    sx, sy = _xy(s_lat, s_lng)
+    vx, vy = _xy(v_lat, v_lng)
+    if method == "sweep":
+        v_ok = ~(np.isnan(vx) | np.isnan(vy))
+        cx, cy = (float(np.mean(vx[v_ok])), float(np.mean(vy[v_ok]))) if v_ok.any() else (float(np.mean(sx[located])), float(np.mean(sy[located])))
+        labels = _sweep(sx[located], sy[located], k, cx, cy)
+    else:
+        labels = _kmeans(np.stack([sx[located], sy[located]], axis=1), k)
+    # Empty clusters (k-means on duplicate points) are dropped by relabelling
+    used = np.unique(labels)
+    labels = np.searchsorted(used, labels)
+    k = len(used)
+    pts = np.stack([sx[located], sy[located]], axis=1)
+    counts = np.bincount(labels, minlength=k)
+    centers = np.stack([np.bincount(labels, weights=pts[:, 0], minlength=k), np.bincount(labels, weights=pts[:, 1], minlength=k)], axis=1) / counts[:, None]
+
+    # Fleet share per region, nearest depots first; vehicles without coordinates fill what's left
+    quota = _quotas(counts.tolist(), problem.n_vehicles)
+    vd = np.hypot(vx[:, None] - centers[None, :, 0], vy[:, None] - centers[None, :, 1])
+    vd = np.nan_to_num(vd, nan=np.inf)
+    v_label = np.full(problem.n_vehicles, -1)
+    for flat in np.argsort(vd, axis=None, kind="stable").tolist():
+        v, j = divmod(flat, k)
+        if v_label[v] < 0 and quota[j] > 0:
+            v_label[v] = j
+            quota[j] -= 1
+
+    s_label = np.zeros(problem.n_shipments, dtype=int)
+    s_label[located] = labels
+    regions = [(np.flatnonzero(v_label == j).tolist(), np.flatnonzero(s_label == j).tolist()) for j in range(k)]
+
+    _, d1, d2 = _nearest_two(pts, centers)
+    boundary = located[d2 <= _BOUNDARY_RATIO * d1].tolist()
+    return regions, boundary
+
+
+def solve_part(
+    problem: Problem,
+    options: Dict[str, Any],
+    zone_index: Optional[ZoneIndex],
+    solver: str,
+    matrix: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Dict[str, Any]:
+    """One region with the local engine (or the mock); module-level so a process pool can run it."""
+    if solver == "mock":
+        return _mock_optimize(problem)
+    return solve_pdp(problem, options, zone_index, matrix)
+
+
+def repair_boundaries(
+    problem: Problem,
+    routes: List[List[int]],
+    pending: List[int],
+    touched: List[int],
+    options: Dict[str, Any],
+    zone_index: Optional[ZoneIndex],
+) -> Dict[str, Any]:
+    """repair_pdp over the stitched plan, returning just its result (for the process pool)."""
+    return repair_pdp(problem, routes, pending, touched, options, zone_index)[0]
+
+
+def stitch(problem: Problem, regions: Sequence[Tuple[List[int], List[int]]], results: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    One result from per-region results: assignments back in input vehicle order (matched by position
+    within the region, or by vehicle_id when a region's result doesn't have one per vehicle), unassigned
+    lists concatenated and summary totals summed. Other top-level keys come from the first region that
+    has them.
+    """
+    by_vehicle: Dict[int, Dict[str, Any]] = {}
+    extra: List[Dict[str, Any]] = []
+    unassigned: List[Any] = []
+    summary: Dict[str, Any] = {}
+    out: Dict[str, Any] = {}
+    for (vehicles, _), res in zip(regions, results):
+        assignments = res.get("assignments") or []
+        for k, a in enumerate(assignments):
+            v = vehicles[k] if len(assignments) == len(vehicles) else problem.vehicle_position(a.get("vehicle_id"))
+            if v is None:
+                extra.append(a)
+            else:
+                by_vehicle[v] = a
+        unassigned.extend(res.get("unassigned") or [])
+        for key, value in (res.get("summary") or {}).items():
+            if key in ("total_distance_km", "total_time_min", "unassigned") and isinstance(value, (int, float)):
+                summary[key] = summary.get(key, 0) + value
+            elif key not in ("spatial_index", "solve_ms"):
+                summary.setdefault(key, value)
+        for key, value in res.items():
+            if key not in ("assignments", "unassigned", "summary"):
+                out.setdefault(key, value)
+    if "total_distance_km" in summary:
+        summary["total_distance_km"] = round(summary["total_distance_km"], 3)
+    out["summary"] = summary
+    out["assignments"] = [by_vehicle[v] for v in sorted(by_vehicle)] + extra
+    if unassigned or any("unassigned" in r for r in results):
+        out["unassigned"] = unassigned
+        summary["unassigned"] = len(unassigned)
+    return out
+
+
+_default_pool: Optional[ProcessPoolExecutor] = None
+_default_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Process-wide pool for region solves, sized by env DECOMPOSE_WORKERS (CPU count). Workers are
+    spawned rather than forked, since the server process runs threads and event loops.
+    """
+    global _default_pool
+    if _default_pool is None:
+        with _default_lock:
+            if _default_pool is None:
+                workers = int(os.getenv("DECOMPOSE_WORKERS") or os.cpu_count() or 1)
+                _default_pool = ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context("spawn"))
+    return _default_pool
+
+
+def shutdown_process_pool() -> None:
+    global _default_pool
+    with _default_lock:
+        pool, _default_pool = _default_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_pool(fn: Callable[..., T], *args) -> T:
+    """
+    fn(*args) in the process pool. If the pool has broken (a worker died, e.g. out of memory) it is
+    replaced for later calls and this one runs in a worker thread instead.
+    """
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_process_pool(), fn, *args)
+    except BrokenProcessPool:
+        shutdown_process_pool()
+        return await asyncio.to_thread(fn, *args)
+
+
+def decomposition_settings(options: Dict[str, Any], n_shipments: int) -> Optional[Dict[str, Any]]:
+    """
+    Resolved decomposition settings, or None to solve in one piece.
+
+    options.decompose: true or {parts?, method?: 'kmeans'|'sweep', repair?: bool (true),
+    target_shipments?: int}; false turns it off. Without the option, instances with at least env
+    DECOMPOSE_MIN_SHIPMENTS shipments (unset: never) are decomposed with the defaults. `parts`
+    defaults to one region per `target_shipments` (env DECOMPOSE_TARGET_SHIPMENTS, 400).
+    """
+    raw = options.get("decompose")
+    if raw is None:
+        threshold = int(os.getenv("DECOMPOSE_MIN_SHIPMENTS") or 0)
+        raw = bool(threshold) and n_shipments >= threshold
+    if raw is False or raw is None:
+        return None
+    cfg = raw if isinstance(raw, dict) else {}
+    method = str(cfg.get("method") or "kmeans").lower()
+    if method not in METHODS:
+        raise ValueError(f"Unknown decomposition method {method!r}; expected one of {', '.join(METHODS)}")
+    target = int(cfg.get("target_shipments") or os.getenv("DECOMPOSE_TARGET_SHIPMENTS") or DEFAULT_TARGET_SHIPMENTS)
+    parts = int(cfg.get("parts") or math.ceil(n_shipments / max(1, target)))
+    if parts < 2:
+        return None
+    return {"parts": parts, "method": method, "repair": cfg.get("repair", True) is not False}
@@ -0,0 +1,157 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "geocode.sqlite"
+)
+
+_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_address(address: str, country: Optional[str] = None) -> str:
+    """
+    Canonical cache key for an address: lower-cased, punctuation stripped, whitespace collapsed,
+    prefixed with the upper-cased country filter (results differ per countrySet).
+    """
+    text = _PUNCT_RE.sub(" ", (address or "").lower())
+    text = _SPACE_RE.sub(" ", text).strip()
+    return f"{(country or '').strip().upper()}|{text}"
+
+
+class GeocodeCache:
+    """
+    SQLite-backed geocode cache with TTL expiry and size-bounded LRU eviction.
+
+    Positive results live for `ttl_s`; "no match" results are cached separately for the shorter
+    `negative_ttl_s`. Transport errors are never cached. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        *,
+        ttl_s: float = 30 * 24 * 3600,
+        negative_ttl_s: float = 24 * 3600,
+        max_entries: int = 100_000,
+    ):
+        self.path = path
+        self.ttl_s = float(ttl_s)
+        self.negative_ttl_s = float(negative_ttl_s)
+        self.max_entries = max(1, int(max_entries))
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            " key TEXT PRIMARY KEY, lat REAL, lng REAL, negative INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS geocode_accessed ON geocode(accessed)")
+        self._size = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def lookup(self, address: str, country: Optional[str] = None) -> Tuple[bool, Optional[Tuple[float, float]]]:
+        """Return (found, coords). found=True with coords=None is a cached negative result."""
+        key = normalize_address(address, country)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lng, negative, created FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            lat, lng, negative, created = row
+            ttl = self.negative_ttl_s if negative else self.ttl_s
+            if now - created > ttl:
+                self._conn.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                self._size -= 1
+                self.expired += 1
+                self.misses += 1
+                return False, None
+            self._conn.execute("UPDATE geocode SET accessed = ? WHERE key = ?", (now, key))
+            if negative:
+                self.negative_hits += 1
+                return True, None
+            self.hits += 1
+            return True, (float(lat), float(lng))
+
+    def store(self, address: str, country: Optional[str], coords: Optional[Tuple[float, float]]) -> None:
+        key = normalize_address(address, country)
+        now = time.time()
+        lat, lng = coords if coords else (None, None)
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM geocode WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lng, negative, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, lat, lng, 0 if coords else 1, now, now),
+            )
+            if not exists:
+                self._size += 1
+            excess = self._size - self.max_entries
+            if excess > 0:
+                # Least recently accessed entries go first
+                self._conn.execute(
+                    "DELETE FROM geocode WHERE key IN"
+                    " (SELECT key FROM geocode ORDER BY accessed ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._size -= excess
+                self.evictions += excess
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM geocode")
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+_default_cache: Optional[GeocodeCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[GeocodeCache]:
+    """
+    Process-wide cache configured from env:
+    GEOCODE_CACHE_PATH, GEOCODE_CACHE_TTL_S, GEOCODE_CACHE_NEGATIVE_TTL_S, GEOCODE_CACHE_MAX_ENTRIES.
+    Set GEOCODE_CACHE_DISABLED=1 to bypass caching entirely.
+    """
+    global _default_cache
+    if os.getenv("GEOCODE_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = GeocodeCache(
+                    os.getenv("GEOCODE_CACHE_PATH") or DEFAULT_CACHE_PATH,
+                    ttl_s=float(os.getenv("GEOCODE_CACHE_TTL_S") or 30 * 24 * 3600),
+                    negative_ttl_s=float(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL_S") or 24 * 3600),
+                    max_entries=int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES") or 100_000),
+                )
+    return _default_cache
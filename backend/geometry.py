@@ -0,0 +1,148 @@
+"""
+Route geometry post-processing for optimize responses: Douglas-Peucker simplification and
+Google encoded-polyline output.
+
+Route coordinate lists may share their [lon, lat] pairs with the TomTom segment cache, so nothing
+here mutates its input; shaped routes are always new lists.
+"""
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_EARTH_R_M = 6_371_000.0
+# Web-mercator ground resolution at zoom 0 on the equator, metres per 256px-tile pixel
+_M_PER_PX_Z0 = 2 * math.pi * 6_378_137.0 / 256
+
+FORMATS = ("geojson", "polyline")
+DEFAULT_TOLERANCE_PX = 1.0
+
+
+def tolerance_for_zoom(zoom: float, lat: float, tolerance_px: float = DEFAULT_TOLERANCE_PX) -> float:
+    """Ground distance (m) covered by `tolerance_px` screen pixels at map `zoom` and latitude `lat`."""
+    return tolerance_px * _M_PER_PX_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+# Below this many interior points a plain loop beats NumPy's per-call overhead
+_SMALL_SPAN = 48
+
+
+def _farthest(x: np.ndarray, y: np.ndarray, xs: List[float], ys: List[float], i: int, j: int):
+    """(index, distance in m) of the point in (i, j) farthest from the segment i-j."""
+    dx, dy = xs[j] - xs[i], ys[j] - ys[i]
+    seg2 = dx * dx + dy * dy
+    # Distance to the segment, not the infinite line, so back-tracking detours survive
+    if j - i <= _SMALL_SPAN:
+        x0, y0 = xs[i], ys[i]
+        best, best_d2 = i + 1, -1.0
+        for k in range(i + 1, j):
+            px, py = xs[k] - x0, ys[k] - y0
+            t = 0.0 if seg2 == 0.0 else min(1.0, max(0.0, (px * dx + py * dy) / seg2))
+            ex, ey = px - t * dx, py - t * dy
+            d2 = ex * ex + ey * ey
+            if d2 > best_d2:
+                best, best_d2 = k, d2
+        return best, math.sqrt(best_d2)
+    px, py = x[i + 1:j] - xs[i], y[i + 1:j] - ys[i]
+    t = np.zeros_like(px) if seg2 == 0.0 else np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+    d2 = (px - t * dx) ** 2 + (py - t * dy) ** 2
+    k = int(np.argmax(d2))
+    return i + 1 + k, math.sqrt(float(d2[k]))
+
+
+def simplify(coords: Sequence[Sequence[float]], tolerance_m: float) -> List[List[float]]:
+    """
+    Douglas-Peucker over [lon, lat] points: keep the fewest points such that no dropped point lies
+    more than `tolerance_m` from the kept polyline. Endpoints are always kept.
+    """
+    n = len(coords)
+    if n < 3 or tolerance_m <= 0:
+        return [list(c) for c in coords]
+    pts = np.asarray(coords, dtype=float)
+    # Local equirectangular projection; error is negligible over a single route
+    lat0 = math.radians(float(np.mean(pts[:, 1])))
+    x = np.radians(pts[:, 0]) * math.cos(lat0) * _EARTH_R_M
+    y = np.radians(pts[:, 1]) * _EARTH_R_M
+
+    xs, ys = x.tolist(), y.tolist()
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        m, dmax = _farthest(x, y, xs, ys, i, j)
+        if dmax > tolerance_m:
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return [list(coords[k]) for k in np.flatnonzero(keep)]
+
+
+def encode_polyline(coords: Sequence[Sequence[float]], precision: int = 5) -> str:
+    """Google encoded-polyline string for [lon, lat] points (encoded in the format's lat,lng order)."""
+    if not len(coords):
+        return ""
+    pts = np.asarray(coords, dtype=float)[:, ::-1]
+    scaled = np.round(pts * (10 ** precision)).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    out: List[str] = []
+    for v in deltas.tolist():
+        v = ~(v << 1) if v < 0 else v << 1
+        while v >= 0x20:
+            out.append(chr((0x20 | (v & 0x1F)) + 63))
+            v >>= 5
+        out.append(chr(v + 63))
+    return "".join(out)
+
+
+def shape_route(route: Optional[Dict[str, Any]], geometry: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], int, int]:
+    """
+    One route shaped per options.geometry (see shape_routes) as (new route, points in, points out).
+    Anything but a non-empty LineString is returned as-is with zero counts.
+    """
+    coords = (route or {}).get("coordinates")
+    if (route or {}).get("type") != "LineString" or not coords:
+        return route, 0, 0
+    fmt = str(geometry.get("format") or "geojson").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown geometry format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    tolerance_m = geometry.get("tolerance_m")
+    zoom = geometry.get("zoom")
+    if tolerance_m is not None:
+        shaped = simplify(coords, float(tolerance_m))
+    elif zoom is not None:
+        tolerance_px = float(geometry.get("tolerance_px") or DEFAULT_TOLERANCE_PX)
+        shaped = simplify(coords, tolerance_for_zoom(float(zoom), coords[len(coords) // 2][1], tolerance_px))
+    else:
+        shaped = coords
+    if fmt == "polyline":
+        precision = int(geometry.get("precision") or 5)
+        return {"type": "EncodedPolyline", "polyline": encode_polyline(shaped, precision), "precision": precision}, len(coords), len(shaped)
+    return {"type": "LineString", "coordinates": shaped}, len(coords), len(shaped)
+
+
+def shape_routes(result: Dict[str, Any], geometry: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Apply options.geometry to every assignment's route in place:
+      - zoom / tolerance_px: simplify to `tolerance_px` (default 1) pixels at that map zoom, or
+      - tolerance_m: simplify to a fixed ground tolerance (takes precedence over zoom)
+      - format: "geojson" (default, LineString) or "polyline"
+        ({type: "EncodedPolyline", polyline, precision}, precision from `precision`, default 5)
+    Adds summary.geometry with point counts. Without options the result is returned untouched.
+    """
+    if not geometry:
+        return result
+    fmt = str(geometry.get("format") or "geojson").lower()
+    points_in = points_out = 0
+    for a in result.get("assignments") or []:
+        if a.get("route") is None:
+            continue
+        a["route"], n_in, n_out = shape_route(a["route"], geometry)
+        points_in += n_in
+        points_out += n_out
+
+    if isinstance(result.get("summary"), dict):
+        result["summary"]["geometry"] = {"format": fmt, "points_in": points_in, "points_out": points_out}
+    return result
@@ -0,0 +1,457 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from metrics import PROVIDER_HEDGES, PROVIDER_REJECTED, PROVIDER_RETRIES
+
+T = TypeVar("T")
+
+# httpx logs every request URL at INFO, which would leak provider keys passed as query params
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class ProviderHTTPError(Exception):
+    """Provider answered with a non-2xx status."""
+
+    def __init__(self, provider: str, status_code: int, body: str, retry_after: Optional[str] = None):
+        super().__init__(f"{provider} HTTP {status_code}: {body[:500]}")
+        self.provider = provider
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+
+class ProviderTransportError(Exception):
+    """Connection, timeout or decode failure talking to a provider."""
+    pass
+
+
+class ProviderUnavailable(ProviderTransportError):
+    """The provider's circuit breaker is open, so the call was not attempted."""
+    pass
+
+
+# Per-provider concurrency defaults; override with <PROVIDER>_CONCURRENCY (e.g. TOMTOM_CONCURRENCY)
+_DEFAULT_CONCURRENCY = {"tomtom": 16, "nextbillion": 4}
+
+# Provider hosts; override with <PROVIDER>_BASE_URL (e.g. to point at provider_stubs.py)
+_DEFAULT_BASE_URL = {"tomtom": "https://api.tomtom.com", "nextbillion": "https://api.nextbillion.io"}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _setting(provider: str, name: str, default: float) -> float:
+    """<PROVIDER>_<NAME>, else PROVIDER_<NAME>, else `default` (e.g. TOMTOM_RETRIES, PROVIDER_RETRIES)."""
+    for var in (f"{provider.upper()}_{name}", f"PROVIDER_{name}"):
+        try:
+            raw = os.getenv(var, "")
+            if raw:
+                return float(raw)
+        except ValueError:
+            pass
+    return default
+
+
+# HTTP statuses worth another attempt; anything else below 500 is the caller's problem, not the provider's
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker for one provider, shared by every event loop. After BREAKER_FAILURES
+    (5) failures in a row it opens and calls fail at once; after BREAKER_COOLDOWN_S (30) one probe is
+    let through (half-open), which closes it on success or reopens it for twice as long on failure.
+    A probe that is cancelled hands the slot back (release_probe); one that never reports within
+    BREAKER_PROBE_TIMEOUT_S (120) counts as a failure, so a lost probe can't hold it half-open.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        *,
+        failures: int = 5,
+        cooldown_s: float = 30.0,
+        max_cooldown_s: float = 300.0,
+        probe_timeout_s: float = 120.0,
+    ):
+        self.provider = provider
+        self.failures = max(1, int(failures))
+        self.cooldown_s = float(cooldown_s)
+        self.max_cooldown_s = max(float(max_cooldown_s), self.cooldown_s)
+        self.probe_timeout_s = float(probe_timeout_s)
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened = 0
+        self._open_until = 0.0
+        self._current_cooldown = self.cooldown_s
+        self._probing = False
+        self._probe_deadline = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "half_open" and self._probing and now >= self._probe_deadline:
+                self._reopen()  # the probe never reported back
+            if self.state == "open" and now >= self._open_until:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                self._probe_deadline = now + self.probe_timeout_s
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """Give the half-open slot back after a call that ended without an outcome (e.g. cancelled)."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.consecutive = 0
+            self._probing = False
+            self._current_cooldown = self.cooldown_s
+
+    def failure(self) -> None:
+        with self._lock:
+            if self.state == "open":
+                return  # calls that started before it opened
+            self.consecutive += 1
+            if self.state == "half_open":
+                self._reopen()
+            elif self.state == "closed" and self.consecutive >= self.failures:
+                self._trip()
+
+    def _reopen(self) -> None:
+        self._current_cooldown = min(self._current_cooldown * 2, self.max_cooldown_s)
+        self._trip()
+
+    def _trip(self) -> None:
+        self.state = "open"
+        self.opened += 1
+        self._probing = False
+        self._open_until = time.monotonic() + self._current_cooldown
+        logging.getLogger("optimizer").warning(
+            "%s circuit open for %.0fs after %d failures", self.provider, self._current_cooldown, self.consecutive,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive,
+                "opened": self.opened,
+                "retry_in_s": round(max(0.0, self._open_until - time.monotonic()), 1) if self.state == "open" else 0.0,
+            }
+
+
+class LatencyTracker:
+    """Recent call latencies (seconds) for one provider operation, for adaptive timeouts and hedging."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=max(1, int(window)))
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latency: Dict[Tuple[str, str], LatencyTracker] = {}
+_state_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """
+    Process-wide breaker for `provider`, sized from <PROVIDER>_/PROVIDER_ BREAKER_FAILURES,
+    BREAKER_COOLDOWN_S and BREAKER_PROBE_TIMEOUT_S.
+    """
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _state_lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                breaker = _breakers[provider] = CircuitBreaker(
+                    provider,
+                    failures=int(_setting(provider, "BREAKER_FAILURES", 5)),
+                    cooldown_s=_setting(provider, "BREAKER_COOLDOWN_S", 30.0),
+                    probe_timeout_s=_setting(provider, "BREAKER_PROBE_TIMEOUT_S", 120.0),
+                )
+    return breaker
+
+
+def _tracker(provider: str, op: str) -> LatencyTracker:
+    key = (provider, op)
+    tracker = _latency.get(key)
+    if tracker is None:
+        with _state_lock:
+            tracker = _latency.setdefault(key, LatencyTracker())
+    return tracker
+
+
+def provider_health() -> Dict[str, Any]:
+    """Breaker state per provider plus p50/p95/p99 latency (ms) per operation, for the health endpoint."""
+    out: Dict[str, Any] = {p: {"breaker": b.stats(), "latency_ms": {}} for p, b in sorted(_breakers.items())}
+    for (provider, op), tracker in sorted(_latency.items()):
+        entry = out.setdefault(provider, {"breaker": get_breaker(provider).stats(), "latency_ms": {}})
+        entry["latency_ms"][op] = {
+            "samples": len(tracker),
+            **{f"p{int(q * 100)}": round((tracker.percentile(q) or 0.0) * 1000, 1) for q in (0.5, 0.95, 0.99)},
+        }
+    return out
+
+
+class ProviderClient:
+    """
+    Async JSON client for one provider host: a keep-alive connection pool plus a semaphore
+    capping in-flight requests. Instances are bound to the event loop that created them.
+
+    Every request goes through the provider's CircuitBreaker and is retried on transport errors,
+    429 and 5xx with jittered exponential backoff, all within the caller's `timeout`. Once an
+    operation has MIN_SAMPLES latencies, each attempt is cut off at TIMEOUT_MULTIPLIER x its p99
+    (never below TIMEOUT_FLOOR_S), and with HEDGE=1 a GET still running after its p95 gets a duplicate.
+    Settings are read as <PROVIDER>_<NAME> or PROVIDER_<NAME>.
+    """
+
+    MIN_SAMPLES = 20
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        keepalive_expiry: float = 30.0,
+        concurrency: int = 16,
+    ):
+        self.name = name
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            follow_redirects=True,
+        )
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self.in_flight = 0
+
+    async def _attempt(self, method: str, url: str, kwargs: Dict[str, Any], timeout: float, tracker: LatencyTracker) -> Any:
+        """One HTTP exchange; feeds the breaker (provider faults only) and the latency window."""
+        breaker = get_breaker(self.name)
+        async with self._sem:
+            # Checked once a slot is free, so calls queued before the breaker opened don't go out either
+            if not breaker.allow():
+                PROVIDER_REJECTED.inc(provider=self.name)
+                raise ProviderUnavailable(f"{self.name} circuit open; failing fast")
+            self.in_flight += 1
+            t0 = time.perf_counter()  # after the semaphore: queueing behind our own calls isn't provider latency
+            try:
+                resp = await self._client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TimeoutException as e:
+                tracker.add(timeout)  # censored sample: pushes the percentiles up while the provider is slow
+                breaker.failure()
+                raise ProviderTransportError(f"{self.name} timed out after {timeout:.1f}s") from e
+            except httpx.HTTPError as e:
+                breaker.failure()
+                raise ProviderTransportError(f"{self.name} transport error: {e!r}") from e
+            except BaseException:
+                breaker.release_probe()  # cancelled (caller timeout, disconnect, hedge loser): no verdict
+                raise
+            finally:
+                self.in_flight -= 1
+        tracker.add(time.perf_counter() - t0)
+        if resp.status_code in _RETRY_STATUSES:
+            breaker.failure()
+        else:
+            breaker.success()
+        if resp.status_code >= 400:
+            raise ProviderHTTPError(self.name, resp.status_code, resp.text, resp.headers.get("Retry-After"))
+        try:
+            return resp.json()
+        except ValueError as e:
+            raise ProviderTransportError(f"{self.name} returned invalid JSON") from e
+
+    async def _hedged(self, call: Callable[[], Awaitable[Any]], delay: float) -> Any:
+        """Run `call`; if it hasn't finished after `delay`, race a duplicate and keep the first success."""
+        first = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(call())
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        PROVIDER_HEDGES.inc(provider=self.name, winner="hedge" if task is second else "primary")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def request_json(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json_body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 15.0,
+        op: str = "call",
+        retries: Optional[int] = None,
+        hedge: Optional[bool] = None,
+    ) -> Any:
+        """
+        JSON response of one logical call. `timeout` bounds all attempts together; `op` names the
+        operation whose latency history sets per-attempt timeouts (e.g. "segment", "matrix").
+        Raises ProviderUnavailable without calling out while the breaker is open.
+        """
+        name = self.name
+        kwargs = {"params": params, "json": json_body, "headers": headers}
+        tracker = _tracker(name, op)
+        if retries is None:
+            retries = int(_setting(name, "RETRIES", 2))
+        if hedge is None:
+            hedge = method == "GET" and _setting(name, "HEDGE", 0) > 0
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            attempt_timeout = remaining
+            warm = len(tracker) >= self.MIN_SAMPLES
+            if warm:
+                p99 = tracker.percentile(0.99) or 0.0
+                attempt_timeout = min(remaining, max(_setting(name, "TIMEOUT_FLOOR_S", 2.0), p99 * _setting(name, "TIMEOUT_MULTIPLIER", 4.0)))
+            call = lambda: self._attempt(method, url, kwargs, attempt_timeout, tracker)
+            try:
+                if hedge and warm:
+                    return await self._hedged(call, max(0.05, tracker.percentile(0.95) or 0.0))
+                return await call()
+            except ProviderUnavailable:
+                raise
+            except (ProviderHTTPError, ProviderTransportError) as e:
+                status = e.status_code if isinstance(e, ProviderHTTPError) else None
+                if attempt >= retries or (status is not None and status not in _RETRY_STATUSES):
+                    raise
+                delay = random.uniform(0, min(_setting(name, "BACKOFF_MAX_S", 2.0), _setting(name, "BACKOFF_BASE_S", 0.2) * 2 ** attempt))
+                retry_after = e.retry_after if isinstance(e, ProviderHTTPError) else None
+                if retry_after:
+                    try:
+                        delay = max(delay, min(float(retry_after), _setting(name, "BACKOFF_MAX_S", 2.0)))
+                    except ValueError:
+                        pass
+                # Not worth another attempt if it couldn't get a reasonable slice of the budget
+                if deadline - time.monotonic() - delay < min(1.0, timeout / 4):
+                    raise
+                attempt += 1
+                PROVIDER_RETRIES.inc(provider=name, op=op)
+                await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        return await self.request_json("GET", url, **kwargs)
+
+    async def post_json(self, url: str, body: Any, **kwargs) -> Any:
+        return await self.request_json("POST", url, json_body=body, **kwargs)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+def provider_url(provider: str, path: str) -> str:
+    """`path` on the provider's host, read from <PROVIDER>_BASE_URL at call time."""
+    base = os.getenv(f"{provider.upper()}_BASE_URL") or _DEFAULT_BASE_URL[provider]
+    return base.rstrip("/") + path
+
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, ProviderClient]]" = weakref.WeakKeyDictionary()
+
+
+def get_client(provider: str) -> ProviderClient:
+    """
+    Pooled client for `provider` ("tomtom", "nextbillion") on the running event loop.
+
+    Pool sizes come from PROVIDER_MAX_CONNECTIONS (20), PROVIDER_MAX_KEEPALIVE (10) and
+    PROVIDER_KEEPALIVE_EXPIRY_S (30); concurrency from <PROVIDER>_CONCURRENCY.
+    """
+    loop = asyncio.get_running_loop()
+    per_loop = _clients.setdefault(loop, {})
+    client = per_loop.get(provider)
+    if client is None:
+        client = ProviderClient(
+            provider,
+            max_connections=_env_int("PROVIDER_MAX_CONNECTIONS", 20),
+            max_keepalive=_env_int("PROVIDER_MAX_KEEPALIVE", 10),
+            keepalive_expiry=float(_env_int("PROVIDER_KEEPALIVE_EXPIRY_S", 30)),
+            concurrency=_env_int(f"{provider.upper()}_CONCURRENCY", _DEFAULT_CONCURRENCY.get(provider, 8)),
+        )
+        per_loop[provider] = client
+    return client
+
+
+async def aclose_clients() -> None:
+    """Close the pools opened on the running loop (call on app shutdown)."""
+    per_loop = _clients.pop(asyncio.get_running_loop(), {})
+    for client in per_loop.values():
+        await client.aclose()
+
+
+# Sync callers (thread pools, CLI scripts) share one background loop so they reuse the same pools
+_bg_loop: Optional[asyncio.AbstractEventLoop] = None
+_bg_thread: Optional[threading.Thread] = None
+_bg_lock = threading.Lock()
+
+
+def _provider_loop() -> asyncio.AbstractEventLoop:
+    global _bg_loop, _bg_thread
+    if _bg_loop is None:
+        with _bg_lock:
+            if _bg_loop is None:
+                loop = asyncio.new_event_loop()
+                _bg_thread = threading.Thread(target=loop.run_forever, name="provider-io", daemon=True)
+                _bg_thread.start()
+                _bg_loop = loop
+    return _bg_loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """Run a provider coroutine from blocking code on the shared background loop and wait for it."""
+    loop = _provider_loop()
+    if threading.current_thread() is _bg_thread:
+        coro.close()
+        raise RuntimeError("run_sync() called from the provider loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+ProgressFn = Callable[[str, Dict[str, Any]], None]
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already queued or running."""
+    pass
+
+
+class Job:
+    """One background optimization: status, ordered progress events and the final result."""
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.status = "queued"  # queued | running | succeeded | failed
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        # (loop, event) per waiting stream; set from worker threads via call_soon_threadsafe
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def emit(self, stage: str, data: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            self._append(stage, data)
+            self._wake_locked()
+
+    def finish(self, status: str, stage: str, data: Optional[Dict[str, Any]] = None) -> None:
+        """Append the terminal event and set the final status atomically, so `done` implies the event is visible."""
+        with self._lock:
+            self._append(stage, data)
+            self.status = status
+            self._wake_locked()
+
+    def _append(self, stage: str, data: Optional[Dict[str, Any]]) -> None:
+        self.events.append({"seq": len(self.events), "stage": stage, "ts": round(time.time(), 3), **(data or {})})
+
+    def _wake_locked(self) -> None:
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # that stream's loop is closed
+
+    async def wait_events(self, since: int, timeout: float) -> List[Dict[str, Any]]:
+        """Wait on the caller's loop (no thread held) until events newer than `since` exist or `timeout` passes; return them."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if len(self.events) > since or self.done:
+                return self.events[since:]
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+        with self._lock:
+            return self.events[since:]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "error": self.error,
+                "progress": self.events[-1] if self.events else None,
+            }
+
+
+class JobManager:
+    """
+    Runs submitted callables on a bounded thread pool and keeps their results for `result_ttl_s`
+    after completion. `max_pending` caps queued + running jobs so a burst can't grow memory unbounded.
+    """
+
+    def __init__(self, *, workers: int = 2, result_ttl_s: float = 3600, max_pending: int = 100):
+        self.result_ttl_s = float(result_ttl_s)
+        self.max_pending = max(1, int(max_pending))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="optimize-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[[ProgressFn], Dict[str, Any]]) -> Job:
+        """Queue `fn(progress)`; `progress(stage, data)` appends an event visible to pollers and streams."""
+        self._expire()
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if not j.done)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"{pending} optimization jobs already pending")
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.id] = job
+        job.emit("queued")
+        self._pool.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, fn: Callable[[ProgressFn], Dict[str, Any]]) -> None:
+        job.started = time.time()
+        job.status = "running"
+        job.emit("running")
+        try:
+            result = fn(job.emit)
+        except Exception as e:
+            job.error = str(e)
+            job.finished = time.time()
+            job.finish("failed", "failed", {"error": job.error})
+            return
+        job.result = result
+        job.finished = time.time()
+        job.finish("succeeded", "done", {"elapsed_ms": int((job.finished - job.started) * 1000)})
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.result_ttl_s
+        with self._lock:
+            stale = [jid for jid, j in self._jobs.items() if j.done and (j.finished or 0) < cutoff]
+            for jid in stale:
+                del self._jobs[jid]
@@ -1,21 +1,46 @@
-import json
+import asyncio
 import os
+import threading
 import time
 import urllib.parse
-import urllib.request
 from typing import Optional, Tuple, List, Dict, Any
+from geocode_cache import get_default_cache
+from http_client import get_client, provider_url, run_sync, ProviderHTTPError, ProviderTransportError
+
+# TomTom's synchronous batch endpoint accepts at most 100 items per call
+TOMTOM_BATCH_MAX_ITEMS = 100
 
 class GeocodeError(Exception):
     """Raised for transport or parse errors talking to TomTom."""
     pass
 
 
+def _resolve_key(api_key: Optional[str]) -> str:
+    key = api_key or os.getenv("TOMTOM_API_KEY") or "kKgEbu6mJhXR5MFTfMCoREBnvdgZb0qE"
+    if not key:
+        raise GeocodeError("TOMTOM_API_KEY not configured")
+    return key
+
+
 def coordinates(
     address: str,
     *,
     country: Optional[str] = None,
     api_key: Optional[str] = None,
-    timeout: float = 10.0
+    timeout: float = 10.0,
+    use_cache: bool = True,
+) -> Optional[Tuple[float, float]]:
+    """Blocking wrapper around coordinates_async."""
+    return run_sync(coordinates_async(address, country=country, api_key=api_key, timeout=timeout, use_cache=use_cache))
+
+
+async def coordinates_async(
+    address: str,
+    *,
+    country: Optional[str] = None,
+    api_key: Optional[str] = None,
+    timeout: float = 10.0,
+    use_cache: bool = True,
 ) -> Optional[Tuple[float, float]]:
     """
     Convert a free-text address into (latitude, longitude) using TomTom Search API.
@@ -25,6 +50,7 @@ def coordinates(
         country: Optional ISO 3166-1 alpha-2 country filter (e.g., "IN", "US").
         api_key: TomTom API key. Defaults to env var TOMTOM_API_KEY.
         timeout: Request timeout in seconds.
+        use_cache: Consult and fill the on-disk geocode cache (see geocode_cache).
 
     Returns:
         (lat, lng) as floats if a result is found; otherwise None.
@@ -39,28 +65,33 @@ def coordinates(
     if not address:
         return None
 
-    key = api_key or os.getenv("TOMTOM_API_KEY") or "kKgEbu6mJhXR5MFTfMCoREBnvdgZb0qE"
-    if not key:
-        raise GeocodeError("TOMTOM_API_KEY not configured")
+    cache = get_default_cache() if use_cache else None
+    if cache is not None:
+        found, cached = cache.lookup(address, country)
+        if found:
+            return cached
 
-    base = (
-        "https://api.tomtom.com/search/2/geocode/"
-        + urllib.parse.quote(address)
-        + ".json"
-    )
+    key = _resolve_key(api_key)
+
+    base = provider_url("tomtom", "/search/2/geocode/" + urllib.parse.quote(address) + ".json")
     params = {"key": key, "limit": 1}
     if country:
         params["countrySet"] = country.strip()
     url = base + "?" + urllib.parse.urlencode(params)
 
     try:
-        with urllib.request.urlopen(url, timeout=timeout) as resp:
-            body = resp.read().decode("utf-8")
-            data = json.loads(body)
-    except Exception as e:
+        data = await get_client("tomtom").get_json(url, timeout=timeout, op="geocode")
+    except (ProviderHTTPError, ProviderTransportError) as e:
         raise GeocodeError(f"request failed: {e}") from e
 
-    # Parse result safely
+    coords = _parse_geocode_response(data)
+    if cache is not None:
+        cache.store(address, country, coords)
+    return coords
+
+
+def _parse_geocode_response(data: Any) -> Optional[Tuple[float, float]]:
+    """Extract (lat, lng) from the first result of a TomTom geocode response."""
     if not isinstance(data, dict):
         raise GeocodeError("unexpected response type from TomTom")
 
@@ -77,27 +108,209 @@ def coordinates(
     return None
 
 
+class _TokenBucket:
+    """Token bucket shared by concurrent tasks: refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_take(self) -> float:
+        """Take a token if available; otherwise return the seconds to wait for the next one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._try_take()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+async def _geocode_one(q: str, country, api_key, timeout, bucket: _TokenBucket) -> Dict[str, Any]:
+    try:
+        if isinstance(q, str) and q.strip():
+            await bucket.acquire()
+        # batch_coordinates already consulted the cache; only fill it here
+        coords = await coordinates_async(q, country=country, api_key=api_key, timeout=timeout, use_cache=False)
+        cache = get_default_cache()
+        if cache is not None and q.strip():
+            cache.store(q.strip(), country, coords)
+        if coords:
+            lat, lng = coords
+        else:
+            lat = lng = None
+        return {"query": q, "lat": lat, "lng": lng}
+    except (GeocodeError, TypeError) as e:
+        return {"query": q, "lat": None, "lng": None, "error": str(e)}
+
+
+async def _geocode_chunk_batch(chunk: List[str], country, api_key, timeout, bucket: _TokenBucket) -> List[Dict[str, Any]]:
+    """
+    Geocode up to TOMTOM_BATCH_MAX_ITEMS addresses with one call to TomTom's synchronous batch endpoint.
+    Failures are reported per item; a failed HTTP call marks every item of the chunk.
+    """
+    out: List[Dict[str, Any]] = [{"query": q, "lat": None, "lng": None} for q in chunk]
+    items: List[Dict[str, str]] = []
+    positions: List[int] = []
+    for i, q in enumerate(chunk):
+        if not isinstance(q, str):
+            out[i]["error"] = "address must be a string"
+            continue
+        q = q.strip()
+        if not q:
+            continue
+        params = {"limit": 1}
+        if country:
+            params["countrySet"] = country.strip()
+        items.append({"query": "/geocode/" + urllib.parse.quote(q) + ".json?" + urllib.parse.urlencode(params)})
+        positions.append(i)
+    if not items:
+        return out
+
+    cache = get_default_cache()
+    try:
+        key = _resolve_key(api_key)
+        url = provider_url("tomtom", "/search/2/batch/sync.json?" + urllib.parse.urlencode({"key": key}))
+        await bucket.acquire()
+        data = await get_client("tomtom").post_json(url, {"batchItems": items}, timeout=timeout, op="geocode_batch")
+        batch_items = data.get("batchItems") if isinstance(data, dict) else None
+        if not isinstance(batch_items, list) or len(batch_items) != len(items):
+            raise GeocodeError("unexpected batch response from TomTom")
+    except (GeocodeError, ProviderHTTPError, ProviderTransportError) as e:
+        err = str(e) if isinstance(e, GeocodeError) else f"request failed: {e}"
+        for i in positions:
+            out[i]["error"] = err
+        return out
+
+    for i, item in zip(positions, batch_items):
+        item = item or {}
+        if item.get("statusCode") != 200:
+            out[i]["error"] = f"batch item failed: HTTP {item.get('statusCode', '?')}"
+            continue
+        try:
+            coords = _parse_geocode_response(item.get("response"))
+        except GeocodeError as e:
+            out[i]["error"] = str(e)
+            continue
+        if cache is not None:
+            cache.store(chunk[i], country, coords)
+        if coords:
+            out[i]["lat"], out[i]["lng"] = coords
+    return out
+
+
 def batch_coordinates(
     addresses: List[str],
     *,
     country: Optional[str] = None,
     api_key: Optional[str] = None,
-    timeout: float = 10.0
+    timeout: float = 10.0,
+    workers: Optional[int] = None,
+    rate_per_sec: Optional[float] = None,
+    use_batch_api: Optional[bool] = None,
+    batch_size: int = TOMTOM_BATCH_MAX_ITEMS,
+) -> List[Dict[str, Any]]:
+    """Blocking wrapper around batch_coordinates_async."""
+    return run_sync(batch_coordinates_async(
+        addresses,
+        country=country,
+        api_key=api_key,
+        timeout=timeout,
+        workers=workers,
+        rate_per_sec=rate_per_sec,
+        use_batch_api=use_batch_api,
+        batch_size=batch_size,
+    ))
+
+
+async def batch_coordinates_async(
+    addresses: List[str],
+    *,
+    country: Optional[str] = None,
+    api_key: Optional[str] = None,
+    timeout: float = 10.0,
+    workers: Optional[int] = None,
+    rate_per_sec: Optional[float] = None,
+    use_batch_api: Optional[bool] = None,
+    batch_size: int = TOMTOM_BATCH_MAX_ITEMS,
 ) -> List[Dict[str, Any]]:
     """
     Batch helper that mirrors your original API output schema for each query.
+
+    Up to `workers` lookups run concurrently, throttled by a shared token bucket to
+    `rate_per_sec` outbound requests. With `use_batch_api`, addresses are sent in chunks of
+    `batch_size` through TomTom's batch search endpoint instead of one call each.
+    Results are returned in input order; failures carry an "error" key on the affected item only.
+    Addresses already in the geocode cache are answered locally and never hit the network.
+
+    Defaults come from GEOCODE_WORKERS (8), GEOCODE_RATE_PER_SEC (5) and GEOCODE_USE_BATCH (off).
     """
-    out: List[Dict[str, Any]] = []
-    for q in addresses or []:
-        try:
-            coords = coordinates(q, country=country, api_key=api_key, timeout=timeout)
-            if coords:
-                lat, lng = coords
-            else:
-                lat = lng = None
-            out.append({"query": q, "lat": lat, "lng": lng})
-        except GeocodeError as e:
-            out.append({"query": q, "lat": None, "lng": None, "error": str(e)})
+    addresses = list(addresses or [])
+    if not addresses:
+        return []
+    if workers is None:
+        workers = int(_env_number("GEOCODE_WORKERS", 8))
+    if rate_per_sec is None:
+        rate_per_sec = _env_number("GEOCODE_RATE_PER_SEC", 5.0)
+    if use_batch_api is None:
+        use_batch_api = os.getenv("GEOCODE_USE_BATCH", "").lower() in ("1", "true", "yes")
+    sem = asyncio.Semaphore(max(1, int(workers)))
+    bucket = _TokenBucket(rate_per_sec)
+
+    out: List[Optional[Dict[str, Any]]] = [None] * len(addresses)
+    pending: List[int] = []
+    cache = get_default_cache()
+    for i, q in enumerate(addresses):
+        if cache is not None and isinstance(q, str) and q.strip():
+            found, coords = cache.lookup(q.strip(), country)
+            if found:
+                lat, lng = coords if coords else (None, None)
+                out[i] = {"query": q, "lat": lat, "lng": lng}
+                continue
+        pending.append(i)
+    if not pending:
+        return out
+
+    async def bounded(coro):
+        async with sem:
+            return await coro
+
+    todo = [addresses[i] for i in pending]
+    if use_batch_api:
+        size = max(1, min(int(batch_size), TOMTOM_BATCH_MAX_ITEMS))
+        chunks = [todo[i:i + size] for i in range(0, len(todo), size)]
+        parts = await asyncio.gather(*(
+            bounded(_geocode_chunk_batch(c, country, api_key, timeout, bucket)) for c in chunks
+        ))
+        results = [r for part in parts for r in part]
+    else:
+        # gather() preserves submission order, so results line up with `pending`
+        results = await asyncio.gather(*(
+            bounded(_geocode_one(q, country, api_key, timeout, bucket)) for q in todo
+        ))
+
+    for i, r in zip(pending, results):
+        out[i] = r
     return out
 
 
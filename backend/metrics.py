@@ -0,0 +1,202 @@
+"""
+Process-local counters and histograms rendered in the Prometheus text exposition format.
+
+Stage timings for one optimization are collected in a StageTimings bound to the running context, so
+helpers deep in the call graph (TomTom segments, ETA computation) can record into it without
+threading a parameter through every signature; asyncio tasks and to_thread workers inherit it.
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; spans a cached lookup (sub-ms) to a slow provider solve
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(_labels_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {_fmt_value(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # label key -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelKey, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, n + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets, counts):
+                    cumulative += c
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', _fmt_value(bound))])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {n}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def add_collector(self, fn: Callable[[], List[str]]) -> None:
+        """`fn()` returns extra exposition lines (e.g. cache gauges read at scrape time)."""
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        for fn in collectors:
+            try:
+                lines.extend(fn())
+            except Exception:
+                pass  # a broken collector must not take down the scrape
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("optimize_stage_seconds", "Time spent per optimization stage.")
+REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "End-to-end latency of API requests.")
+REQUESTS = REGISTRY.counter("http_requests_total", "API requests by endpoint and status code.")
+PROVIDER_CALL_SECONDS = REGISTRY.histogram("provider_call_seconds", "Latency of individual provider HTTP calls.")
+PROVIDER_ERRORS = REGISTRY.counter("provider_errors_total", "Failed provider calls by provider.")
+PROVIDER_RETRIES = REGISTRY.counter("provider_retries_total", "Provider HTTP attempts repeated after a retryable failure.")
+PROVIDER_HEDGES = REGISTRY.counter("provider_hedged_requests_total", "Duplicate provider requests sent for slow calls, by winner.")
+PROVIDER_REJECTED = REGISTRY.counter("provider_breaker_rejections_total", "Provider calls failed fast by an open circuit breaker.")
+SOLVER_FALLBACKS = REGISTRY.counter("solver_fallbacks_total", "Optimizations solved locally instead of by NextBillion.")
+CACHE_LOOKUPS = REGISTRY.counter("result_cache_lookups_total", "Optimization result cache lookups by outcome.")
+
+
+class StageTimings:
+    """Per-request stage totals in milliseconds plus call counts, safe to update from worker threads."""
+
+    def __init__(self):
+        self._ms: Dict[str, float] = {}
+        self._calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._ms[stage] = self._ms.get(stage, 0.0) + seconds * 1000.0
+            self._calls[stage] = self._calls.get(stage, 0) + 1
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {s: {"ms": round(ms, 3), "calls": self._calls[s]} for s, ms in self._ms.items()}
+
+
+_current: "contextvars.ContextVar[Optional[StageTimings]]" = contextvars.ContextVar("stage_timings", default=None)
+
+
+def bind_timings(timings: Optional[StageTimings] = None) -> StageTimings:
+    """Make `timings` (or a fresh one) the collector for the current context and return it."""
+    timings = timings or StageTimings()
+    _current.set(timings)
+    return timings
+
+
+def record(stage: str, seconds: float) -> None:
+    """Observe one stage duration into the histogram and the context's StageTimings, if bound."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+def cache_collector(name: str, help_text: str, sources: Dict[str, Callable[[], Optional[Dict[str, object]]]]) -> Callable[[], List[str]]:
+    """
+    Collector exposing the numeric fields of each cache's `stats()` as one gauge family, labelled by
+    cache and field, e.g. cache_stat{cache="geocode",stat="hits"}. A source returning None is skipped.
+    """
+    def collect() -> List[str]:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for source, fn in sources.items():
+            stats = fn() or {}
+            for field, v in sorted(stats.items()):
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    lines.append(f"{name}{_fmt_labels(_labels_key({'cache': source, 'stat': field}))} {_fmt_value(v)}")
+        return lines
+    return collect
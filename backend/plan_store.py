@@ -0,0 +1,169 @@
+import copy
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from problem import Problem
+
+
+class PlanNotFound(Exception):
+    """No kept plan with that id: never created, expired or evicted."""
+    pass
+
+
+class PlanConflict(Exception):
+    """The plan changed since the revision the caller based its update on."""
+    pass
+
+
+class Plan:
+    """
+    A solved plan kept for incremental changes: the problem it was solved for, each vehicle's stop
+    sequence as shipment nodes (pickup 2s, delivery 2s+1) and the full, enriched result.
+    """
+
+    __slots__ = ("id", "problem", "routes", "result", "zones", "options", "use_road_routes", "revision", "created", "touched")
+
+    def __init__(self, plan_id: str, problem: Problem, routes: List[List[int]], result: Dict[str, Any],
+                 zones: List[Dict[str, Any]], options: Dict[str, Any], use_road_routes: bool):
+        self.id = plan_id
+        self.problem = problem
+        self.routes = routes
+        self.result = result
+        self.zones = zones
+        self.options = options
+        self.use_road_routes = use_road_routes
+        self.revision = 0
+        self.created = self.touched = time.time()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "plan_id": self.id,
+            "revision": self.revision,
+            "vehicles": self.problem.n_vehicles,
+            "shipments": self.problem.n_shipments,
+            "assigned": sum(len(r) for r in self.routes) // 2,
+            "created": self.created,
+        }
+
+
+def routes_from_result(problem: Problem, result: Dict[str, Any]) -> Optional[List[List[int]]]:
+    """
+    Per-vehicle shipment-node sequences read back from a result's stops by vehicle and stop id. Works for
+    any solver's output; None if a stop can't be matched to exactly one shipment of `problem`.
+    """
+    assignments = result.get("assignments") or []
+    pickups: Dict[Any, List[int]] = {}
+    deliveries: Dict[Any, List[int]] = {}
+    for s in range(problem.n_shipments):
+        pickups.setdefault(problem.pickup_ids[s], []).append(s)
+        deliveries.setdefault(problem.delivery_ids[s], []).append(s)
+    routes: List[List[int]] = [[] for _ in range(problem.n_vehicles)]
+    placed = set()
+    for k, a in enumerate(assignments):
+        # Solvers emit one assignment per vehicle in input order; fall back to the id otherwise
+        v = k if len(assignments) == problem.n_vehicles else problem.vehicle_position(a.get("vehicle_id"))
+        if v is None:
+            return None
+        picked = set()
+        for st in a.get("stops") or []:
+            kind = st.get("type")
+            if kind == "pickup":
+                # Duplicate ids: take the first shipment with that id not yet on a route
+                s = next((s for s in pickups.get(st.get("id"), []) if s not in placed), None)
+                if s is None:
+                    return None
+                placed.add(s)
+                picked.add(s)
+                routes[v].append(2 * s)
+            elif kind == "delivery":
+                s = next((s for s in deliveries.get(st.get("id"), []) if s in picked), None)
+                if s is None:
+                    return None
+                picked.discard(s)
+                routes[v].append(2 * s + 1)
+        if picked:
+            return None  # pickup without its delivery
+    return routes
+
+
+class PlanStore:
+    """In-memory LRU of solved plans; entries expire `ttl_s` after their last use."""
+
+    def __init__(self, *, max_entries: int = 32, ttl_s: float = 86400):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self._entries: "OrderedDict[str, Plan]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, problem: Problem, result: Dict[str, Any], zones: List[Dict[str, Any]],
+               options: Dict[str, Any], use_road_routes: bool) -> Optional[Plan]:
+        """Keep a copy of `result` as a new plan; None if its stops can't be mapped back onto `problem`."""
+        routes = routes_from_result(problem, result)
+        if routes is None:
+            return None
+        stored = copy.deepcopy({k: v for k, v in result.items() if k not in ("cache", "plan_id", "plan_revision")})
+        plan = Plan(uuid.uuid4().hex, problem, routes, stored, copy.deepcopy(zones), copy.deepcopy(options), use_road_routes)
+        with self._lock:
+            self._expire_locked()
+            self._entries[plan.id] = plan
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return plan
+
+    def get(self, plan_id: str) -> Optional[Plan]:
+        with self._lock:
+            self._expire_locked()
+            plan = self._entries.get(plan_id)
+            if plan is not None:
+                plan.touched = time.time()
+                self._entries.move_to_end(plan_id)
+            return plan
+
+    def update(self, plan_id: str, revision: int, *, problem: Problem, routes: List[List[int]], result: Dict[str, Any]) -> Plan:
+        """
+        Replace a plan's state if it is still at `revision`; raises PlanNotFound if it is gone and
+        PlanConflict if another update got there first. The stored result is a private copy.
+        """
+        stored = copy.deepcopy({k: v for k, v in result.items() if k not in ("cache", "plan_id", "plan_revision")})
+        with self._lock:
+            plan = self._entries.get(plan_id)
+            if plan is None:
+                raise PlanNotFound(plan_id)
+            if plan.revision != revision:
+                raise PlanConflict(f"plan is at revision {plan.revision}, not {revision}")
+            plan.problem, plan.routes, plan.result = problem, routes, stored
+            plan.revision += 1
+            plan.touched = time.time()
+            self._entries.move_to_end(plan_id)
+            return plan
+
+    def delete(self, plan_id: str) -> bool:
+        with self._lock:
+            return self._entries.pop(plan_id, None) is not None
+
+    def _expire_locked(self) -> None:
+        cutoff = time.time() - self.ttl_s
+        stale = [pid for pid, p in self._entries.items() if p.touched < cutoff]
+        for pid in stale:
+            del self._entries[pid]
+
+
+_default_store: Optional[PlanStore] = None
+_default_lock = threading.Lock()
+
+
+def get_plan_store() -> PlanStore:
+    """Process-wide store configured from env PLAN_STORE_MAX_ENTRIES (32) and PLAN_STORE_TTL_S (86400)."""
+    global _default_store
+    if _default_store is None:
+        with _default_lock:
+            if _default_store is None:
+                _default_store = PlanStore(
+                    max_entries=int(os.getenv("PLAN_STORE_MAX_ENTRIES") or 32),
+                    ttl_s=float(os.getenv("PLAN_STORE_TTL_S") or 86400),
+                )
+    return _default_store
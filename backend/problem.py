@@ -0,0 +1,309 @@
+"""
+Columnar problem model: the uploaded vehicle and shipment tables parsed and validated once per request.
+
+Coordinates, epoch time windows, capacities and quantities live in NumPy columns (NaN = missing);
+ids, descriptions and the raw time-window strings the providers expect stay as plain lists.
+The solvers, the NextBillion payload builder and TomTom enrichment all read these columns
+directly instead of walking per-row dicts.
+"""
+import hashlib
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# CSV headers (see input_vehicles.csv and input_shipments.csv at the repo root)
+VEHICLE_COLUMNS = {
+    "id": "id",
+    "description": "vehicle_description",
+    "capacity": "capacity",
+    "start_lat": "start_latitude",
+    "start_lng": "start_longitude",
+    "end_lat": "end_latitude",
+    "end_lng": "end_longitude",
+    "shift_start": "shift_start",
+    "shift_end": "shift_end",
+    "max_tasks": "max_tasks",
+}
+SHIPMENT_COLUMNS = {
+    "pickup_id": "Pickup Id",
+    "pickup_lat": "Pickup Location Lat",
+    "pickup_lng": "Pickup Location Lng",
+    "pickup_start": "Pickup Start Time",
+    "pickup_end": "Pickup End Time",
+    "delivery_id": "Delivery Id",
+    "delivery_lat": "Delivery Location Lat",
+    "delivery_lng": "Delivery Location Lng",
+    "delivery_start": "Delivery Start Time",
+    "delivery_end": "Delivery End Time",
+    "quantity": "Quantity",
+    "priority": "Priority",
+    "description": "Description",
+}
+
+
+def _num(v: Any) -> float:
+    try:
+        return float(str(v).strip())
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _int_or_nan(v: Any) -> float:
+    # Integers only, as the CSV mapping always accepted: "2.5" reads as missing
+    try:
+        return float(int(str(v).strip()))
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _epoch(v: Any) -> float:
+    if not v:
+        return math.nan
+    try:
+        dt = datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+    except ValueError:
+        return math.nan
+    if dt.tzinfo is None:
+        # Naive CSV timestamps are read as UTC, matching the "Z" suffix used for computed ETAs
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _opt(x: float) -> Optional[float]:
+    return None if math.isnan(x) else x
+
+
+def _opt_int(x: float) -> Optional[int]:
+    return None if math.isnan(x) else int(x)
+
+
+class _Table:
+    """Header-indexed view over raw CSV rows; short rows read as missing cells."""
+
+    __slots__ = ("rows", "idx")
+
+    def __init__(self, table: Dict[str, Any]):
+        self.rows: List[List[Any]] = table.get("rows") or []
+        self.idx = {h: i for i, h in enumerate(table.get("headers") or [])}
+
+    def column(self, header: str) -> List[Any]:
+        i = self.idx.get(header)
+        if i is None:
+            return [None] * len(self.rows)
+        return [r[i] if i < len(r) else None for r in self.rows]
+
+
+_VEHICLE_FIELDS = (
+    "vehicle_ids", "vehicle_descriptions", "capacity", "max_tasks",
+    "start_lat", "start_lng", "end_lat", "end_lng", "shift_start", "shift_end", "shift_ts",
+)
+_SHIPMENT_FIELDS = (
+    "pickup_ids", "delivery_ids", "descriptions",
+    "pickup_lat", "pickup_lng", "delivery_lat", "delivery_lng",
+    "pickup_tw", "delivery_tw", "pickup_tw_ts", "delivery_tw_ts",
+    "quantity", "priority",
+)
+
+
+class Problem:
+    """
+    Vehicles and shipments of one optimization request as parallel columns.
+
+    Vehicle v: vehicle_ids[v], capacity[v], max_tasks[v], start_lat/start_lng/end_lat/end_lng[v],
+    shift_start/shift_end[v] (raw strings) and shift_ts[v] = (start, end) epoch seconds. max_tasks
+    counts stops, not shipments: a shipment's pickup and delivery are two tasks, as NextBillion counts
+    them, and the local solver enforces it the same way.
+    Shipment i: pickup_ids[i]/delivery_ids[i], pickup_lat/lng, delivery_lat/lng, pickup_tw/delivery_tw
+    (raw [start, end] strings), pickup_tw_ts/delivery_tw_ts (epoch, shape (n, 2)), quantity, priority.
+    """
+
+    __slots__ = _VEHICLE_FIELDS + _SHIPMENT_FIELDS + ("issues", "_vehicle_pos")
+
+    def __init__(self, nv: int = 0, ns: int = 0):
+        nan = lambda n: np.full(n, np.nan)
+        self.vehicle_ids: List[Optional[str]] = [None] * nv
+        self.vehicle_descriptions: List[Optional[str]] = [None] * nv
+        self.capacity = nan(nv)
+        self.max_tasks = nan(nv)
+        self.start_lat, self.start_lng, self.end_lat, self.end_lng = nan(nv), nan(nv), nan(nv), nan(nv)
+        self.shift_start: List[Optional[str]] = [None] * nv
+        self.shift_end: List[Optional[str]] = [None] * nv
+        self.shift_ts = np.full((nv, 2), np.nan)
+        self.pickup_ids: List[Optional[str]] = [None] * ns
+        self.delivery_ids: List[Optional[str]] = [None] * ns
+        self.descriptions: List[Optional[str]] = [None] * ns
+        self.pickup_lat, self.pickup_lng, self.delivery_lat, self.delivery_lng = nan(ns), nan(ns), nan(ns), nan(ns)
+        self.pickup_tw: List[List[Optional[str]]] = [[None, None] for _ in range(ns)]
+        self.delivery_tw: List[List[Optional[str]]] = [[None, None] for _ in range(ns)]
+        self.pickup_tw_ts = np.full((ns, 2), np.nan)
+        self.delivery_tw_ts = np.full((ns, 2), np.nan)
+        self.quantity = nan(ns)
+        self.priority = nan(ns)
+        # Row-level validation findings: {"table", "row", "field", "message"}
+        self.issues: List[Dict[str, Any]] = []
+        self._vehicle_pos: Optional[Dict[str, int]] = None
+
+    @property
+    def n_vehicles(self) -> int:
+        return len(self.vehicle_ids)
+
+    @property
+    def n_shipments(self) -> int:
+        return len(self.pickup_ids)
+
+    @classmethod
+    def from_tables(cls, vehicles_in: Dict[str, Any], shipments_in: Dict[str, Any]) -> "Problem":
+        """Parse the {headers, rows} tables posted to /api/optimize."""
+        vt, st = _Table(vehicles_in or {}), _Table(shipments_in or {})
+        p = cls(len(vt.rows), len(st.rows))
+        vc = {k: vt.column(h) for k, h in VEHICLE_COLUMNS.items()}
+        sc = {k: st.column(h) for k, h in SHIPMENT_COLUMNS.items()}
+
+        p.vehicle_ids = vc["id"]
+        p.vehicle_descriptions = vc["description"]
+        p.capacity[:] = [_int_or_nan(x) for x in vc["capacity"]]
+        p.max_tasks[:] = [_int_or_nan(x) for x in vc["max_tasks"]]
+        for col in ("start_lat", "start_lng", "end_lat", "end_lng"):
+            getattr(p, col)[:] = [_num(x) for x in vc[col]]
+        p.shift_start, p.shift_end = vc["shift_start"], vc["shift_end"]
+        p.shift_ts[:, 0] = [_epoch(x) for x in p.shift_start]
+        p.shift_ts[:, 1] = [_epoch(x) for x in p.shift_end]
+
+        p.pickup_ids, p.delivery_ids, p.descriptions = sc["pickup_id"], sc["delivery_id"], sc["description"]
+        for col in ("pickup_lat", "pickup_lng", "delivery_lat", "delivery_lng"):
+            getattr(p, col)[:] = [_num(x) for x in sc[col]]
+        p.pickup_tw = [[a, b] for a, b in zip(sc["pickup_start"], sc["pickup_end"])]
+        p.delivery_tw = [[a, b] for a, b in zip(sc["delivery_start"], sc["delivery_end"])]
+        p.pickup_tw_ts[:, 0] = [_epoch(x) for x in sc["pickup_start"]]
+        p.pickup_tw_ts[:, 1] = [_epoch(x) for x in sc["pickup_end"]]
+        p.delivery_tw_ts[:, 0] = [_epoch(x) for x in sc["delivery_start"]]
+        p.delivery_tw_ts[:, 1] = [_epoch(x) for x in sc["delivery_end"]]
+        p.quantity[:] = [_int_or_nan(x) for x in sc["quantity"]]
+        p.priority[:] = [_int_or_nan(x) for x in sc["priority"]]
+        p.validate()
+        return p
+
+    @classmethod
+    def from_records(cls, vehicles: Sequence[Dict[str, Any]], shipments: Sequence[Dict[str, Any]]) -> "Problem":
+        """Build from the nested dict shape ({"start": {"lat", "lng"}, "pickup": {...}, ...}) used by scripts."""
+        p = cls(len(vehicles), len(shipments))
+        for v, veh in enumerate(vehicles):
+            start, end, shift = veh.get("start") or {}, veh.get("end") or {}, veh.get("shift") or {}
+            p.vehicle_ids[v] = veh.get("id")
+            p.vehicle_descriptions[v] = veh.get("description")
+            p.capacity[v] = _int_or_nan(veh.get("capacity"))
+            p.max_tasks[v] = _int_or_nan(veh.get("max_tasks"))
+            p.start_lat[v], p.start_lng[v] = _num(start.get("lat")), _num(start.get("lng"))
+            p.end_lat[v], p.end_lng[v] = _num(end.get("lat")), _num(end.get("lng"))
+            p.shift_start[v], p.shift_end[v] = shift.get("start"), shift.get("end")
+            p.shift_ts[v] = (_epoch(shift.get("start")), _epoch(shift.get("end")))
+        for i, shp in enumerate(shipments):
+            pk, dl = shp.get("pickup") or {}, shp.get("delivery") or {}
+            p.pickup_ids[i], p.delivery_ids[i] = pk.get("id"), dl.get("id")
+            p.descriptions[i] = shp.get("description")
+            p.pickup_lat[i], p.pickup_lng[i] = _num(pk.get("lat")), _num(pk.get("lng"))
+            p.delivery_lat[i], p.delivery_lng[i] = _num(dl.get("lat")), _num(dl.get("lng"))
+            ptw = list(pk.get("time_window") or [None, None]) + [None, None]
+            dtw = list(dl.get("time_window") or [None, None]) + [None, None]
+            p.pickup_tw[i], p.delivery_tw[i] = ptw[:2], dtw[:2]
+            p.pickup_tw_ts[i] = (_epoch(ptw[0]), _epoch(ptw[1]))
+            p.delivery_tw_ts[i] = (_epoch(dtw[0]), _epoch(dtw[1]))
+            p.quantity[i] = _int_or_nan(shp.get("quantity"))
+            p.priority[i] = _int_or_nan(shp.get("priority"))
+        p.validate()
+        return p
+
+    @classmethod
+    def concat(cls, parts: Sequence["Problem"]) -> "Problem":
+        """Stack problems row-wise (vehicles after vehicles, shipments after shipments)."""
+        p = cls()
+        for name in _VEHICLE_FIELDS + _SHIPMENT_FIELDS:
+            cols = [getattr(part, name) for part in parts]
+            if isinstance(getattr(p, name), np.ndarray):
+                setattr(p, name, np.concatenate([getattr(p, name)] + cols))
+            else:
+                setattr(p, name, [x for col in cols for x in col])
+        p.validate()
+        return p
+
+    @classmethod
+    def combine(cls, vehicles_from: "Problem", shipments_from: "Problem") -> "Problem":
+        """Vehicles of one problem with shipments of another; columns are shared, not copied."""
+        p = cls()
+        for name in _VEHICLE_FIELDS:
+            setattr(p, name, getattr(vehicles_from, name))
+        for name in _SHIPMENT_FIELDS:
+            setattr(p, name, getattr(shipments_from, name))
+        p.issues = [i for i in vehicles_from.issues if i["table"] == "vehicles"]
+        p.issues += [i for i in shipments_from.issues if i["table"] == "shipments"]
+        return p
+
+    def select(self, vehicles: Sequence[int], shipments: Sequence[int]) -> "Problem":
+        """The given vehicle and shipment rows, in that order (e.g. without retired vehicles or cancelled shipments)."""
+        p = type(self)()
+        for names, rows in ((_VEHICLE_FIELDS, vehicles), (_SHIPMENT_FIELDS, shipments)):
+            idx = np.asarray(rows, dtype=int)
+            for name in names:
+                col = getattr(self, name)
+                setattr(p, name, col[idx] if isinstance(col, np.ndarray) else [col[i] for i in idx.tolist()])
+        p.validate()
+        return p
+
+    def validate(self) -> None:
+        """
+        Blank out coordinates outside WGS84 ranges (they would poison every distance computation)
+        and record row-level issues for them and for shipments that cannot be routed.
+        """
+        self.issues = []
+        checks = (
+            ("vehicles", "start", self.start_lat, self.start_lng),
+            ("vehicles", "end", self.end_lat, self.end_lng),
+            ("shipments", "pickup", self.pickup_lat, self.pickup_lng),
+            ("shipments", "delivery", self.delivery_lat, self.delivery_lng),
+        )
+        for table, field, lat, lng in checks:
+            bad = (np.abs(lat) > 90) | (np.abs(lng) > 180)
+            for row in np.nonzero(bad)[0].tolist():
+                self.issues.append({"table": table, "row": row, "field": field, "message": "coordinates out of range"})
+            lat[bad] = np.nan
+            lng[bad] = np.nan
+        missing = ~self.routable
+        for row in np.nonzero(missing)[0].tolist():
+            self.issues.append({"table": "shipments", "row": row, "field": "pickup/delivery", "message": "missing coordinates"})
+        self._vehicle_pos = None
+
+    @property
+    def routable(self) -> np.ndarray:
+        """Shipments with both pickup and delivery coordinates."""
+        return ~(
+            np.isnan(self.pickup_lat) | np.isnan(self.pickup_lng)
+            | np.isnan(self.delivery_lat) | np.isnan(self.delivery_lng)
+        )
+
+    def vehicle_position(self, vehicle_id: Any) -> Optional[int]:
+        """Row of the vehicle with this id (first one wins on duplicates)."""
+        if self._vehicle_pos is None:
+            pos: Dict[str, int] = {}
+            for v, vid in enumerate(self.vehicle_ids):
+                pos.setdefault(vid, v)
+            self._vehicle_pos = pos
+        return self._vehicle_pos.get(vehicle_id)
+
+    def shipment_id(self, i: int) -> Optional[str]:
+        return self.pickup_ids[i] or self.delivery_ids[i]
+
+    def fingerprint(self) -> str:
+        """SHA-256 over every column; equal problems hash equal regardless of how they were built."""
+        h = hashlib.sha256()
+        for name in self.__slots__:
+            if name in ("issues", "_vehicle_pos"):
+                continue
+            col = getattr(self, name)
+            h.update(name.encode())
+            if isinstance(col, np.ndarray):
+                h.update(np.ascontiguousarray(col).tobytes())
+            else:
+                h.update(repr(col).encode("utf-8"))
+        return h.hexdigest()
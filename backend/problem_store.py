@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from problem import Problem
+
+
+class StoredProblem:
+    """Uploaded halves of one problem; either may still be missing while the user uploads the other."""
+
+    __slots__ = ("id", "vehicles", "shipments", "reports", "created", "touched")
+
+    def __init__(self, problem_id: str):
+        self.id = problem_id
+        self.vehicles: Optional[Problem] = None
+        self.shipments: Optional[Problem] = None
+        self.reports: Dict[str, Dict[str, Any]] = {}
+        self.created = self.touched = time.time()
+
+    @property
+    def complete(self) -> bool:
+        return self.vehicles is not None and self.shipments is not None
+
+    def problem(self) -> Problem:
+        """The combined problem; call only when `complete`."""
+        return Problem.combine(self.vehicles, self.shipments)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "problem_id": self.id,
+            "vehicles": self.vehicles.n_vehicles if self.vehicles is not None else None,
+            "shipments": self.shipments.n_shipments if self.shipments is not None else None,
+            "complete": self.complete,
+            "created": self.created,
+        }
+
+
+class ProblemStore:
+    """
+    In-memory LRU of uploaded problems. Entries expire `ttl_s` after their last use and at most
+    `max_entries` are kept, so abandoned uploads can't accumulate.
+    """
+
+    def __init__(self, *, max_entries: int = 32, ttl_s: float = 3600):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self._entries: "OrderedDict[str, StoredProblem]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def attach(self, problem_id: Optional[str], kind: str, half: Problem, report: Dict[str, Any]) -> StoredProblem:
+        """
+        Store one uploaded table ("vehicles" or "shipments") under `problem_id`, or under a new id when
+        None. Raises KeyError for an unknown or expired id.
+        """
+        with self._lock:
+            self._expire_locked()
+            if problem_id:
+                entry = self._entries[problem_id]
+            else:
+                entry = StoredProblem(uuid.uuid4().hex)
+                self._entries[entry.id] = entry
+            setattr(entry, kind, half)
+            entry.reports[kind] = report
+            entry.touched = time.time()
+            self._entries.move_to_end(entry.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def get(self, problem_id: str) -> Optional[StoredProblem]:
+        with self._lock:
+            self._expire_locked()
+            entry = self._entries.get(problem_id)
+            if entry is not None:
+                entry.touched = time.time()
+                self._entries.move_to_end(problem_id)
+            return entry
+
+    def delete(self, problem_id: str) -> bool:
+        with self._lock:
+            return self._entries.pop(problem_id, None) is not None
+
+    def _expire_locked(self) -> None:
+        cutoff = time.time() - self.ttl_s
+        stale = [pid for pid, e in self._entries.items() if e.touched < cutoff]
+        for pid in stale:
+            del self._entries[pid]
+
+
+_default_store: Optional[ProblemStore] = None
+_default_lock = threading.Lock()
+
+
+def get_problem_store() -> ProblemStore:
+    """Process-wide store configured from env PROBLEM_STORE_MAX_ENTRIES (32) and PROBLEM_STORE_TTL_S (3600)."""
+    global _default_store
+    if _default_store is None:
+        with _default_lock:
+            if _default_store is None:
+                _default_store = ProblemStore(
+                    max_entries=int(os.getenv("PROBLEM_STORE_MAX_ENTRIES") or 32),
+                    ttl_s=float(os.getenv("PROBLEM_STORE_TTL_S") or 3600),
+                )
+    return _default_store
@@ -0,0 +1,220 @@
+"""
+Opt-in cProfile capture for single API requests.
+
+A profiled request runs on its own event loop in a dedicated thread, and every `asyncio.to_thread`
+call it makes goes through an executor that profiles the worker call too. The report therefore covers
+the request's coroutines, solver and mapping work in worker threads, and provider waits, without
+picking up other requests that share the server loop. Profiled requests open fresh provider
+connections, so connection setup shows up in the profile where pooled requests would skip it.
+"""
+import asyncio
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from http_client import aclose_clients
+
+T = TypeVar("T")
+
+# Rows per section of the text report
+REPORT_ROWS = 40
+
+
+class ProfilingDisabled(Exception):
+    """A client asked for a profile but PROFILING_ENABLED is not set."""
+    pass
+
+
+class _Session:
+    """Collects cProfile stats from the request loop thread and each worker call it spawns."""
+
+    def __init__(self):
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # 3.12+ profiles through sys.monitoring, one profiler per process; the outer one sees this call
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            prof.disable()
+            self._merge(prof)
+
+    def _merge(self, prof: cProfile.Profile) -> None:
+        prof.create_stats()
+        if not prof.stats:
+            return
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(prof)
+            else:
+                self._stats.add(prof)
+
+    @property
+    def stats(self) -> Optional[pstats.Stats]:
+        return self._stats
+
+
+class _ProfilingExecutor(ThreadPoolExecutor):
+    def __init__(self, session: _Session, **kwargs):
+        super().__init__(**kwargs)
+        self._session = session
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(self._session.run, fn, *args, **kwargs)
+
+
+def _report(stats: pstats.Stats) -> str:
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats("cumulative").print_stats(REPORT_ROWS)
+    stats.sort_stats("tottime").print_stats(REPORT_ROWS)
+    return out.getvalue()
+
+
+def run_profiled(make_coro: Callable[[], Awaitable[T]]) -> Tuple[T, Optional[pstats.Stats]]:
+    """
+    Run `make_coro()` to completion on a private loop in the calling thread under cProfile and return
+    (result, stats). Call it from a worker thread (e.g. via asyncio.to_thread), never from a running loop.
+    The coroutine's exception, if any, propagates after the stats are collected and discarded.
+    """
+    session = _Session()
+    loop = asyncio.new_event_loop()
+    executor = _ProfilingExecutor(session, max_workers=4, thread_name_prefix="profiled")
+    loop.set_default_executor(executor)
+
+    async def main() -> T:
+        try:
+            return await make_coro()
+        finally:
+            await aclose_clients()
+
+    try:
+        result = session.run(loop.run_until_complete, main())
+    finally:
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+    return result, session.stats
+
+
+class ProfileStore:
+    """Most recent profiles keyed by request id, capped at `max_entries` (oldest dropped first)."""
+
+    def __init__(self, *, max_entries: int = 20):
+        self.max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, request_id: str, endpoint: str, stats: pstats.Stats, *, elapsed_s: float, sampled: bool) -> Dict[str, Any]:
+        entry = {
+            "request_id": request_id,
+            "endpoint": endpoint,
+            "created": time.time(),
+            "ms": int(elapsed_s * 1000),
+            "sampled": sampled,
+            "total_calls": stats.total_calls,
+            "report": _report(stats),
+            # Same layout pstats.Stats.dump_stats writes, so the download opens in snakeviz etc.
+            "pstats": marshal.dumps(stats.stats),
+        }
+        with self._lock:
+            self._entries[request_id] = entry
+            self._entries.move_to_end(request_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(request_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {k: v for k, v in e.items() if k not in ("report", "pstats")}
+                for e in reversed(self._entries.values())
+            ]
+
+
+def _truthy(value: Optional[str]) -> bool:
+    return (value or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class Profiler:
+    """
+    Decides which requests to profile and keeps their output.
+
+    `enabled` guards everything: clients may ask for a profile with the X-Profile header or
+    ?profile=1, and `sample_percent` of other requests are profiled automatically.
+    """
+
+    def __init__(self, *, enabled: bool = False, sample_percent: float = 0.0, max_entries: int = 20):
+        self.enabled = bool(enabled)
+        self.sample_percent = min(100.0, max(0.0, float(sample_percent)))
+        self.store = ProfileStore(max_entries=max_entries)
+
+    def should_profile(self, requested: bool) -> Tuple[bool, bool]:
+        """(profile, sampled) for one request. Raises ProfilingDisabled if requested while disabled."""
+        if requested:
+            if not self.enabled:
+                raise ProfilingDisabled("Profiling is disabled on this server (set PROFILING_ENABLED=1)")
+            return True, False
+        if self.enabled and self.sample_percent > 0 and random.random() * 100 < self.sample_percent:
+            return True, True
+        return False, False
+
+    async def run(
+        self,
+        endpoint: str,
+        request_id: Optional[str],
+        make_coro: Callable[[], Awaitable[T]],
+        *,
+        sampled: bool = False,
+    ) -> Tuple[T, str]:
+        """Run `make_coro()` profiled in a worker thread, store the profile and return (result, request id)."""
+        request_id = request_id or uuid.uuid4().hex
+        t0 = time.perf_counter()
+        result, stats = await asyncio.to_thread(run_profiled, make_coro)
+        if stats is not None:
+            self.store.put(request_id, endpoint, stats, elapsed_s=time.perf_counter() - t0, sampled=sampled)
+        return result, request_id
+
+
+_default_profiler: Optional[Profiler] = None
+_default_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler:
+    """
+    Process-wide profiler configured from env PROFILING_ENABLED (off), PROFILE_SAMPLE_PERCENT (0)
+    and PROFILE_MAX_ENTRIES (20).
+    """
+    global _default_profiler
+    if _default_profiler is None:
+        with _default_lock:
+            if _default_profiler is None:
+                _default_profiler = Profiler(
+                    enabled=_truthy(os.getenv("PROFILING_ENABLED")),
+                    sample_percent=float(os.getenv("PROFILE_SAMPLE_PERCENT") or 0),
+                    max_entries=int(os.getenv("PROFILE_MAX_ENTRIES") or 20),
+                )
+    return _default_profiler
+
+
+def profile_requested(header: Optional[str], query: Optional[str]) -> bool:
+    """True when the X-Profile header or the ?profile= query flag is set."""
+    return _truthy(header) or _truthy(query)
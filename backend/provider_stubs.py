@@ -0,0 +1,418 @@
+"""
+Local stand-ins for the NextBillion and TomTom endpoints the backend calls, for benchmarks and offline runs.
+
+Each stub is a threaded HTTP server on 127.0.0.1 answering in the provider's response shape:
+  nextbillion  POST /route-optimization               nearest-depot assignment, stops in pickup-time order
+  tomtom       GET  /routing/1/calculateRoute/.../json  straight legs with interpolated points, 30 km/h
+               POST /routing/matrix/2                  the same legs' lengths and times per cell (max 200 cells)
+               GET  /search/2/geocode/<q>.json         a position derived from a hash of the query
+               POST /search/2/batch/sync.json          the same, per batch item
+Every request waits latency_ms (+ up to jitter_ms) first and fails with `error_status` at `error_rate`.
+Point the backend at them with NEXTBILLION_BASE_URL / TOMTOM_BASE_URL (see running_stubs).
+
+CLI:
+    python backend/provider_stubs.py --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+PROVIDERS = ("nextbillion", "tomtom")
+
+_EARTH_M = 6371000.0
+_DETOUR = 1.3  # road distance over great-circle distance
+_SPEED_MPS = 30 / 3.6
+_POINT_EVERY_M = 250.0  # route geometry density, roughly what calculateRoute returns in a city
+_GEOCODE_CENTER = (34.0522, -118.2437)
+_MATRIX_MAX_CELLS = 200
+
+
+def _haversine_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    p1, p2 = math.radians(a[0]), math.radians(b[0])
+    h = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(b[1] - a[1]) / 2) ** 2
+    return 2 * _EARTH_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _leg(a: Tuple[float, float], b: Tuple[float, float]) -> Dict[str, Any]:
+    dist = _haversine_m(a, b) * _DETOUR
+    n = max(2, min(200, int(dist / _POINT_EVERY_M) + 2))
+    points = [
+        {"latitude": round(a[0] + (b[0] - a[0]) * i / (n - 1), 6), "longitude": round(a[1] + (b[1] - a[1]) * i / (n - 1), 6)}
+        for i in range(n)
+    ]
+    return {
+        "summary": {"lengthInMeters": int(round(dist)), "travelTimeInSeconds": int(round(dist / _SPEED_MPS))},
+        "points": points,
+    }
+
+
+def _calculate_route(path: str) -> Optional[Dict[str, Any]]:
+    locations = []
+    for part in urllib.parse.unquote(path).split(":"):
+        try:
+            lat, lng = (float(x) for x in part.split(","))
+        except ValueError:
+            return None
+        locations.append((lat, lng))
+    if len(locations) < 2:
+        return None
+    legs = [_leg(locations[i], locations[i + 1]) for i in range(len(locations) - 1)]
+    summary = {
+        "lengthInMeters": sum(leg["summary"]["lengthInMeters"] for leg in legs),
+        "travelTimeInSeconds": sum(leg["summary"]["travelTimeInSeconds"] for leg in legs),
+    }
+    return {"formatVersion": "0.0.12", "routes": [{"summary": summary, "legs": legs}]}
+
+
+def _matrix(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def points(items: Any) -> List[Tuple[float, float]]:
+        return [(float(p["point"]["latitude"]), float(p["point"]["longitude"])) for p in items or []]
+
+    try:
+        origins, destinations = points(body.get("origins")), points(body.get("destinations"))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not origins or not destinations or len(origins) * len(destinations) > _MATRIX_MAX_CELLS:
+        return None
+    data = []
+    for i, a in enumerate(origins):
+        for j, b in enumerate(destinations):
+            summary = _leg(a, b)["summary"] if a != b else {"lengthInMeters": 0, "travelTimeInSeconds": 0}
+            data.append({"originIndex": i, "destinationIndex": j, "routeSummary": summary})
+    n = len(data)
+    return {"formatVersion": "0.0.1", "data": data, "statistics": {"totalCount": n, "successes": n, "failures": 0}}
+
+
+def _geocode(query: str) -> Dict[str, Any]:
+    digest = hashlib.blake2b(query.strip().lower().encode("utf-8"), digest_size=8).digest()
+    u = int.from_bytes(digest[:4], "big") / 2 ** 32
+    v = int.from_bytes(digest[4:], "big") / 2 ** 32
+    lat = _GEOCODE_CENTER[0] + (u - 0.5) * 0.5
+    lon = _GEOCODE_CENTER[1] + (v - 0.5) * 0.6
+    result = {
+        "type": "Point Address",
+        "score": 10.0,
+        "address": {"freeformAddress": query},
+        "position": {"lat": round(lat, 6), "lon": round(lon, 6)},
+    }
+    return {"summary": {"query": query, "numResults": 1, "totalResults": 1}, "results": [result]}
+
+
+def _geocode_query_from_path(path: str) -> str:
+    # /geocode/<quoted query>.json?...
+    name = path.split("?", 1)[0].rsplit("/", 1)[-1]
+    return urllib.parse.unquote(name[:-5] if name.endswith(".json") else name)
+
+
+def _parse_time(value: Any) -> float:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except (TypeError, ValueError):
+        return math.inf
+
+
+def _fmt_time(ts: float) -> Optional[str]:
+    if not math.isfinite(ts):
+        return None
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _optimize(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Assign each shipment to the nearest vehicle start, visit in pickup-window order, no capacity checks."""
+    vehicles = payload.get("vehicles") or []
+    shipments = payload.get("shipments") or []
+
+    def loc(d: Any) -> Optional[Tuple[float, float]]:
+        d = d or {}
+        if d.get("lat") is None or d.get("lng") is None:
+            return None
+        return float(d["lat"]), float(d["lng"])
+
+    starts = [loc(v.get("start_location")) or loc(v.get("end_location")) or (math.nan, math.nan) for v in vehicles]
+    picks = [loc((s.get("pickup") or {}).get("location")) or (math.nan, math.nan) for s in shipments]
+    by_vehicle: List[List[int]] = [[] for _ in vehicles]
+    if vehicles and shipments:
+        # Equirectangular distance is plenty to pick the nearest depot
+        v_xy = np.radians(np.asarray(starts, dtype=float))
+        p_xy = np.radians(np.asarray(picks, dtype=float))
+        for lo in range(0, len(shipments), 2048):
+            chunk = p_xy[lo:lo + 2048]
+            dx = (chunk[:, None, 1] - v_xy[None, :, 1]) * np.cos(chunk[:, None, 0])
+            dy = chunk[:, None, 0] - v_xy[None, :, 0]
+            d = np.nan_to_num(dx * dx + dy * dy, nan=np.inf)
+            for k, best in enumerate(np.argmin(d, axis=1).tolist()):
+                if np.isfinite(d[k, best]):
+                    by_vehicle[best].append(lo + k)
+
+    assignments = []
+    total_m = 0.0
+    for v, veh in enumerate(vehicles):
+        stops: List[Dict[str, Any]] = []
+        tw = veh.get("time_window") or [None, None]
+        clock = _parse_time(tw[0])
+        here = loc(veh.get("start_location"))
+        if here is not None:
+            stops.append({"type": "start", "lat": here[0], "lng": here[1], "eta": tw[0]})
+        order = sorted(by_vehicle[v], key=lambda i: _parse_time(((shipments[i].get("pickup") or {}).get("time_window") or [None])[0]))
+        for i in order:
+            s = shipments[i]
+            for kind in ("pickup", "delivery"):
+                point = loc((s.get(kind) or {}).get("location"))
+                if point is None:
+                    continue
+                if here is not None:
+                    d = _haversine_m(here, point) * _DETOUR
+                    total_m += d
+                    clock += d / _SPEED_MPS
+                opens = _parse_time(((s.get(kind) or {}).get("time_window") or [None])[0])
+                if math.isfinite(opens):
+                    clock = max(clock, opens) if math.isfinite(clock) else opens
+                stops.append({"type": kind, "id": s.get("id"), "lat": point[0], "lng": point[1], "eta": _fmt_time(clock)})
+                here = point
+        end = loc(veh.get("end_location"))
+        if end is not None:
+            if here is not None:
+                total_m += _haversine_m(here, end) * _DETOUR
+            stops.append({"type": "end", "lat": end[0], "lng": end[1], "eta": tw[1]})
+        coords = [[st["lng"], st["lat"]] for st in stops]
+        assignments.append({"vehicle_id": veh.get("id"), "stops": stops, "route": {"type": "LineString", "coordinates": coords}})
+    summary = {"total_distance_km": round(total_m / 1000.0, 3), "total_time_min": int(total_m / _SPEED_MPS / 60)}
+    return {"summary": summary, "assignments": assignments}
+
+
+def _path_kind(path: str) -> str:
+    """Request path without its per-call part (waypoints, query), for stats."""
+    if path.startswith("/routing/1/calculateRoute/"):
+        return "/routing/1/calculateRoute"
+    if path.startswith("/search/2/geocode/"):
+        return "/search/2/geocode"
+    return path
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real hosts
+    server: "_StubHTTPServer"
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: Any) -> None:
+        data = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Any:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"null")
+
+    def _handle(self, method: str) -> None:
+        stub = self.server.stub
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = self._body() if method == "POST" else None
+        stub.wait()
+        if stub.provider == "nextbillion" and not self.headers.get("x-api-key"):
+            status, out = 401, {"msg": "missing api key"}
+        elif stub.provider == "tomtom" and not query.get("key"):
+            status, out = 403, {"detailedError": {"code": "Forbidden", "message": "missing key"}}
+        elif stub.fail():
+            status, out = stub.error_status, {"error": "injected failure"}
+        else:
+            status, out = self._route(stub.provider, method, url.path, body)
+        stub.count(url.path, status)
+        self._send(status, out)
+
+    @staticmethod
+    def _route(provider: str, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        if provider == "nextbillion" and method == "POST" and path == "/route-optimization":
+            return 200, _optimize(body or {})
+        if provider == "tomtom" and method == "GET" and path.startswith("/routing/1/calculateRoute/") and path.endswith("/json"):
+            route = _calculate_route(path[len("/routing/1/calculateRoute/"):-len("/json")])
+            if route is None:
+                return 400, {"error": {"description": "Invalid locations"}}
+            return 200, route
+        if provider == "tomtom" and method == "POST" and path == "/routing/matrix/2":
+            matrix = _matrix(body or {})
+            if matrix is None:
+                return 400, {"detailedError": {"code": "BadRequest", "message": "invalid or too large matrix"}}
+            return 200, matrix
+        if provider == "tomtom" and method == "GET" and path.startswith("/search/2/geocode/"):
+            return 200, _geocode(_geocode_query_from_path(path))
+        if provider == "tomtom" and method == "POST" and path == "/search/2/batch/sync.json":
+            items = (body or {}).get("batchItems") or []
+            out = []
+            for item in items:
+                q = (item or {}).get("query") or ""
+                if q.startswith("/geocode/"):
+                    out.append({"statusCode": 200, "response": _geocode(_geocode_query_from_path(q))})
+                else:
+                    out.append({"statusCode": 400, "response": {"errorText": "unsupported query"}})
+            return 200, {"formatVersion": "0.0.1", "batchItems": out, "summary": {"successfulRequests": len(out), "totalRequests": len(out)}}
+        return 404, {"error": f"no stub for {method} {path}"}
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    stub: "ProviderStub"
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Clients that gave up (timeouts, losing hedged duplicates) hang up mid-response; expected, not a bug
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class ProviderStub:
+    """One provider's stub server on a background thread; `url` is its base URL once started."""
+
+    def __init__(
+        self,
+        provider: str,
+        *,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        if provider not in PROVIDERS:
+            raise ValueError(f"unknown provider {provider!r}; expected one of {', '.join(PROVIDERS)}")
+        self.provider = provider
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests: Dict[str, int] = {}
+        self._errors = 0
+        self._server = _StubHTTPServer((host, port), _Handler)
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "ProviderStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"{self.provider}-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self) -> None:
+        with self._lock:
+            delay_ms = self.latency_ms + (self._rng.random() * self.jitter_ms if self.jitter_ms else 0.0)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+
+    def fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def count(self, path: str, status: int) -> None:
+        kind = _path_kind(path)
+        with self._lock:
+            self._requests[kind] = self._requests.get(kind, 0) + 1
+            if status >= 400:
+                self._errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": sum(self._requests.values()), "errors": self._errors, "by_path": dict(self._requests)}
+
+    def __enter__(self) -> "ProviderStub":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+@contextmanager
+def running_stubs(**config: Any) -> Iterator[Dict[str, ProviderStub]]:
+    """
+    Start a stub per provider (keyword arguments as for ProviderStub) and point the backend at them:
+    <PROVIDER>_BASE_URL and, when unset, NEXTBILLION_API_KEY / TOMTOM_API_KEY. The environment is
+    restored on exit.
+    """
+    stubs = {name: ProviderStub(name, **config).start() for name in PROVIDERS}
+    env = {
+        "NEXTBILLION_BASE_URL": stubs["nextbillion"].url,
+        "TOMTOM_BASE_URL": stubs["tomtom"].url,
+        "NEXTBILLION_API_KEY": os.getenv("NEXTBILLION_API_KEY") or "stub",
+        "TOMTOM_API_KEY": os.getenv("TOMTOM_API_KEY") or "stub",
+    }
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        yield stubs
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        for stub in stubs.values():
+            stub.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve NextBillion/TomTom stand-ins until interrupted.")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--nextbillion-port", type=int, default=8801)
+    parser.add_argument("--tomtom-port", type=int, default=8802)
+    args = parser.parse_args(argv)
+    config = dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                  error_status=args.error_status, seed=args.seed)
+    stubs = [
+        ProviderStub("nextbillion", port=args.nextbillion_port, **config).start(),
+        ProviderStub("tomtom", port=args.tomtom_port, **config).start(),
+    ]
+    print(f"export NEXTBILLION_BASE_URL={stubs[0].url} TOMTOM_BASE_URL={stubs[1].url}")
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for stub in stubs:
+            stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
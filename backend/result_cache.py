@@ -0,0 +1,164 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Options that change how a result is computed or presented but not what it is
+# (geometry shaping and plan keeping are applied to cached results on the way out)
+_NON_SEMANTIC_OPTIONS = {"enrichment_workers", "no_cache", "geometry", "keep_plan"}
+
+
+def canonical_key(**parts: Any) -> str:
+    """
+    SHA-256 over a canonical JSON encoding (sorted keys, compact separators) of the given parts.
+    Callers pass mapped inputs and flags only; API keys must never be part of the hash.
+    """
+    options = parts.get("options")
+    if isinstance(options, dict):
+        parts["options"] = {k: v for k, v in options.items() if k not in _NON_SEMANTIC_OPTIONS}
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _LeaderCancelled(Exception):
+    """Set on an in-flight future whose computing caller was cancelled."""
+    pass
+
+
+def _retrieve(fut: "asyncio.Future") -> None:
+    if not fut.cancelled():
+        fut.exception()
+
+
+class ResultCache:
+    """
+    LRU + TTL cache of optimization results with in-flight coalescing: concurrent requests for the
+    same key share a single computation instead of each calling the providers. Works across the app
+    loop, the background provider loop and job threads.
+    """
+
+    def __init__(self, *, max_entries: int = 128, ttl_s: float = 600):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_locked(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored, value = entry
+        if time.time() - stored > self.ttl_s:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_locked(self, key: str, value: Dict[str, Any]) -> None:
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+        *,
+        cacheable: Callable[[Dict[str, Any]], bool] = lambda r: True,
+    ) -> Tuple[Dict[str, Any], str]:
+        """
+        Return (result, source) where source is "hit", "coalesced" or "miss".
+        Results are deep-copied on the way in and out so callers may mutate what they get.
+        Failed computations and results rejected by `cacheable` are not stored. If the computing
+        caller is cancelled, one of the waiters starts the computation again.
+        """
+        while True:
+            with self._lock:
+                cached = self._get_locked(key)
+                if cached is not None:
+                    self.hits += 1
+                    return copy.deepcopy(cached), "hit"
+                fut = self._inflight.get(key)
+                leader = fut is None
+                if leader:
+                    fut = Future()
+                    self._inflight[key] = fut
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+            waiter = asyncio.wrap_future(fut)
+            waiter.add_done_callback(_retrieve)  # this waiter may be gone by the time it fails
+            try:
+                # Shielded: a waiter going away must not cancel the shared future under the others
+                result = await asyncio.shield(waiter)
+            except _LeaderCancelled:
+                continue  # the computing caller went away; take over or join whoever did
+            return copy.deepcopy(result), "coalesced"
+
+        try:
+            result = await compute()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            # Waiters share real failures, but not this caller's cancellation (e.g. a client disconnect)
+            fut.set_exception(e if isinstance(e, Exception) else _LeaderCancelled())
+            # Nobody may be waiting; mark the exception as retrieved to avoid noisy logging
+            fut.exception()
+            raise
+        stored = copy.deepcopy(result)
+        with self._lock:
+            self._inflight.pop(key, None)
+            if cacheable(result):
+                self._put_locked(key, stored)
+        fut.set_result(stored)
+        return result, "miss"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "in_flight": len(self._inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+_default_cache: Optional[ResultCache] = None
+_default_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    Process-wide result cache configured from env RESULT_CACHE_MAX_ENTRIES (128) and
+    RESULT_CACHE_TTL_S (600). Set RESULT_CACHE_DISABLED=1 to bypass it.
+    """
+    global _default_cache
+    if os.getenv("RESULT_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = ResultCache(
+                    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES") or 128),
+                    ttl_s=float(os.getenv("RESULT_CACHE_TTL_S") or 600),
+                )
+    return _default_cache
@@ -0,0 +1,719 @@
+"""
+Offline road routing over a road-graph extract, as a local stand-in for TomTom calculateRoute.
+
+The extract is GeoJSON LineStrings (e.g. an OpenStreetMap export with highway / maxspeed / oneway
+tags). Every vertex becomes a node and every consecutive vertex pair an edge weighted by travel time
+at the tagged speed, or a default for the road class; adjacency is kept as CSR arrays. A contraction
+hierarchy over the largest strongly connected component answers point-to-point and one-to-many
+queries with two small upward searches, and shortcuts unpack to the original node sequence for
+geometry. The compiled graph and hierarchy are cached next to the extract (<path>.ch.npz), so only
+the first load pays for preprocessing.
+
+No-go zones can't be baked into a shared hierarchy. RoadRouter checks each unpacked path against the
+request's zones and re-routes the few that touch one with A* on the base graph, blocked edges removed.
+
+Configure with ROAD_GRAPH_PATH (GeoJSON or a compiled .npz) and select it for enrichment with
+ROUTING_PROVIDER=local or options.routing_provider = "local".
+"""
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from spatial_index import GridIndex
+from zones import ZoneIndex
+
+logger = logging.getLogger("optimizer")
+
+FORMAT_VERSION = 1
+EARTH_RADIUS_M = 6371000.0
+
+# Free-flow speeds by OSM highway class when an edge has no usable maxspeed
+ROAD_SPEEDS_KMH = {
+    "motorway": 100, "motorway_link": 60, "trunk": 80, "trunk_link": 50,
+    "primary": 60, "primary_link": 40, "secondary": 50, "secondary_link": 40,
+    "tertiary": 40, "tertiary_link": 30, "unclassified": 30, "residential": 30,
+    "living_street": 10, "service": 15, "road": 30,
+}
+DEFAULT_SPEED_KMH = 30.0
+# Stops are joined to their nearest routable node by a straight connector at this speed
+ACCESS_SPEED_KMH = 15.0
+DEFAULT_SNAP_MAX_M = 500.0
+# Witness searches during contraction stop after this many settled nodes (more shortcuts, never wrong ones)
+_WITNESS_SETTLE_LIMIT = 40
+
+Segment = Tuple[List[List[float]], float, float]  # (coords [[lon, lat], ...], distance_m, time_s), as utils
+
+
+class RoadGraphError(Exception):
+    pass
+
+
+def _haversine_m(lat1, lng1, lat2, lng2) -> np.ndarray:
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    h = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(np.asarray(lng2) - lng1) / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(h), np.sqrt(np.maximum(0.0, 1 - h)))
+
+
+def _parse_speed(props: Dict[str, Any]) -> float:
+    for key in ("speed_kmh", "maxspeed"):
+        raw = props.get(key)
+        if raw is None:
+            continue
+        text = str(raw).split(";")[0].strip().lower()
+        factor = 1.609344 if text.endswith("mph") else 1.0
+        try:
+            value = float(text.replace("mph", "").replace("km/h", "").strip()) * factor
+        except ValueError:
+            continue
+        if value > 0:
+            return value
+    return float(ROAD_SPEEDS_KMH.get(str(props.get("highway") or "").lower(), DEFAULT_SPEED_KMH))
+
+
+def _oneway(props: Dict[str, Any]) -> int:
+    """1: forward only, -1: reverse only, 0: both ways."""
+    raw = str(props.get("oneway") if props.get("oneway") is not None else "").strip().lower()
+    if raw in ("yes", "true", "1"):
+        return 1
+    if raw == "-1":
+        return -1
+    if raw in ("no", "false", "0"):
+        return 0
+    return 1 if str(props.get("junction") or "").lower() == "roundabout" else 0
+
+
+def _lines(geometry: Dict[str, Any]) -> List[List[List[float]]]:
+    kind = (geometry or {}).get("type")
+    if kind == "LineString":
+        return [geometry.get("coordinates") or []]
+    if kind == "MultiLineString":
+        return list(geometry.get("coordinates") or [])
+    return []
+
+
+def _edges_from_geojson(data: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(node lat, node lng, edge tail, edge head, edge speed m/s) with vertices shared by coordinate."""
+    lat_v: List[float] = []
+    lng_v: List[float] = []
+    seg_first: List[int] = []  # index of a segment's first vertex in lat_v/lng_v
+    seg_dir: List[int] = []
+    seg_speed: List[float] = []
+    for feature in data.get("features") or []:
+        props = feature.get("properties") or {}
+        if props.get("highway") in ("footway", "path", "steps", "cycleway", "pedestrian", "bridleway"):
+            continue
+        speed = _parse_speed(props) / 3.6
+        way = _oneway(props)
+        for line in _lines(feature.get("geometry") or {}):
+            if len(line) < 2:
+                continue
+            base = len(lat_v)
+            for pt in line:
+                lng_v.append(float(pt[0]))
+                lat_v.append(float(pt[1]))
+            seg_first.extend(range(base, base + len(line) - 1))
+            seg_dir.extend([way] * (len(line) - 1))
+            seg_speed.extend([speed] * (len(line) - 1))
+    if not seg_first:
+        raise RoadGraphError("road graph has no LineString roads")
+    lat = np.asarray(lat_v)
+    lng = np.asarray(lng_v)
+    # Vertices at the same coordinate (1e-7 degrees) are one node
+    keys = ((np.round(lat * 1e7).astype(np.int64) + 900_000_000) << 32) | (np.round(lng * 1e7).astype(np.int64) + 1_800_000_000)
+    uniq, first, node_of = np.unique(keys, return_index=True, return_inverse=True)
+    node_of = node_of.reshape(-1)
+    a = node_of[np.asarray(seg_first)]
+    b = node_of[np.asarray(seg_first) + 1]
+    way = np.asarray(seg_dir)
+    speed = np.asarray(seg_speed)
+    fwd = way >= 0
+    rev = way <= 0
+    tail = np.concatenate([a[fwd], b[rev]])
+    head = np.concatenate([b[fwd], a[rev]])
+    mps = np.concatenate([speed[fwd], speed[rev]])
+    keep = tail != head
+    return lat[first], lng[first], tail[keep], head[keep], mps[keep]
+
+
+def _csr(n: int, tail: np.ndarray, *cols: np.ndarray) -> Tuple[np.ndarray, ...]:
+    order = np.argsort(tail, kind="stable")
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tail, minlength=n), out=ptr[1:])
+    return (ptr,) + tuple(c[order] for c in cols)
+
+
+def _largest_scc(n: int, ptr: List[int], head: List[int], rptr: List[int], rhead: List[int]) -> np.ndarray:
+    """Mask of the largest strongly connected component (iterative Kosaraju)."""
+    seen = bytearray(n)
+    order: List[int] = []
+    for root in range(n):
+        if seen[root]:
+            continue
+        seen[root] = 1
+        stack = [(root, ptr[root])]
+        while stack:
+            u, i = stack[-1]
+            if i < ptr[u + 1]:
+                stack[-1] = (u, i + 1)
+                v = head[i]
+                if not seen[v]:
+                    seen[v] = 1
+                    stack.append((v, ptr[v]))
+            else:
+                order.append(u)
+                stack.pop()
+    comp = [-1] * n
+    sizes: List[int] = []
+    for root in reversed(order):
+        if comp[root] >= 0:
+            continue
+        c = len(sizes)
+        comp[root] = c
+        size = 0
+        stack2 = [root]
+        while stack2:
+            u = stack2.pop()
+            size += 1
+            for i in range(rptr[u], rptr[u + 1]):
+                v = rhead[i]
+                if comp[v] < 0:
+                    comp[v] = c
+                    stack2.append(v)
+        sizes.append(size)
+    if not sizes:
+        return np.zeros(n, dtype=bool)
+    return np.asarray(comp) == int(np.argmax(sizes))
+
+
+def _contract(n: int, tail: np.ndarray, head: np.ndarray, weight: np.ndarray, length: np.ndarray, active: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Contraction hierarchy over the `active` nodes: node order by lazy edge-difference priority,
+    shortcuts where a bounded witness search finds no path as short as through the contracted node.
+    Returns the upward (rank increasing) and downward search graphs as CSR arrays plus node ranks.
+    """
+    out_adj: List[Dict[int, List[float]]] = [{} for _ in range(n)]
+    in_adj: List[Dict[int, List[float]]] = [{} for _ in range(n)]
+    for u, v, w, d in zip(tail.tolist(), head.tolist(), weight.tolist(), length.tolist()):
+        if not (active[u] and active[v]):
+            continue
+        cur = out_adj[u].get(v)
+        if cur is None or w < cur[0]:
+            out_adj[u][v] = in_adj[v][u] = [w, d, -1]
+
+    def witness(src: int, skip: int, limit: float, targets: set) -> Dict[int, float]:
+        dist = {src: 0.0}
+        heap = [(0.0, src)]
+        settled = 0
+        left = len(targets)
+        while heap and settled < _WITNESS_SETTLE_LIMIT and left:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            if u in targets:
+                left -= 1
+            for v, e in out_adj[u].items():
+                if v == skip:
+                    continue
+                nd = d + e[0]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def shortcuts(v: int) -> List[Tuple[int, int, float, float, int]]:
+        outs = list(out_adj[v].items())
+        found = []
+        for u, (wu, du, _) in in_adj[v].items():
+            cands = {w: wu + e[0] for w, e in outs if w != u}
+            if not cands:
+                continue
+            dist = witness(u, v, max(cands.values()), set(cands))
+            for w, e in outs:
+                if w != u and dist.get(w, math.inf) > wu + e[0] + 1e-9:
+                    found.append((u, w, wu + e[0], du + e[1], v))
+        return found
+
+    deleted = [0] * n
+    level = [0] * n
+
+    def priority(v: int) -> float:
+        return 2 * len(shortcuts(v)) - len(in_adj[v]) - len(out_adj[v]) + deleted[v] + level[v]
+
+    nodes = np.flatnonzero(active).tolist()
+    heap = [(priority(v), v) for v in nodes]
+    heapq.heapify(heap)
+    rank = np.full(n, -1, dtype=np.int64)
+    up: List[Tuple[int, int, float, float, int]] = []
+    down: List[Tuple[int, int, float, float, int]] = []
+    r = 0
+    while heap:
+        _, v = heapq.heappop(heap)
+        p = priority(v)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))
+            continue
+        for u, w, wt, ln, mid in shortcuts(v):
+            cur = out_adj[u].get(w)
+            if cur is None or wt < cur[0]:
+                out_adj[u][w] = in_adj[w][u] = [wt, ln, mid]
+        # Remaining neighbours all rank above v: its edges become its search-graph edges
+        for w, (wt, ln, mid) in out_adj[v].items():
+            up.append((v, w, wt, ln, mid))
+            del in_adj[w][v]
+            deleted[w] += 1
+            level[w] = max(level[w], level[v] + 1)
+        for u, (wt, ln, mid) in in_adj[v].items():
+            down.append((v, u, wt, ln, mid))  # stored at v: original edge u -> v
+            del out_adj[u][v]
+            deleted[u] += 1
+            level[u] = max(level[u], level[v] + 1)
+        out_adj[v] = {}
+        in_adj[v] = {}
+        rank[v] = r
+        r += 1
+
+    out: Dict[str, np.ndarray] = {"rank": rank}
+    for name, edges in (("up", up), ("dn", down)):
+        arr = np.asarray(edges, dtype=float).reshape(-1, 5)
+        ptr, other, wt, ln, mid = _csr(
+            n, arr[:, 0].astype(np.int64), arr[:, 1].astype(np.int32), arr[:, 2], arr[:, 3].astype(np.float32), arr[:, 4].astype(np.int32),
+        )
+        out.update({f"{name}_ptr": ptr, f"{name}_node": other, f"{name}_time": wt, f"{name}_len": ln, f"{name}_mid": mid})
+    return out
+
+
+class RoadNetwork:
+    """
+    A compiled road graph: node coordinates, base CSR adjacency (time and length per edge), the
+    contraction hierarchy, and a grid index of routable nodes for snapping stops.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], *, source: Optional[str] = None, snap_max_m: float = DEFAULT_SNAP_MAX_M):
+        self.arrays = arrays
+        self.source = source
+        self.snap_max_m = float(snap_max_m)
+        self.lat = arrays["lat"]
+        self.lng = arrays["lng"]
+        self.n_nodes = int(len(self.lat))
+        self.n_edges = int(len(arrays["head"]))
+        routable = arrays["rank"] >= 0
+        self._routable_ids = np.flatnonzero(routable)
+        self._index = GridIndex(self.lat[routable], self.lng[routable])
+        self.max_mps = float(arrays["time"].size and (arrays["len"] / np.maximum(arrays["time"], 1e-6)).max()) or 1.0
+        # Python lists for the search loops: indexing them is several times faster than NumPy scalars
+        self._lat = self.lat.tolist()
+        self._lng = self.lng.tolist()
+        self._ptr = arrays["ptr"].tolist()
+        self._head = arrays["head"].tolist()
+        self._time = arrays["time"].astype(float).tolist()
+        self._len = arrays["len"].astype(float).tolist()
+        self._rank = arrays["rank"].tolist()
+        self._up = tuple(arrays["up_" + k].tolist() for k in ("ptr", "node", "time", "len", "mid"))
+        self._dn = tuple(arrays["dn_" + k].tolist() for k in ("ptr", "node", "time", "len", "mid"))
+
+    # -- building ----------------------------------------------------------
+
+    @classmethod
+    def from_geojson(cls, data: Dict[str, Any], **kwargs: Any) -> "RoadNetwork":
+        return cls(compile_graph(*_edges_from_geojson(data)), **kwargs)
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "RoadNetwork":
+        """Load a compiled .npz, or a GeoJSON extract through its <path>.ch.npz cache (rebuilt when stale)."""
+        if path.endswith(".npz"):
+            return cls(_read_npz(path), source=path, **kwargs)
+        stat = os.stat(path)
+        signature = f"{FORMAT_VERSION}:{stat.st_size}:{stat.st_mtime_ns}"
+        cache = path + ".ch.npz"
+        if os.path.exists(cache):
+            try:
+                arrays = _read_npz(cache)
+                if str(arrays.get("signature")) == signature:
+                    return cls(arrays, source=path, **kwargs)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("road graph cache %s unreadable, rebuilding: %s", cache, e)
+        t0 = time.perf_counter()
+        with open(path, encoding="utf-8") as f:
+            arrays = compile_graph(*_edges_from_geojson(json.load(f)))
+        logger.info("road graph %s compiled: nodes=%d edges=%d shortcuts=%d ms=%d", path, len(arrays["lat"]),
+                    len(arrays["head"]), len(arrays["up_node"]) + len(arrays["dn_node"]) - len(arrays["head"]),
+                    int((time.perf_counter() - t0) * 1000))
+        arrays["signature"] = np.asarray(signature)
+        try:
+            save_compiled(arrays, cache)
+        except OSError as e:
+            logger.warning("road graph cache %s not written: %s", cache, e)
+        return cls(arrays, source=path, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "nodes": self.n_nodes,
+            "edges": self.n_edges,
+            "routable_nodes": int(len(self._routable_ids)),
+            "ch_edges": len(self._up[1]) + len(self._dn[1]),
+        }
+
+    # -- snapping ----------------------------------------------------------
+
+    def snap(self, lats: Sequence[float], lngs: Sequence[float]) -> List[Optional[Tuple[int, float]]]:
+        """(node, metres) of the nearest routable node per point; None beyond snap_max_m or without coordinates."""
+        out: List[Optional[Tuple[int, float]]] = []
+        for hits in self._index.knn_many(lats, lngs, 1):
+            if hits and hits[0][1] <= self.snap_max_m:
+                out.append((int(self._routable_ids[hits[0][0]]), float(hits[0][1])))
+            else:
+                out.append(None)
+        return out
+
+    # -- hierarchy queries -------------------------------------------------
+
+    def _upward(self, graph: Tuple[list, ...], src: int, dist: Dict[int, float], parent: Dict[int, int], heap: list) -> Tuple[float, int]:
+        """Settle one node of an upward search; returns (its distance, node) or (inf, -1) when exhausted."""
+        ptr, node, wt, _, _ = graph
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in range(ptr[u], ptr[u + 1]):
+                v = node[e]
+                nd = d + wt[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    parent[v] = e
+                    heapq.heappush(heap, (nd, v))
+            return d, u
+        return math.inf, -1
+
+    def _ch_query(self, s: int, t: int) -> Optional[Tuple[float, int, Dict[int, int], Dict[int, int]]]:
+        """(time_s, meeting node, forward parents, backward parents) of the fastest s -> t path."""
+        if s == t:
+            return 0.0, s, {}, {}
+        df, db = {s: 0.0}, {t: 0.0}
+        pf: Dict[int, int] = {}
+        pb: Dict[int, int] = {}
+        qf, qb = [(0.0, s)], [(0.0, t)]
+        best, meet = math.inf, -1
+        while qf or qb:
+            kf = qf[0][0] if qf else math.inf
+            kb = qb[0][0] if qb else math.inf
+            if min(kf, kb) >= best:
+                break
+            if kf <= kb:
+                d, u = self._upward(self._up, s, df, pf, qf)
+                other = db
+            else:
+                d, u = self._upward(self._dn, t, db, pb, qb)
+                other = df
+            if u >= 0 and u in other and d + other[u] < best:
+                best, meet = d + other[u], u
+        if meet < 0:
+            return None
+        return best, meet, pf, pb
+
+    def _edge_nodes(self, a: int, b: int, mid: int, out: List[int]) -> None:
+        """Append the original nodes after `a` on edge a -> b (unpacking shortcuts through `mid`)."""
+        stack = [(a, b, mid)]
+        while stack:
+            x, y, m = stack.pop()
+            if m < 0:
+                out.append(y)
+                continue
+            # x -> m is stored downward at m, m -> y upward at m (m ranks below both)
+            first = self._find(self._dn, m, x)
+            second = self._find(self._up, m, y)
+            stack.append((m, y, second))
+            stack.append((x, m, first))
+
+    @staticmethod
+    def _find(graph: Tuple[list, ...], at: int, other: int) -> int:
+        ptr, node, _, _, mid = graph
+        for e in range(ptr[at], ptr[at + 1]):
+            if node[e] == other:
+                return mid[e]
+        raise RoadGraphError(f"hierarchy edge {at}-{other} missing")
+
+    def path(self, s: int, t: int) -> Optional[Tuple[List[int], float, float]]:
+        """(node sequence, metres, seconds) of the fastest s -> t route, or None if unreachable."""
+        found = self._ch_query(s, t)
+        if found is None:
+            return None
+        seconds, meet, pf, pb = found
+        up_ptr, up_node, _, up_len, up_mid = self._up
+        dn_ptr, dn_node, _, dn_len, dn_mid = self._dn
+        # Forward half: edges from s up to the meeting node, collected backwards
+        chain: List[Tuple[int, int, int]] = []
+        metres = 0.0
+        v = meet
+        while v != s:
+            e = pf[v]
+            u = _owner(up_ptr, e)
+            chain.append((u, v, up_mid[e]))
+            metres += up_len[e]
+            v = u
+        nodes = [s]
+        for u, v, m in reversed(chain):
+            self._edge_nodes(u, v, m, nodes)
+        # Backward half: the backward search walked original edges x -> y against their direction
+        x = meet
+        while x != t:
+            e = pb[x]
+            y = _owner(dn_ptr, e)
+            self._edge_nodes(x, y, dn_mid[e], nodes)
+            metres += dn_len[e]
+            x = y
+        return nodes, metres, seconds
+
+    def one_to_many(self, s: int, targets: Sequence[int]) -> List[Optional[Tuple[float, float]]]:
+        """(metres, seconds) from `s` to each target (None where unreachable): one forward search, pruned backward ones."""
+        up_ptr, up_node, up_time, up_len, _ = self._up
+        dn_ptr, dn_node, dn_time, dn_len, _ = self._dn
+        df = {s: 0.0}
+        lf = {s: 0.0}
+        heap = [(0.0, s)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > df[u]:
+                continue
+            for e in range(up_ptr[u], up_ptr[u + 1]):
+                v = up_node[e]
+                nd = d + up_time[e]
+                if nd < df.get(v, math.inf):
+                    df[v] = nd
+                    lf[v] = lf[u] + up_len[e]
+                    heapq.heappush(heap, (nd, v))
+        out: List[Optional[Tuple[float, float]]] = []
+        for t in targets:
+            db = {t: 0.0}
+            lb = {t: 0.0}
+            heap = [(0.0, t)]
+            best, best_len = math.inf, 0.0
+            while heap:
+                d, u = heapq.heappop(heap)
+                if d >= best:
+                    break
+                if d > db[u]:
+                    continue
+                if u in df and d + df[u] < best:
+                    best, best_len = d + df[u], lb[u] + lf[u]
+                for e in range(dn_ptr[u], dn_ptr[u + 1]):
+                    v = dn_node[e]
+                    nd = d + dn_time[e]
+                    if nd < db.get(v, math.inf):
+                        db[v] = nd
+                        lb[v] = lb[u] + dn_len[e]
+                        heapq.heappush(heap, (nd, v))
+            out.append((best_len, best) if best < math.inf else None)
+        return out
+
+    # -- base-graph search (no-go detours) ---------------------------------
+
+    def astar(self, s: int, t: int, blocked: Optional[Sequence[bool]] = None) -> Optional[Tuple[List[int], float, float]]:
+        """Fastest s -> t route on the base graph skipping `blocked` edges; (nodes, metres, seconds) or None."""
+        lat, lng, ptr, head, wt, ln = self._lat, self._lng, self._ptr, self._head, self._time, self._len
+        cos_t = math.cos(math.radians(lat[t]))
+        inv_speed = 1.0 / self.max_mps
+        k = math.pi / 180.0 * EARTH_RADIUS_M
+
+        def h(v: int) -> float:
+            # Equirectangular distance never exceeds the great-circle one by enough to matter at city scale
+            dx = (lng[v] - lng[t]) * cos_t
+            dy = lat[v] - lat[t]
+            return math.sqrt(dx * dx + dy * dy) * k * inv_speed * 0.99
+
+        dist = {s: 0.0}
+        parent: Dict[int, int] = {}
+        heap = [(h(s), s)]
+        done = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if u == t:
+                break
+            done.add(u)
+            d = dist[u]
+            for e in range(ptr[u], ptr[u + 1]):
+                if blocked is not None and blocked[e]:
+                    continue
+                v = head[e]
+                nd = d + wt[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    parent[v] = e
+                    heapq.heappush(heap, (nd + h(v), v))
+        if t not in dist:
+            return None
+        nodes = [t]
+        metres = 0.0
+        v = t
+        while v != s:
+            e = parent[v]
+            metres += ln[e]
+            v = _owner(ptr, e)
+            nodes.append(v)
+        nodes.reverse()
+        return nodes, metres, dist[t]
+
+    def blocked_edges(self, zone_index: ZoneIndex) -> Tuple[List[bool], np.ndarray]:
+        """(per base edge: touches a no-go zone, per node: inside one) for `zone_index`."""
+        node_in = zone_index.nogo_mask(self.lat, self.lng)
+        tail = np.repeat(np.arange(self.n_nodes), np.diff(self.arrays["ptr"]))
+        head = self.arrays["head"]
+        blocked = node_in[tail] | node_in[head]
+        lat1, lng1, lat2, lng2 = self.lat[tail], self.lng[tail], self.lat[head], self.lng[head]
+        for z in zone_index.nogo:
+            min_lat, min_lng, max_lat, max_lng = z.bbox
+            cand = np.flatnonzero(
+                ~blocked & (np.maximum(lat1, lat2) >= min_lat) & (np.minimum(lat1, lat2) <= max_lat)
+                & (np.maximum(lng1, lng2) >= min_lng) & (np.minimum(lng1, lng2) <= max_lng)
+            )
+            for e in cand.tolist():
+                blocked[e] = z.crosses(float(lat1[e]), float(lng1[e]), float(lat2[e]), float(lng2[e]))
+        return blocked.tolist(), node_in
+
+
+def _owner(ptr: List[int], e: int) -> int:
+    """Node whose CSR slice holds edge `e`."""
+    lo, hi = 0, len(ptr) - 2
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if ptr[mid] <= e:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def compile_graph(lat: np.ndarray, lng: np.ndarray, tail: np.ndarray, head: np.ndarray, speed_mps: np.ndarray) -> Dict[str, np.ndarray]:
+    """Base CSR arrays plus the contraction hierarchy over the largest strongly connected component."""
+    n = len(lat)
+    length = _haversine_m(lat[tail], lng[tail], lat[head], lng[head])
+    seconds = length / np.maximum(speed_mps, 0.5)
+    ptr, head_s, time_s, len_s, tail_s = _csr(n, tail, head.astype(np.int32), seconds, length.astype(np.float32), tail)
+    rptr, rhead = _csr(n, head, tail.astype(np.int32))
+    active = _largest_scc(n, ptr.tolist(), head_s.tolist(), rptr.tolist(), rhead.tolist())
+    arrays = {"lat": lat, "lng": lng, "ptr": ptr, "head": head_s, "time": time_s.astype(np.float32), "len": len_s}
+    arrays.update(_contract(n, tail_s, head_s, time_s, len_s, active))
+    return arrays
+
+
+def save_compiled(arrays: Dict[str, np.ndarray], path: str) -> None:
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def _read_npz(path: str) -> Dict[str, np.ndarray]:
+    with np.load(path, allow_pickle=False) as data:
+        return {k: data[k] for k in data.files}
+
+
+class RoadRouter:
+    """
+    Routes for one request: the network plus that request's no-go zones (blocked edges computed once).
+    route_run returns utils-style segments, None for legs it can't route (unsnappable or unreachable stops).
+    """
+
+    def __init__(self, network: RoadNetwork, zone_index: Optional[ZoneIndex] = None):
+        self.network = network
+        self.zone_index = zone_index if zone_index is not None and zone_index.nogo else None
+        self._blocked: Optional[List[bool]] = None
+        self._node_in: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.detours = 0
+
+    def _path(self, s: int, t: int) -> Optional[Tuple[List[int], float, float]]:
+        found = self.network.path(s, t)
+        if self.zone_index is None or found is None:
+            return found
+        with self._lock:  # route_run runs in worker threads, one per vehicle
+            if self._blocked is None:
+                self._blocked, self._node_in = self.network.blocked_edges(self.zone_index)
+        nodes = found[0]
+        net = self.network
+        touches = bool(self._node_in[nodes].any())
+        if not touches:
+            coords = [[net._lng[v], net._lat[v]] for v in nodes]
+            touches = bool(self.zone_index.route_crossings(coords))
+        if not touches:
+            return found
+        self.detours += 1
+        return net.astar(s, t, self._blocked)
+
+    def route_run(self, run: List[Dict[str, float]]) -> List[Optional[Segment]]:
+        """One segment per consecutive pair of `run` ({lat, lng} stops)."""
+        net = self.network
+        snaps = net.snap([p["lat"] for p in run], [p["lng"] for p in run])
+        access_mps = ACCESS_SPEED_KMH / 3.6
+        out: List[Optional[Segment]] = []
+        for i in range(len(run) - 1):
+            a, b = snaps[i], snaps[i + 1]
+            if a is None or b is None:
+                out.append(None)
+                continue
+            found = self._path(a[0], b[0])
+            if found is None:
+                out.append(None)
+                continue
+            nodes, metres, seconds = found
+            coords = [[run[i]["lng"], run[i]["lat"]]]
+            coords.extend([net._lng[v], net._lat[v]] for v in nodes)
+            coords.append([run[i + 1]["lng"], run[i + 1]["lat"]])
+            connectors = a[1] + b[1]
+            out.append((coords, metres + connectors, seconds + connectors / access_mps))
+        return out
+
+    def one_to_many(self, origin: Dict[str, float], destinations: List[Dict[str, float]]) -> List[Optional[Tuple[float, float]]]:
+        """(metres, seconds) from `origin` to each destination through the hierarchy (no-go zones not applied)."""
+        net = self.network
+        snaps = net.snap([origin["lat"]] + [p["lat"] for p in destinations], [origin["lng"]] + [p["lng"] for p in destinations])
+        if snaps[0] is None:
+            return [None] * len(destinations)
+        targets = [s for s in snaps[1:] if s is not None]
+        found = iter(net.one_to_many(snaps[0][0], [s[0] for s in targets]))
+        access_mps = ACCESS_SPEED_KMH / 3.6
+        out: List[Optional[Tuple[float, float]]] = []
+        for snap in snaps[1:]:
+            hit = next(found) if snap is not None else None
+            if hit is None:
+                out.append(None)
+                continue
+            connectors = snaps[0][1] + snap[1]
+            out.append((hit[0] + connectors, hit[1] + connectors / access_mps))
+        return out
+
+
+_default_network: Optional[RoadNetwork] = None
+_default_failed = False
+_default_lock = threading.Lock()
+
+
+def get_road_network() -> Optional[RoadNetwork]:
+    """
+    Process-wide network from ROAD_GRAPH_PATH (None when unset or unloadable). The first call loads,
+    and if needed compiles, the graph; ROAD_SNAP_MAX_M (500) bounds how far a stop may be from a road.
+    """
+    global _default_network, _default_failed
+    path = os.getenv("ROAD_GRAPH_PATH")
+    if not path:
+        return None
+    if _default_network is None and not _default_failed:
+        with _default_lock:
+            if _default_network is None and not _default_failed:
+                try:
+                    _default_network = RoadNetwork.load(path, snap_max_m=float(os.getenv("ROAD_SNAP_MAX_M") or DEFAULT_SNAP_MAX_M))
+                except (OSError, ValueError, KeyError, RoadGraphError) as e:
+                    _default_failed = True
+                    logger.warning("road graph %s not loaded: %s", path, e)
+    return _default_network
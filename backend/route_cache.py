@@ -0,0 +1,171 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+Segment = Tuple[List[List[float]], float, float]  # (coords [[lon, lat], ...], distance_m, time_s)
+
+
+class SegmentCache:
+    """
+    Cache for TomTom route segments keyed on quantized endpoints plus routing restrictions.
+
+    Endpoints are rounded to `precision` decimal places (5 ~ 1 m), so re-plans of the same stops
+    reuse legs even when coordinates jitter in the last digits. Entries are held in a bounded
+    in-memory LRU; when `path` is given they are also persisted to SQLite and survive restarts.
+    `ttl_s` bounds how long traffic-aware travel times are trusted.
+    """
+
+    def __init__(
+        self,
+        *,
+        precision: int = 5,
+        max_entries: int = 20_000,
+        ttl_s: float = 24 * 3600,
+        path: Optional[str] = None,
+        max_disk_entries: int = 500_000,
+    ):
+        self.precision = int(precision)
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.max_disk_entries = max(1, int(max_disk_entries))
+        self._mem: "OrderedDict[str, Tuple[float, Segment]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_size = 0
+        if path:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                " key TEXT PRIMARY KEY, coords TEXT NOT NULL, distance_m REAL NOT NULL,"
+                " time_s REAL NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS segments_accessed ON segments(accessed)")
+            self._disk_size = self._conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(
+        self,
+        start: Dict[str, float],
+        end: Dict[str, float],
+        avoid_param: str,
+        vehicle_params: Dict[str, Any],
+    ) -> str:
+        p = self.precision
+        ends = "%.*f,%.*f:%.*f,%.*f" % (
+            p, float(start["lat"]), p, float(start["lng"]), p, float(end["lat"]), p, float(end["lng"]),
+        )
+        vparams = "&".join(f"{k}={vehicle_params[k]}" for k in sorted(vehicle_params or {}))
+        return f"{ends}|{avoid_param or ''}|{vparams}"
+
+    def get(self, key: str) -> Optional[Segment]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                created, seg = entry
+                if now - created <= self.ttl_s:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return seg
+                del self._mem[key]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT coords, distance_m, time_s, created FROM segments WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[3] <= self.ttl_s:
+                    self._conn.execute("UPDATE segments SET accessed = ? WHERE key = ?", (now, key))
+                    seg = (json.loads(row[0]), float(row[1]), float(row[2]))
+                    self._remember(key, row[3], seg)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return seg
+            self.misses += 1
+            return None
+
+    def put(self, key: str, seg: Segment) -> None:
+        now = time.time()
+        coords, distance_m, time_s = seg
+        with self._lock:
+            self._remember(key, now, seg)
+            if self._conn is None:
+                return
+            exists = self._conn.execute("SELECT 1 FROM segments WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO segments (key, coords, distance_m, time_s, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(coords, separators=(",", ":")), float(distance_m), float(time_s), now, now),
+            )
+            if not exists:
+                self._disk_size += 1
+            excess = self._disk_size - self.max_disk_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM segments WHERE key IN"
+                    " (SELECT key FROM segments ORDER BY accessed ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._disk_size -= excess
+
+    def _remember(self, key: str, created: float, seg: Segment) -> None:
+        self._mem[key] = (created, seg)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM segments")
+                self._disk_size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "max_entries": self.max_entries,
+                "disk_entries": self._disk_size if self._conn is not None else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_default_cache: Optional[SegmentCache] = None
+_default_lock = threading.Lock()
+
+
+def get_segment_cache() -> Optional[SegmentCache]:
+    """
+    Process-wide segment cache configured from env:
+    ROUTE_CACHE_PRECISION, ROUTE_CACHE_MAX_ENTRIES, ROUTE_CACHE_TTL_S and ROUTE_CACHE_PATH
+    (enables SQLite persistence). Set ROUTE_CACHE_DISABLED=1 to bypass caching entirely.
+    """
+    global _default_cache
+    if os.getenv("ROUTE_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = SegmentCache(
+                    precision=int(os.getenv("ROUTE_CACHE_PRECISION") or 5),
+                    max_entries=int(os.getenv("ROUTE_CACHE_MAX_ENTRIES") or 20_000),
+                    ttl_s=float(os.getenv("ROUTE_CACHE_TTL_S") or 24 * 3600),
+                    path=os.getenv("ROUTE_CACHE_PATH") or None,
+                )
+    return _default_cache
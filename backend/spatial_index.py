@@ -0,0 +1,265 @@
+"""
+Uniform grid index over lat/lng points for the solvers' proximity queries.
+
+Points are projected once to local equirectangular metres around the data's mean latitude and
+bucketed into square cells sized for a handful of points each. Queries walk rings of cells
+outward from the query cell and rank candidates by exact haversine distance, so answers match a
+brute-force scan while touching only nearby points. Build it once per request.
+"""
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+# Equirectangular distances can under-estimate haversine slightly away from the reference latitude;
+# ring pruning keeps this much slack so it never drops a true neighbour at city/region scale
+_PRUNE_SLACK = 1.02
+
+
+class GridIndex:
+    """
+    Static grid over `lats`/`lngs` (NaN entries are skipped). `cell_m` defaults to a size giving about
+    `points_per_cell` points per occupied cell. Returned ids are positions in the input arrays.
+    """
+
+    def __init__(
+        self,
+        lats: Sequence[float],
+        lngs: Sequence[float],
+        *,
+        cell_m: Optional[float] = None,
+        points_per_cell: float = 4.0,
+    ):
+        t0 = time.perf_counter()
+        lat = np.asarray(lats, dtype=float)
+        lng = np.asarray(lngs, dtype=float)
+        ok = ~(np.isnan(lat) | np.isnan(lng))
+        self.ids = np.nonzero(ok)[0]
+        self.size = int(len(self.ids))
+        self._phi = np.radians(lat[self.ids])
+        self._lam = np.radians(lng[self.ids])
+        self._cos_phi = np.cos(self._phi)
+        self._lat0 = float(np.mean(self._phi)) if self.size else 0.0
+        self._kx = EARTH_RADIUS_M * math.cos(self._lat0)
+        x, y = self._project(self._phi, self._lam)
+
+        if cell_m is None:
+            if self.size > 1:
+                area = max(float(np.ptp(x)) * float(np.ptp(y)), 1.0)
+                cell_m = math.sqrt(area * points_per_cell / self.size)
+            else:
+                cell_m = 1000.0
+        self.cell_m = max(float(cell_m), 1.0)
+        self._x0 = float(x.min()) if self.size else 0.0
+        self._y0 = float(y.min()) if self.size else 0.0
+        cx = ((x - self._x0) // self.cell_m).astype(np.int64)
+        cy = ((y - self._y0) // self.cell_m).astype(np.int64)
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if self.size:
+            order = np.lexsort((cy, cx))
+            keys = np.stack([cx[order], cy[order]], axis=1)
+            breaks = np.nonzero(np.any(np.diff(keys, axis=0) != 0, axis=1))[0] + 1
+            for chunk in np.split(order, breaks):
+                self._cells[(int(cx[chunk[0]]), int(cy[chunk[0]]))] = chunk
+            self._max_cx, self._max_cy = int(cx.max()), int(cy.max())
+        else:
+            self._max_cx = self._max_cy = 0
+        self.build_ms = (time.perf_counter() - t0) * 1000.0
+        self.queries = 0
+        self.query_ms = 0.0
+
+    def _project(self, phi, lam):
+        return lam * self._kx, phi * EARTH_RADIUS_M
+
+    def _cell_of(self, lat: float, lng: float) -> Tuple[int, int, float, float]:
+        x, y = self._project(math.radians(lat), math.radians(lng))
+        return int((x - self._x0) // self.cell_m), int((y - self._y0) // self.cell_m), x, y
+
+    def _ring(self, cx: int, cy: int, r: int) -> List[np.ndarray]:
+        """Occupied cells on the square ring at Chebyshev distance `r` from (cx, cy), clipped to the grid."""
+        if r == 0:
+            chunk = self._cells.get((cx, cy))
+            return [chunk] if chunk is not None else []
+        mx, my = self._max_cx, self._max_cy
+        keys = []
+        x_lo, x_hi = max(cx - r, 0), min(cx + r, mx)
+        for y in (cy - r, cy + r):
+            if 0 <= y <= my:
+                keys.extend((x, y) for x in range(x_lo, x_hi + 1))
+        y_lo, y_hi = max(cy - r + 1, 0), min(cy + r - 1, my)
+        for x in (cx - r, cx + r):
+            if 0 <= x <= mx:
+                keys.extend((x, y) for y in range(y_lo, y_hi + 1))
+        cells = self._cells
+        return [cells[key] for key in keys if key in cells]
+
+    def _haversine(self, lat: float, lng: float, pos: np.ndarray) -> np.ndarray:
+        phi = math.radians(lat)
+        dphi = self._phi[pos] - phi
+        dlam = self._lam[pos] - math.radians(lng)
+        a = np.sin(dphi / 2) ** 2 + math.cos(phi) * self._cos_phi[pos] * np.sin(dlam / 2) ** 2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def _ring_clearance(self, x: float, y: float, cx: int, cy: int, r: int) -> float:
+        """Lower bound on the projected distance from (x, y) to any cell outside rings 0..r."""
+        fx = x - self._x0 - cx * self.cell_m
+        fy = y - self._y0 - cy * self.cell_m
+        edge = min(fx, self.cell_m - fx, fy, self.cell_m - fy)
+        return max(0.0, edge) + r * self.cell_m
+
+    def knn(self, lat: float, lng: float, k: int, *, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Up to `k` nearest points as [(id, metres)], closest first (ties by id). `exclude` skips one id."""
+        t0 = time.perf_counter()
+        out: List[Tuple[int, float]] = []
+        if self.size and k > 0 and lat is not None and lng is not None:
+            cx, cy, x, y = self._cell_of(lat, lng)
+            need = k + (1 if exclude is not None else 0)
+            # Rings closer than the grid's bounding box are empty; rings past r_end hold nothing new
+            r = max(0, -cx, -cy, cx - self._max_cx, cy - self._max_cy)
+            r_end = max(cx, cy, self._max_cx - cx, self._max_cy - cy)
+            pos_parts: List[np.ndarray] = []
+            d_parts: List[np.ndarray] = []
+            found = 0
+            while r <= r_end:
+                for chunk in self._ring(cx, cy, r):
+                    pos_parts.append(chunk)
+                    d_parts.append(self._haversine(lat, lng, chunk))
+                    found += len(chunk)
+                if found >= need:
+                    kth = np.partition(np.concatenate(d_parts), need - 1)[need - 1]
+                    if kth * _PRUNE_SLACK <= self._ring_clearance(x, y, cx, cy, r):
+                        break
+                r += 1
+            if pos_parts:
+                pos = np.concatenate(pos_parts)
+                d = np.concatenate(d_parts)
+                for j in np.lexsort((self.ids[pos], d)):
+                    pid = int(self.ids[pos[j]])
+                    if pid == exclude:
+                        continue
+                    out.append((pid, float(d[j])))
+                    if len(out) >= k:
+                        break
+        self.queries += 1
+        self.query_ms += (time.perf_counter() - t0) * 1000.0
+        return out
+
+    def knn_many(
+        self,
+        lats: Sequence[float],
+        lngs: Sequence[float],
+        k: int,
+        *,
+        exclude: Optional[Sequence[int]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        knn() for many query points at once; `exclude[i]` (if given) is an id to skip for query i.
+        Queries falling in the same cell share one candidate set (rings grown until they provably hold
+        every member's k nearest), so each cell is answered with a single vectorized distance block.
+        """
+        t0 = time.perf_counter()
+        qlat = np.asarray(lats, dtype=float)
+        qlng = np.asarray(lngs, dtype=float)
+        out: List[List[Tuple[int, float]]] = [[] for _ in range(len(qlat))]
+        ok = ~(np.isnan(qlat) | np.isnan(qlng))
+        if self.size and k > 0 and ok.any():
+            need = k + (1 if exclude is not None else 0)
+            qi = np.nonzero(ok)[0]
+            qphi = np.radians(qlat[qi])
+            qlam = np.radians(qlng[qi])
+            x, y = self._project(qphi, qlam)
+            cx = ((x - self._x0) // self.cell_m).astype(np.int64)
+            cy = ((y - self._y0) // self.cell_m).astype(np.int64)
+            order = np.lexsort((cy, cx))
+            keys = np.stack([cx[order], cy[order]], axis=1)
+            breaks = np.nonzero(np.any(np.diff(keys, axis=0) != 0, axis=1))[0] + 1
+            for group in np.split(order, breaks):
+                gx, gy = int(cx[group[0]]), int(cy[group[0]])
+                r = max(0, -gx, -gy, gx - self._max_cx, gy - self._max_cy)
+                r_end = max(gx, gy, self._max_cx - gx, self._max_cy - gy)
+                parts: List[np.ndarray] = []
+                while True:
+                    parts.extend(self._ring(gx, gy, r))
+                    if r >= r_end:
+                        break
+                    if parts and sum(len(p) for p in parts) >= need:
+                        d = self._block(qphi[group], qlam[group], np.concatenate(parts))
+                        kth = np.partition(d, need - 1, axis=1)[:, need - 1].max()
+                        # Points outside rings 0..r are at least r cells from every query in this cell
+                        if kth * _PRUNE_SLACK <= r * self.cell_m:
+                            break
+                    r += 1
+                if not parts:
+                    continue
+                cand = np.concatenate(parts)
+                cand_ids = self.ids[cand]
+                d = self._block(qphi[group], qlam[group], cand)
+                for row, q in enumerate(qi[group].tolist()):
+                    skip = int(exclude[q]) if exclude is not None else None
+                    hits = out[q]
+                    for j in np.lexsort((cand_ids, d[row]))[:need]:
+                        pid = int(cand_ids[j])
+                        if pid != skip and len(hits) < k:
+                            hits.append((pid, float(d[row, j])))
+        self.queries += len(qlat)
+        self.query_ms += (time.perf_counter() - t0) * 1000.0
+        return out
+
+    def _block(self, phi: np.ndarray, lam: np.ndarray, pos: np.ndarray) -> np.ndarray:
+        """Haversine metres between query points (rows) and indexed positions `pos` (columns)."""
+        phi1 = phi[:, None]
+        dphi = self._phi[pos][None, :] - phi1
+        dlam = self._lam[pos][None, :] - lam[:, None]
+        a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * self._cos_phi[pos][None, :] * np.sin(dlam / 2) ** 2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def radius(self, lat: float, lng: float, radius_m: float) -> List[Tuple[int, float]]:
+        """All points within `radius_m` metres as [(id, metres)], closest first."""
+        t0 = time.perf_counter()
+        out: List[Tuple[int, float]] = []
+        if self.size and lat is not None and lng is not None:
+            cx, cy, _, _ = self._cell_of(lat, lng)
+            reach = int(math.ceil(radius_m * _PRUNE_SLACK / self.cell_m))
+            parts = [
+                chunk
+                for dx in range(-reach, reach + 1)
+                for dy in range(-reach, reach + 1)
+                for chunk in (self._cells.get((cx + dx, cy + dy)),)
+                if chunk is not None
+            ] if (2 * reach + 1) ** 2 <= 4 * len(self._cells) else [np.arange(self.size)]
+            if parts:
+                pos = np.concatenate(parts)
+                d = self._haversine(lat, lng, pos)
+                keep = d <= radius_m
+                pos, d = pos[keep], d[keep]
+                for j in np.lexsort((self.ids[pos], d)):
+                    out.append((int(self.ids[pos[j]]), float(d[j])))
+        self.queries += 1
+        self.query_ms += (time.perf_counter() - t0) * 1000.0
+        return out
+
+    def nearest(self, lat: float, lng: float) -> Optional[int]:
+        hit = self.knn(lat, lng, 1)
+        return hit[0][0] if hit else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "points": self.size,
+            "cells": len(self._cells),
+            "cell_m": round(self.cell_m, 1),
+            "build_ms": round(self.build_ms, 3),
+            "queries": self.queries,
+            "query_ms": round(self.query_ms, 3),
+        }
+
+
+def neighbour_lists(index: GridIndex, k: int) -> Dict[int, List[int]]:
+    """Granular neighbourhoods for local search: {id: ids of its `k` nearest other indexed points}."""
+    lat = np.degrees(index._phi)
+    lng = np.degrees(index._lam)
+    hits = index.knn_many(lat, lng, k, exclude=index.ids)
+    return {int(pid): [j for j, _ in row] for pid, row in zip(index.ids.tolist(), hits)}
+
+
@@ -0,0 +1,194 @@
+"""
+Seeded synthetic fleets in the input_vehicles.csv / input_shipments.csv schemas, for benchmarks.
+
+Stops are drawn around a handful of hotspots inside `radius_km` of a city centre (Los Angeles by
+default), so routes look like real urban work rather than uniform noise. The same seed always gives
+the same rows. generate_road_grid writes a matching street grid for the offline router
+(road_network.py).
+
+CLI:
+    python backend/synth.py --vehicles 20 --shipments 150 --seed 1 --out-dir /tmp/fleet [--road-grid-km 10]
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Column order of the templates at the repo root
+VEHICLE_HEADERS = [
+    "id", "vehicle_description", "capacity", "start_latitude", "start_longitude",
+    "end_latitude", "end_longitude", "shift_start", "shift_end", "max_tasks",
+]
+SHIPMENT_HEADERS = [
+    "Pickup Id", "Delivery Id", "Description", "Pickup Location Lat", "Pickup Location Lng",
+    "Pickup Start Time", "Pickup End Time", "Delivery Location Lat", "Delivery Location Lng",
+    "Delivery Start Time", "Delivery End Time", "Quantity", "Priority",
+]
+
+DEFAULT_CENTER = (34.0522, -118.2437)
+DEFAULT_DAY = "2023-02-18"
+_TIME_FMT = "%Y-%m-%d %H:%M:%S"
+_VEHICLE_TYPES = [("Minivan", 25), ("Cargo Van", 40), ("Box Truck", 80)]
+_STREETS = ["Main St", "Broadway", "Sunset Blvd", "Figueroa St", "Olympic Blvd", "Vermont Ave", "Alameda St", "Wilshire Blvd"]
+
+Table = Dict[str, Any]  # {"headers": [...], "rows": [[str, ...], ...]}, as posted to /api/optimize
+
+
+def _points(rng: np.random.Generator, n: int, hotspots: np.ndarray, center: Tuple[float, float], radius_km: float) -> np.ndarray:
+    """n (lat, lng) points: 80% scattered around a random hotspot, the rest uniform over the disc."""
+    lat0, lng0 = center
+    km_lat = 1 / 111.32
+    km_lng = 1 / (111.32 * math.cos(math.radians(lat0)))
+    around = rng.random(n) < 0.8
+    spot = hotspots[rng.integers(0, len(hotspots), n)]
+    spread = rng.normal(0.0, radius_km * 0.08, (n, 2))
+    r = radius_km * np.sqrt(rng.random(n))
+    theta = rng.random(n) * 2 * math.pi
+    uniform = np.column_stack((r * np.cos(theta), r * np.sin(theta)))
+    km = np.where(around[:, None], spot + spread, uniform)
+    return np.column_stack((lat0 + km[:, 0] * km_lat, lng0 + km[:, 1] * km_lng))
+
+
+def generate_fleet(
+    n_vehicles: int,
+    n_shipments: int,
+    *,
+    seed: int = 0,
+    center: Tuple[float, float] = DEFAULT_CENTER,
+    radius_km: float = 25.0,
+    day: str = DEFAULT_DAY,
+    window_min: int = 60,
+) -> Tuple[Table, Table]:
+    """
+    (vehicles, shipments) tables with string cells, like an uploaded CSV. Shifts run 08:00-18:00;
+    pickups open between 08:00 and 15:00 for `window_min` minutes, deliveries 1-3 hours later.
+    max_tasks (stops, two per shipment; see Problem) leaves the fleet about 50% headroom over an
+    even split.
+    """
+    rng = np.random.default_rng(seed)
+    n_hot = max(3, min(40, int(math.sqrt(max(n_shipments, 1)) // 2)))
+    r = radius_km * 0.7 * np.sqrt(rng.random(n_hot))
+    theta = rng.random(n_hot) * 2 * math.pi
+    hotspots = np.column_stack((r * np.cos(theta), r * np.sin(theta)))
+
+    t0 = datetime.strptime(day + " 08:00:00", _TIME_FMT)
+    shift_start, shift_end = t0.strftime(_TIME_FMT), (t0 + timedelta(hours=10)).strftime(_TIME_FMT)
+    max_tasks = max(10, math.ceil(2 * 1.5 * n_shipments / max(n_vehicles, 1)))
+    depots = _points(rng, n_vehicles, hotspots, center, radius_km)
+    kinds = rng.integers(0, len(_VEHICLE_TYPES), n_vehicles)
+    vehicles = []
+    for v in range(n_vehicles):
+        name, capacity = _VEHICLE_TYPES[kinds[v]]
+        lat, lng = f"{depots[v, 0]:.8f}", f"{depots[v, 1]:.7f}"
+        vehicles.append([str(v + 1), name, str(capacity), lat, lng, lat, lng, shift_start, shift_end, str(max_tasks)])
+
+    pickups = _points(rng, n_shipments, hotspots, center, radius_km)
+    drops = _points(rng, n_shipments, hotspots, center, radius_km)
+    open_min = rng.integers(0, 7 * 12, n_shipments) * 5
+    lead_min = rng.integers(12, 37, n_shipments) * 5
+    quantity = rng.integers(1, 9, n_shipments)
+    priority = rng.integers(1, 11, n_shipments) * 10
+    window = timedelta(minutes=window_min)
+    shipments = []
+    for s in range(n_shipments):
+        p_open = t0 + timedelta(minutes=int(open_min[s]))
+        d_open = p_open + timedelta(minutes=int(lead_min[s]))
+        shipments.append([
+            str(s + 1), str(s + 1), f"Job {s + 1}",
+            f"{pickups[s, 0]:.8f}", f"{pickups[s, 1]:.7f}",
+            p_open.strftime(_TIME_FMT), (p_open + window).strftime(_TIME_FMT),
+            f"{drops[s, 0]:.8f}", f"{drops[s, 1]:.7f}",
+            d_open.strftime(_TIME_FMT), (d_open + window).strftime(_TIME_FMT),
+            str(quantity[s]), str(priority[s]),
+        ])
+    return {"headers": list(VEHICLE_HEADERS), "rows": vehicles}, {"headers": list(SHIPMENT_HEADERS), "rows": shipments}
+
+
+def generate_addresses(n: int, *, seed: int = 0, city: str = "Los Angeles, CA") -> List[str]:
+    """n free-text street addresses (with repeats, like real order lists) for geocoding benchmarks."""
+    rng = np.random.default_rng(seed)
+    numbers = rng.integers(1, 2000, n) * 2 + 1
+    streets = rng.integers(0, len(_STREETS), n)
+    return [f"{numbers[i]} {_STREETS[streets[i]]}, {city}" for i in range(n)]
+
+
+def generate_road_grid(
+    *,
+    seed: int = 0,
+    center: Tuple[float, float] = DEFAULT_CENTER,
+    size_km: float = 10.0,
+    spacing_m: float = 200.0,
+    drop: float = 0.05,
+) -> Dict[str, Any]:
+    """
+    A GeoJSON street grid (road_network's input) centred on `center`: residential blocks every
+    `spacing_m`, a primary road every fifth street, alternate residential streets one-way, and a
+    `drop` share of blocks missing so routes have to detour.
+    """
+    rng = np.random.default_rng(seed)
+    lat0, lng0 = center
+    n = max(2, int(size_km * 1000 / spacing_m) + 1)
+    deg_lat = spacing_m / 111320.0
+    deg_lng = spacing_m / (111320.0 * math.cos(math.radians(lat0)))
+    jitter = rng.normal(0.0, 0.08, (n, n, 2))
+    lats = lat0 + (np.arange(n)[:, None] - (n - 1) / 2 + jitter[..., 0]) * deg_lat
+    lngs = lng0 + (np.arange(n)[None, :] - (n - 1) / 2 + jitter[..., 1]) * deg_lng
+    features = []
+    for horizontal in (True, False):
+        for line in range(n):
+            arterial = line % 5 == 0
+            props: Dict[str, Any] = {"highway": "primary" if arterial else "residential"}
+            if not arterial and line % 2:
+                props["oneway"] = "yes" if line % 4 == 1 else "-1"
+            for k in range(n - 1):
+                if not arterial and rng.random() < drop:
+                    continue
+                ends = [(line, k), (line, k + 1)] if horizontal else [(k, line), (k + 1, line)]
+                coords = [[round(float(lngs[i, j]), 7), round(float(lats[i, j]), 7)] for i, j in ends]
+                features.append({"type": "Feature", "properties": props, "geometry": {"type": "LineString", "coordinates": coords}})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def optimize_payload(vehicles: Table, shipments: Table, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """An /api/optimize request body for generated tables."""
+    return {"vehicles": vehicles, "shipments": shipments, "zones": [], "options": dict(options or {})}
+
+
+def write_csv(table: Table, path: str) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(table["headers"])
+        w.writerows(table["rows"])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic fleet as input_vehicles.csv / input_shipments.csv.")
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--shipments", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--radius-km", type=float, default=25.0)
+    parser.add_argument("--window-min", type=int, default=60, help="pickup/delivery time window length")
+    parser.add_argument("--out-dir", default=".")
+    parser.add_argument("--road-grid-km", type=float, default=0.0, help="also write road_grid.geojson covering this many km")
+    args = parser.parse_args(argv)
+    vehicles, shipments = generate_fleet(
+        args.vehicles, args.shipments, seed=args.seed, radius_km=args.radius_km, window_min=args.window_min,
+    )
+    os.makedirs(args.out_dir, exist_ok=True)
+    write_csv(vehicles, os.path.join(args.out_dir, "input_vehicles.csv"))
+    write_csv(shipments, os.path.join(args.out_dir, "input_shipments.csv"))
+    if args.road_grid_km > 0:
+        with open(os.path.join(args.out_dir, "road_grid.geojson"), "w", encoding="utf-8") as f:
+            json.dump(generate_road_grid(seed=args.seed, size_km=args.road_grid_km), f)
+    print(f"wrote {args.vehicles} vehicles and {args.shipments} shipments to {args.out_dir}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""
+Travel-time and distance matrices from TomTom Matrix Routing, for the local solver.
+
+An N x M request is reduced to its distinct (quantized) origins and destinations, every cell already
+in the MatrixCache is reused, and the remaining cells are tiled into blocks of at most
+TOMTOM_MATRIX_MAX_CELLS that go out concurrently on the pooled TomTom client. Cells from failed
+blocks are estimated by the travel model and flagged. The result is a pair of dense arrays.
+"""
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from http_client import get_client, provider_url, run_sync, ProviderHTTPError, ProviderTransportError
+from metrics import PROVIDER_CALL_SECONDS, PROVIDER_ERRORS, record
+from travel_model import get_travel_model, local_hour
+
+logger = logging.getLogger("optimizer")
+
+# Synchronous Matrix Routing v2 accepts at most this many origin x destination cells per request
+TOMTOM_MATRIX_MAX_CELLS = 200
+
+Cell = Tuple[float, float]  # (distance_m, time_s)
+
+
+class MatrixCache:
+    """
+    Matrix cells keyed on quantized origin and destination plus routing restrictions, in a bounded
+    in-memory LRU and, when `path` is given, SQLite. Like SegmentCache, but a cell is only
+    (distance_m, time_s), so a full matrix fits in memory where its route geometry wouldn't.
+    """
+
+    def __init__(
+        self,
+        *,
+        precision: int = 5,
+        max_entries: int = 500_000,
+        ttl_s: float = 24 * 3600,
+        path: Optional[str] = None,
+    ):
+        self.precision = int(precision)
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self._mem: "OrderedDict[str, Tuple[float, Cell]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cells ("
+                " key TEXT PRIMARY KEY, distance_m REAL NOT NULL, time_s REAL NOT NULL, created REAL NOT NULL)"
+            )
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def point_keys(self, lats: Sequence[float], lngs: Sequence[float]) -> List[str]:
+        p = self.precision
+        return ["%.*f,%.*f" % (p, lat, p, lng) for lat, lng in zip(lats, lngs)]
+
+    @staticmethod
+    def restriction_key(vehicle_params: Optional[Dict[str, Any]], depart_hour: Optional[int] = None) -> str:
+        vparams = "&".join(f"{k}={vehicle_params[k]}" for k in sorted(vehicle_params or {}))
+        return f"{vparams}|h={'' if depart_hour is None else depart_hour}"
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[Cell]]:
+        now = time.time()
+        out: List[Optional[Cell]] = []
+        disk: List[int] = []
+        with self._lock:
+            for key in keys:
+                entry = self._mem.get(key)
+                if entry is not None and now - entry[0] <= self.ttl_s:
+                    self._mem.move_to_end(key)
+                    out.append(entry[1])
+                    continue
+                if entry is not None:
+                    del self._mem[key]
+                out.append(None)
+                disk.append(len(out) - 1)
+            if disk and self._conn is not None:
+                for start in range(0, len(disk), 500):
+                    part = disk[start:start + 500]
+                    rows = self._conn.execute(
+                        "SELECT key, distance_m, time_s, created FROM cells WHERE key IN (%s)" % ",".join("?" * len(part)),
+                        [keys[i] for i in part],
+                    ).fetchall()
+                    found = {r[0]: r for r in rows if now - r[3] <= self.ttl_s}
+                    for i in part:
+                        row = found.get(keys[i])
+                        if row is not None:
+                            out[i] = (float(row[1]), float(row[2]))
+                            self._remember(keys[i], row[3], out[i])
+                            self.disk_hits += 1
+            found_n = sum(1 for c in out if c is not None)
+            self.hits += found_n
+            self.misses += len(out) - found_n
+        return out
+
+    def put_many(self, items: Sequence[Tuple[str, Cell]]) -> None:
+        now = time.time()
+        with self._lock:
+            for key, cell in items:
+                self._remember(key, now, cell)
+            if self._conn is not None and items:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO cells (key, distance_m, time_s, created) VALUES (?, ?, ?, ?)",
+                    [(key, float(d), float(t), now) for key, (d, t) in items],
+                )
+
+    def _remember(self, key: str, created: float, cell: Cell) -> None:
+        self._mem[key] = (created, cell)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM cells")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_default_cache: Optional[MatrixCache] = None
+_default_lock = threading.Lock()
+
+
+def get_matrix_cache() -> Optional[MatrixCache]:
+    """
+    Process-wide matrix cache configured from env: MATRIX_CACHE_PRECISION, MATRIX_CACHE_MAX_ENTRIES,
+    MATRIX_CACHE_TTL_S and MATRIX_CACHE_PATH (SQLite). Set MATRIX_CACHE_DISABLED=1 to bypass it.
+    """
+    global _default_cache
+    if os.getenv("MATRIX_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = MatrixCache(
+                    precision=int(os.getenv("MATRIX_CACHE_PRECISION") or 5),
+                    max_entries=int(os.getenv("MATRIX_CACHE_MAX_ENTRIES") or 500_000),
+                    ttl_s=float(os.getenv("MATRIX_CACHE_TTL_S") or 24 * 3600),
+                    path=os.getenv("MATRIX_CACHE_PATH") or None,
+                )
+    return _default_cache
+
+
+class TravelMatrix:
+    """
+    Dense origin x destination arrays: distance_m and time_s (0 where either point lacks coordinates)
+    and `estimated`, True for cells the travel model filled in. `stats` counts where cells came from.
+    """
+
+    def __init__(self, distance_m: np.ndarray, time_s: np.ndarray, estimated: np.ndarray, stats: Dict[str, Any]):
+        self.distance_m = distance_m
+        self.time_s = time_s
+        self.estimated = estimated
+        self.stats = stats
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.distance_m.shape
+
+
+def _matrix_options(vehicle_params: Optional[Dict[str, Any]], depart_at: Optional[str]) -> Dict[str, Any]:
+    """Matrix v2 `options` for calculateRoute-style vehicle params (see utils._build_vehicle_params)."""
+    opts: Dict[str, Any] = {"traffic": "historical", "routeType": "fastest"}
+    if depart_at:
+        opts["departAt"] = depart_at
+    for k, v in (vehicle_params or {}).items():
+        if str(v).lower() in ("true", "false"):
+            opts[k] = str(v).lower() == "true"
+        else:
+            try:
+                opts[k] = float(v)
+            except (TypeError, ValueError):
+                opts[k] = v
+    if opts.get("vehicleCommercial"):
+        opts["travelMode"] = "truck"
+    return opts
+
+
+def _tiles(rows: Sequence[int], cols: Sequence[int], max_cells: int) -> List[Tuple[List[int], List[int]]]:
+    """Blocks of at most max_cells covering rows x cols, shaped to need the fewest of them."""
+    max_cells = max(1, int(max_cells))
+    n, m = len(rows), len(cols)
+    if not n or not m:
+        return []
+    best = None
+    for height in range(1, min(n, max_cells) + 1):
+        width = min(m, max_cells // height)
+        count = math.ceil(n / height) * math.ceil(m / width)
+        if best is None or count < best[0]:
+            best = (count, height, width)
+    _, height, width = best
+    return [
+        (list(rows[i:i + height]), list(cols[j:j + width]))
+        for i in range(0, n, height)
+        for j in range(0, m, width)
+    ]
+
+
+async def _fetch_tile(
+    origins: List[Tuple[float, float]],
+    destinations: List[Tuple[float, float]],
+    key: str,
+    options: Dict[str, Any],
+) -> Optional[List[Tuple[int, int, float, float]]]:
+    """One Matrix Routing call; (origin, destination, distance_m, time_s) per routed cell, or None if it failed."""
+    body = {
+        "origins": [{"point": {"latitude": lat, "longitude": lng}} for lat, lng in origins],
+        "destinations": [{"point": {"latitude": lat, "longitude": lng}} for lat, lng in destinations],
+        "options": options,
+    }
+    t0 = time.perf_counter()
+    try:
+        data = await get_client("tomtom").post_json(
+            provider_url("tomtom", "/routing/matrix/2"), body, params={"key": key}, timeout=30, op="matrix",
+        )
+        cells = []
+        for item in data.get("data") or []:
+            summ = item.get("routeSummary")
+            if not summ:
+                continue  # per-cell detailedError: left for the travel model
+            cells.append((int(item["originIndex"]), int(item["destinationIndex"]),
+                          float(summ.get("lengthInMeters") or 0), float(summ.get("travelTimeInSeconds") or 0)))
+        return cells
+    except (ProviderHTTPError, ProviderTransportError, AttributeError, KeyError, TypeError, ValueError) as e:
+        PROVIDER_ERRORS.inc(provider="tomtom")
+        logger.warning("tomtom matrix %dx%d failed: %s", len(origins), len(destinations), e)
+        return None
+    finally:
+        elapsed = time.perf_counter() - t0
+        PROVIDER_CALL_SECONDS.observe(elapsed, provider="tomtom", call="matrix")
+        record("tomtom_matrix", elapsed)
+
+
+def _distinct(lats: np.ndarray, lngs: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(unique lat, unique lng, index into them per point) over points with coordinates; -1 for the rest."""
+    ok = ~(np.isnan(lats) | np.isnan(lngs))
+    inverse = np.full(len(lats), -1, dtype=np.int64)
+    if not ok.any():
+        return np.empty(0), np.empty(0), inverse
+    pts = np.round(np.column_stack((lats[ok], lngs[ok])), precision)
+    uniq, inv = np.unique(pts, axis=0, return_inverse=True)
+    inverse[ok] = inv.reshape(-1)
+    return uniq[:, 0], uniq[:, 1], inverse
+
+
+async def travel_matrix_async(
+    origin_lat: Sequence[float],
+    origin_lng: Sequence[float],
+    dest_lat: Optional[Sequence[float]] = None,
+    dest_lng: Optional[Sequence[float]] = None,
+    *,
+    key: str,
+    vehicle_params: Optional[Dict[str, Any]] = None,
+    depart_at: Optional[str] = None,
+    max_cells: Optional[int] = None,
+) -> TravelMatrix:
+    """
+    Travel-time and distance matrix from origins to destinations (to the origins themselves when
+    destinations are omitted). `depart_at` (ISO time) asks for historical traffic at that time; cached
+    cells are keyed on its hour. max_cells defaults to env TOMTOM_MATRIX_MAX_CELLS (200).
+    """
+    t0 = time.perf_counter()
+    olat, olng = np.asarray(origin_lat, dtype=float), np.asarray(origin_lng, dtype=float)
+    dlat = olat if dest_lat is None else np.asarray(dest_lat, dtype=float)
+    dlng = olng if dest_lng is None else np.asarray(dest_lng, dtype=float)
+    if max_cells is None:
+        max_cells = int(os.getenv("TOMTOM_MATRIX_MAX_CELLS") or TOMTOM_MATRIX_MAX_CELLS)
+    cache = get_matrix_cache()
+    precision = cache.precision if cache is not None else 5
+    u_olat, u_olng, o_inv = _distinct(olat, olng, precision)
+    u_dlat, u_dlng, d_inv = _distinct(dlat, dlng, precision)
+    n, m = len(u_olat), len(u_dlat)
+
+    dist = np.full((n, m), np.nan)
+    secs = np.full((n, m), np.nan)
+    same = (u_olat[:, None] == u_dlat[None, :]) & (u_olng[:, None] == u_dlng[None, :])
+    dist[same] = 0.0
+    secs[same] = 0.0
+    hour = local_hour(depart_at) if depart_at else None
+    key_at: Dict[Tuple[int, int], str] = {}
+    cached = 0
+    if cache is not None and n and m:
+        suffix = cache.restriction_key(vehicle_params, None if hour is None else int(hour))
+        o_keys, d_keys = cache.point_keys(u_olat.tolist(), u_olng.tolist()), cache.point_keys(u_dlat.tolist(), u_dlng.tolist())
+        key_at = {(i, j): f"{o_keys[i]}:{d_keys[j]}|{suffix}" for i, j in np.argwhere(~same).tolist()}
+        for (i, j), hit in zip(key_at, cache.get_many(list(key_at.values()))):
+            if hit is not None:
+                dist[i, j], secs[i, j] = hit
+                cached += 1
+
+    missing = np.isnan(dist)
+    rows = np.flatnonzero(missing.any(axis=1)).tolist()
+    cols = np.flatnonzero(missing.any(axis=0)).tolist()
+    tiles = [(r, c) for r, c in _tiles(rows, cols, max_cells) if missing[np.ix_(r, c)].any()] if rows else []
+    options = _matrix_options(vehicle_params, depart_at)
+    fetched_all = await asyncio.gather(*(
+        _fetch_tile(list(zip(u_olat[r].tolist(), u_olng[r].tolist())), list(zip(u_dlat[c].tolist(), u_dlng[c].tolist())), key, options)
+        for r, c in tiles
+    ))
+    fresh: List[Tuple[str, Cell]] = []
+    fetched = 0
+    failed_tiles = 0
+    for (r, c), cells in zip(tiles, fetched_all):
+        if cells is None:
+            failed_tiles += 1
+            continue
+        for oi, di, d, t in cells:
+            if not (0 <= oi < len(r) and 0 <= di < len(c)):
+                continue
+            i, j = r[oi], c[di]
+            if not missing[i, j]:
+                continue
+            dist[i, j], secs[i, j] = d, t
+            fetched += 1
+            if (i, j) in key_at:
+                fresh.append((key_at[(i, j)], (d, t)))
+    if cache is not None and fresh:
+        cache.put_many(fresh)
+
+    estimated = np.isnan(dist)
+    if estimated.any():
+        ii, jj = np.nonzero(estimated)
+        road_m, time_s = get_travel_model().estimate(u_olat[ii], u_olng[ii], u_dlat[jj], u_dlng[jj], hour)
+        dist[ii, jj] = road_m
+        secs[ii, jj] = time_s
+
+    # Back to the caller's rows and columns; points without coordinates get 0, as the solver expects
+    o_ok, d_ok = o_inv >= 0, d_inv >= 0
+    full_shape = (len(olat), len(dlat))
+    out_dist, out_time = np.zeros(full_shape), np.zeros(full_shape)
+    out_est = np.zeros(full_shape, dtype=bool)
+    if n and m:
+        sel = np.ix_(np.flatnonzero(o_ok), np.flatnonzero(d_ok))
+        pick = np.ix_(o_inv[o_ok], d_inv[d_ok])
+        out_dist[sel], out_time[sel], out_est[sel] = dist[pick], secs[pick], estimated[pick]
+    stats = {
+        "shape": list(full_shape),
+        "distinct": [n, m],
+        "cached": cached,
+        "fetched": fetched,
+        "estimated": int(estimated.sum()),
+        "calls": len(tiles),
+        "failed_calls": failed_tiles,
+        "ms": int((time.perf_counter() - t0) * 1000),
+    }
+    return TravelMatrix(out_dist, out_time, out_est, stats)
+
+
+def travel_matrix(*args: Any, **kwargs: Any) -> TravelMatrix:
+    """Blocking wrapper around travel_matrix_async for thread/CLI callers."""
+    return run_sync(travel_matrix_async(*args, **kwargs))
@@ -0,0 +1,310 @@
+"""
+Local travel-time model for legs TomTom did not route: road-distance detour factors and time-of-day
+speed profiles per region, kept as small NumPy lookup tables.
+
+Regions are REGION_DEG x REGION_DEG cells. Every cell starts from the built-in urban prior
+(DEFAULT_DETOUR, DEFAULT_SPEED_KMH) and is calibrated from the distance and travel time of legs
+TomTom returns: observations are shrunk towards the prior (more data, less prior), first per
+region and distance band across the day, then per hour. Tables are rebuilt lazily after new
+observations; lookups are vectorized for batch use, with a scalar path for ETA chains.
+
+Hours are local wall-clock hours. Timestamps are read as written: uploaded CSV times are naive
+local times and computed ETAs carry them through with a "Z" suffix (see problem._epoch), so the
+clock hour of either is the local hour. Only "now" (when calibrating) is converted, by
+longitude / 15 h, which is close enough for hourly profiles.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("optimizer")
+
+REGION_DEG = 0.5
+HOURS = 24
+# Distance bands (metres): detour factors are banded on straight-line distance, speeds on road distance
+BAND_EDGES_M = (1_000.0, 5_000.0, 20_000.0)
+N_BANDS = len(BAND_EDGES_M) + 1
+
+# Short hops wind through local streets; long legs follow arterials and highways
+DEFAULT_DETOUR = (1.45, 1.35, 1.28, 1.22)
+# Urban hourly profile for 1-5 km legs, scaled per band by _BAND_SPEED_FACTOR
+DEFAULT_SPEED_KMH = (
+    42, 44, 44, 44, 42, 38, 33, 26, 24, 27, 30, 30,
+    29, 29, 29, 28, 24, 22, 23, 28, 33, 36, 38, 40,
+)
+_BAND_SPEED_FACTOR = (0.7, 1.0, 1.4, 1.8)
+
+# Prior weights: straight-line metres for detour factors, seconds of driving for speeds
+_PRIOR_DETOUR_M = 10_000.0
+_PRIOR_SCALE_S = 1_800.0
+_PRIOR_HOUR_S = 1_200.0
+
+
+def _haversine_m(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """Element-wise great-circle metres between paired points."""
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    h = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(np.asarray(lng2) - lng1) / 2) ** 2
+    return 6371000.0 * 2 * np.arctan2(np.sqrt(h), np.sqrt(np.maximum(0.0, 1 - h)))
+
+
+def _bands(metres: np.ndarray) -> np.ndarray:
+    return np.searchsorted(BAND_EDGES_M, metres, side="right")
+
+
+def _prior_tables() -> Tuple[np.ndarray, np.ndarray]:
+    detour = np.asarray(DEFAULT_DETOUR, dtype=float)
+    speed = np.outer(_BAND_SPEED_FACTOR, DEFAULT_SPEED_KMH) / 3.6  # (band, hour) m/s
+    return detour, speed
+
+
+def local_hour(when: Any) -> Optional[float]:
+    """Fractional clock hour of a datetime, ISO string or epoch seconds as written; None if unparseable."""
+    if isinstance(when, (int, float)):
+        return (when % 86400.0) / 3600.0 if math.isfinite(when) else None
+    if isinstance(when, str):
+        try:
+            when = datetime.fromisoformat(when.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(when, datetime):
+        return None
+    return when.hour + when.minute / 60.0 + when.second / 3600.0
+
+
+def _hours_now(lng: np.ndarray) -> np.ndarray:
+    now = datetime.now(timezone.utc)
+    return (now.hour + now.minute / 60.0 + np.nan_to_num(lng) / 15.0) % HOURS
+
+
+class TravelModel:
+    """Per-region detour and hourly speed tables plus the calibration sums they are built from."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells: Dict[Tuple[int, int], int] = {}  # region cell -> row; row 0 is the uncalibrated prior
+        self._prior_detour, self._prior_speed = _prior_tables()
+        self._straight = np.zeros((1, N_BANDS))
+        self._road_d = np.zeros((1, N_BANDS))
+        self._road = np.zeros((1, N_BANDS, HOURS))
+        self._time = np.zeros((1, N_BANDS, HOURS))
+        self._expected = np.zeros((1, N_BANDS, HOURS))  # time the prior would have predicted
+        self.observations = 0
+        self._tables: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, list, list]] = None  # see tables()
+
+    # -- lookups -----------------------------------------------------------
+
+    def _rows(self, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+        """Table row of each point's region (0 for uncalibrated regions and missing coordinates)."""
+        ok = ~(np.isnan(lat) | np.isnan(lng))
+        ci = np.where(ok, np.floor(np.nan_to_num(lat) / REGION_DEG), 0).astype(np.int64)
+        cj = np.where(ok, np.floor(np.nan_to_num(lng) / REGION_DEG), 0).astype(np.int64)
+        if not self._cells:
+            return np.zeros(lat.shape, dtype=np.int64)
+        keys, inverse = np.unique(np.stack([ci, cj], axis=-1).reshape(-1, 2), axis=0, return_inverse=True)
+        rows = np.array([self._cells.get((int(a), int(b)), 0) for a, b in keys], dtype=np.int64)
+        return np.where(ok, rows[inverse.reshape(-1)].reshape(lat.shape), 0)
+
+    def tables(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, list, list]:
+        """
+        (detour[row, band], speed_mps[row, band, hour], day_speed_mps[row, band]) as arrays, followed by
+        list copies of the speed tables for the scalar path.
+        """
+        with self._lock:
+            if self._tables is None:
+                self._tables = self._build()
+            return self._tables
+
+    def _build(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, list, list]:
+        detour = (self._road_d + _PRIOR_DETOUR_M * self._prior_detour) / (self._straight + _PRIOR_DETOUR_M)
+        # Region/band speed relative to the prior across the whole day, then each hour around that
+        scale = (self._expected.sum(axis=2) + _PRIOR_SCALE_S) / (self._time.sum(axis=2) + _PRIOR_SCALE_S)
+        prior = self._prior_speed[None, :, :] * scale[:, :, None]
+        speed = (self._road + _PRIOR_HOUR_S * prior) / (self._time + _PRIOR_HOUR_S)
+        day = HOURS / (1.0 / speed).sum(axis=2)  # mean time over the day, not mean speed
+        return detour, speed, day, speed.tolist(), day.tolist()
+
+    def estimate(self, lat1, lng1, lat2, lng2, hour=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (road_m, time_s) for each leg, vectorized. `hour` is the local departure hour per leg (scalar
+        or array, fractional hours interpolate); None uses the whole-day average. NaN coordinates give 0.
+        """
+        lat1, lng1, lat2, lng2 = (np.atleast_1d(np.asarray(x, dtype=float)) for x in (lat1, lng1, lat2, lng2))
+        detour, speed, day, _, _ = self.tables()
+        straight = np.nan_to_num(_haversine_m(lat1, lng1, lat2, lng2))
+        rows = self._rows(lat1, lng1)
+        road = straight * detour[rows, _bands(straight)]
+        band = _bands(road)
+        if hour is None:
+            mps = day[rows, band]
+        else:
+            h = np.broadcast_to(np.asarray(hour, dtype=float) % HOURS, road.shape)
+            h0 = np.floor(h).astype(np.int64) % HOURS
+            frac = h - np.floor(h)
+            mps = speed[rows, band, h0] * (1 - frac) + speed[rows, band, (h0 + 1) % HOURS] * frac
+        return road, road / mps
+
+    def travel_time_s(self, lat: float, lng: float, road_m: float, hour: Optional[float]) -> float:
+        """Scalar time for `road_m` metres departing at local `hour` from (lat, lng); for sequential ETA chains."""
+        _, _, _, speed, day = self.tables()
+        row = 0
+        if self._cells and lat == lat and lng == lng:
+            row = self._cells.get((math.floor(lat / REGION_DEG), math.floor(lng / REGION_DEG)), 0)
+        band = bisect.bisect_right(BAND_EDGES_M, road_m)
+        if hour is None:
+            return road_m / day[row][band]
+        hour %= HOURS
+        h0 = int(hour)
+        frac = hour - h0
+        profile = speed[row][band]
+        return road_m / (profile[h0] * (1 - frac) + profile[(h0 + 1) % HOURS] * frac)
+
+    # -- calibration -------------------------------------------------------
+
+    def observe(self, lat1, lng1, lat2, lng2, road_m, time_s, hour=None) -> int:
+        """
+        Fold routed legs (metres and seconds as returned by TomTom) into the tables; `hour` defaults
+        to now in each leg's local time, which is what traffic-aware routing answers for. Legs that
+        are too short or implausible are skipped. Returns how many were used.
+        """
+        lat1, lng1, lat2, lng2, road_m, time_s = (
+            np.atleast_1d(np.asarray(x, dtype=float)) for x in (lat1, lng1, lat2, lng2, road_m, time_s)
+        )
+        straight = _haversine_m(lat1, lng1, lat2, lng2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ok = (
+                (straight >= 50.0) & (time_s > 0) & (road_m >= 0.9 * straight) & (road_m <= 5.0 * straight)
+                & (road_m / time_s >= 1.0) & (road_m / time_s <= 40.0)
+            )
+        if not ok.any():
+            return 0
+        lat1, lng1, straight, road_m, time_s = lat1[ok], lng1[ok], straight[ok], road_m[ok], time_s[ok]
+        hours = _hours_now(lng1) if hour is None else np.broadcast_to(np.asarray(hour, dtype=float), ok.shape)[ok] % HOURS
+        h = np.floor(hours).astype(np.int64) % HOURS
+        sb, rb = _bands(straight), _bands(road_m)
+        ci = np.floor(lat1 / REGION_DEG).astype(np.int64)
+        cj = np.floor(lng1 / REGION_DEG).astype(np.int64)
+        with self._lock:
+            rows = np.empty(len(ci), dtype=np.int64)
+            for k, cell in enumerate(zip(ci.tolist(), cj.tolist())):
+                row = self._cells.get(cell)
+                if row is None:
+                    row = self._cells[cell] = len(self._cells) + 1
+                rows[k] = row
+            self._grow(len(self._cells) + 1)
+            np.add.at(self._straight, (rows, sb), straight)
+            np.add.at(self._road_d, (rows, sb), road_m)
+            np.add.at(self._road, (rows, rb, h), road_m)
+            np.add.at(self._time, (rows, rb, h), time_s)
+            np.add.at(self._expected, (rows, rb, h), road_m / self._prior_speed[rb, h])
+            self.observations += len(rows)
+            self._tables = None
+        return len(rows)
+
+    def _grow(self, n_rows: int) -> None:
+        extra = n_rows - self._straight.shape[0]
+        if extra <= 0:
+            return
+        self._straight = np.concatenate([self._straight, np.zeros((extra, N_BANDS))])
+        self._road_d = np.concatenate([self._road_d, np.zeros((extra, N_BANDS))])
+        for name in ("_road", "_time", "_expected"):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros((extra, N_BANDS, HOURS))]))
+
+    # -- persistence -------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        detour, _, day, _, _ = self.tables()
+        with self._lock:
+            return {
+                "regions": len(self._cells),
+                "observations": self.observations,
+                "region_deg": REGION_DEG,
+                "prior_detour": [round(x, 3) for x in detour[0].tolist()],
+                "prior_day_speed_kmh": [round(x * 3.6, 1) for x in day[0].tolist()],
+            }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": 1,
+                "region_deg": REGION_DEG,
+                "observations": self.observations,
+                "cells": [[i, j] for (i, j), _ in sorted(self._cells.items(), key=lambda kv: kv[1])],
+                "straight": self._straight[1:].round(1).tolist(),
+                "road_d": self._road_d[1:].round(1).tolist(),
+                "road": self._road[1:].round(1).tolist(),
+                "time": self._time[1:].round(1).tolist(),
+                "expected": self._expected[1:].round(1).tolist(),
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TravelModel":
+        model = cls()
+        if data.get("region_deg") != REGION_DEG or not data.get("cells"):
+            return model
+        n = len(data["cells"])
+        model._cells = {(int(i), int(j)): row + 1 for row, (i, j) in enumerate(data["cells"])}
+        model._grow(n + 1)
+        model._straight[1:] = np.asarray(data["straight"], dtype=float).reshape(n, N_BANDS)
+        model._road_d[1:] = np.asarray(data["road_d"], dtype=float).reshape(n, N_BANDS)
+        for name in ("road", "time", "expected"):
+            getattr(model, "_" + name)[1:] = np.asarray(data[name], dtype=float).reshape(n, N_BANDS, HOURS)
+        model.observations = int(data.get("observations") or 0)
+        return model
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TravelModel":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+_default_model: Optional[TravelModel] = None
+_default_lock = threading.Lock()
+
+
+def get_travel_model() -> TravelModel:
+    """
+    Process-wide model. With TRAVEL_MODEL_PATH set, calibration saved there by save_travel_model
+    (on app shutdown) is loaded on first use.
+    """
+    global _default_model
+    if _default_model is None:
+        with _default_lock:
+            if _default_model is None:
+                path = os.getenv("TRAVEL_MODEL_PATH")
+                model = TravelModel()
+                if path and os.path.exists(path):
+                    try:
+                        model = TravelModel.load(path)
+                    except (OSError, ValueError, KeyError, TypeError) as e:
+                        logger.warning("travel model %s not loaded: %s", path, e)
+                _default_model = model
+    return _default_model
+
+
+def calibration_enabled() -> bool:
+    """Set TRAVEL_MODEL_CALIBRATE=0 to keep the tables at the prior (or the loaded calibration)."""
+    return os.getenv("TRAVEL_MODEL_CALIBRATE", "1").lower() not in ("0", "false", "no")
+
+
+def save_travel_model() -> None:
+    """Persist the calibration to TRAVEL_MODEL_PATH, if set and anything was observed."""
+    path = os.getenv("TRAVEL_MODEL_PATH")
+    if path and _default_model is not None and _default_model.observations:
+        try:
+            _default_model.save(path)
+        except OSError as e:
+            logger.warning("travel model not saved to %s: %s", path, e)
@@ -1,199 +1,278 @@
 import os
+import asyncio
 import urllib.parse
-import urllib.request
-import json
-from typing import List, Dict, Any, Tuple
-from datetime import datetime, timedelta
+from typing import List, Dict, Any, Tuple, Callable, Optional
+from datetime import datetime, timedelta, timezone
 import math
-
-def _map_shipment_row(headers: List[str], row: List[str]) -> Dict[str, Any]:
-    idx = {h: i for i, h in enumerate(headers)}
-    def g(name, default=None):
-        return row[idx[name]] if name in idx and idx[name] < len(row) else default
-    def fnum(v):
-        try:
-            return float(str(v).strip())
-        except Exception:
-            return None
-    return {
-        "pickup": {
-            "id": g("Pickup Id"),
-            "lat": fnum(g("Pickup Location Lat")),
-            "lng": fnum(g("Pickup Location Lng")),
-            "time_window": [g("Pickup Start Time"), g("Pickup End Time")],
-        },
-        "delivery": {
-            "id": g("Delivery Id"),
-            "lat": fnum(g("Delivery Location Lat")),
-            "lng": fnum(g("Delivery Location Lng")),
-            "time_window": [g("Delivery Start Time"), g("Delivery End Time")],
-        },
-        "quantity": _safe_int(g("Quantity")),
-        "priority": _safe_int(g("Priority")),
-        "description": g("Description"),
-    }
-
-
-def _safe_int(v, default=None):
-    try:
-        return int(str(v).strip())
-    except Exception:
-        return default
-    
-
-
-
-def _mock_optimize(vehicles: List[Dict[str, Any]], shipments: List[Dict[str, Any]]):
+import time
+import numpy as np
+from route_cache import get_segment_cache
+from spatial_index import GridIndex
+from zones import ZoneIndex
+from problem import Problem
+from metrics import PROVIDER_CALL_SECONDS, PROVIDER_ERRORS, record, timed
+from http_client import get_client, provider_url, run_sync, ProviderHTTPError, ProviderTransportError
+from travel_model import calibration_enabled, get_travel_model, local_hour
+from road_network import RoadRouter, get_road_network
+
+# calculateRoute accepts at most 150 locations (origin + waypoints + destination) per request
+TOMTOM_MAX_WAYPOINTS = 150
+
+def _mock_optimize(problem: Problem):
     """Heuristic VRP mock: assign shipments to nearest vehicle start; build routes with pickup-delivery precedence and simple capacity.
     Produces a reasonable baseline when NextBillion is unavailable.
+
+    Distances come from NumPy haversine matrices (vehicle-to-pickup for the assignment, stop-to-stop
+    per vehicle for the nearest-neighbour walk), so each routing step is one vectorized argmin.
+    Large fleets assign through a GridIndex instead; its timings are reported as summary.spatial_index.
+    ETAs and summary totals come from the travel model (see _time_mock_routes).
     """
-    if not vehicles:
+    nv, ns = problem.n_vehicles, problem.n_shipments
+    if not nv:
         return {"summary": {}, "assignments": []}
 
-    # Assign shipments to nearest vehicle start
-    veh_points = []
-    for vi, v in enumerate(vehicles):
-        slat = v.get("start", {}).get("lat")
-        slng = v.get("start", {}).get("lng")
-        if slat is None or slng is None:
-            # fallback to first valid point among start/end
-            elat = v.get("end", {}).get("lat")
-            elng = v.get("end", {}).get("lng")
-            slat, slng = elat, elng
-        veh_points.append((vi, float(slat) if slat is not None else None, float(slng) if slng is not None else None))
-
-    assignments_idx: List[List[int]] = [[] for _ in vehicles]
-    for si, shp in enumerate(shipments):
-        plat, plng = shp.get("pickup", {}).get("lat"), shp.get("pickup", {}).get("lng")
-        if plat is None or plng is None:
-            dlat, dlng = shp.get("delivery", {}).get("lat"), shp.get("delivery", {}).get("lng")
-            plat, plng = dlat, dlng
-        best_vi = 0
-        best_d = float("inf")
-        for (vi, vlat, vlng) in veh_points:
-            if vlat is None or vlng is None or plat is None or plng is None:
-                continue
-            d = _haversine_m(vlat, vlng, float(plat), float(plng))
-            if d < best_d:
-                best_d = d
-                best_vi = vi
-        assignments_idx[best_vi].append(si)
+    # Assign shipments to nearest vehicle start (fallback to end when start is missing)
+    start_ok = ~(np.isnan(problem.start_lat) | np.isnan(problem.start_lng))
+    veh_lat = np.where(start_ok, problem.start_lat, problem.end_lat)
+    veh_lng = np.where(start_ok, problem.start_lng, problem.end_lng)
+    pick_ok = ~(np.isnan(problem.pickup_lat) | np.isnan(problem.pickup_lng))
+    p_lat = np.where(pick_ok, problem.pickup_lat, problem.delivery_lat)
+    p_lng = np.where(pick_ok, problem.pickup_lng, problem.delivery_lng)
+
+    assignments_idx: List[List[int]] = [[] for _ in range(nv)]
+    index_stats = None
+    if ns and ns * nv > MOCK_INDEX_MIN_CELLS:
+        # Large fleets: one grid index over vehicle positions instead of a shipments x vehicles matrix
+        index = GridIndex(veh_lat, veh_lng)
+        nearest = index.knn_many(p_lat, p_lng, 1)
+        # No usable distance at all -> first vehicle, as before
+        best = [hit[0][0] if hit else 0 for hit in nearest]
+        index_stats = index.stats()
+        for si, vi in enumerate(best):
+            assignments_idx[vi].append(si)
+    elif ns:
+        d = _haversine_matrix_m(p_lat, p_lng, veh_lat, veh_lng)  # shipments x vehicles
+        d = np.where(np.isnan(d), np.inf, d)
+        best = np.argmin(d, axis=1)
+        # No usable distance at all -> first vehicle, as before
+        best[~np.isfinite(d.min(axis=1))] = 0
+        for si, vi in enumerate(best.tolist()):
+            assignments_idx[vi].append(si)
 
     # Build routes per vehicle using nearest-neighbor with precedence and simple capacity
+    start_lat, start_lng = _nullable(problem.start_lat), _nullable(problem.start_lng)
+    end_lat, end_lng = _nullable(problem.end_lat), _nullable(problem.end_lng)
+    pickup_lat, pickup_lng = problem.pickup_lat.tolist(), problem.pickup_lng.tolist()
+    delivery_lat, delivery_lng = problem.delivery_lat.tolist(), problem.delivery_lng.tolist()
+    capacity = _nullable(problem.capacity)
+    pickup_open, delivery_open = problem.pickup_tw_ts[:, 0].tolist(), problem.delivery_tw_ts[:, 0].tolist()
     assignments = []
-    for vi, v in enumerate(vehicles):
+    opens: List[List[float]] = []  # per vehicle, the epoch each stop's window opens (NaN: no window)
+    for vi in range(nv):
         stops: List[Dict[str, Any]] = []
-        if v.get("start", {}).get("lat") is not None:
-            stops.append({"type": "start", **v["start"], "eta": v.get("shift", {}).get("start")})
-
-        cur_lat = v.get("start", {}).get("lat") or v.get("end", {}).get("lat")
-        cur_lng = v.get("start", {}).get("lng") or v.get("end", {}).get("lng")
-        assigned = [shipments[i] for i in assignments_idx[vi]]
-        picked = set()  # shipment ids
-        delivered = set()
-        load = 0
-        capacity = v.get("capacity") or None
-
-        def can_pick(shp):
-            q = shp.get("quantity") or 0
-            if capacity is None:
-                return True
-            try:
-                return (load + int(q)) <= int(capacity)
-            except Exception:
-                return True
-
-        while True:
-            best = None
-            best_dist = float("inf")
-            # Candidate: any undelivered shipment
-            for shp in assigned:
-                sid = shp.get("pickup", {}).get("id") or shp.get("delivery", {}).get("id") or "sid"
-                if sid in delivered:
-                    continue
-                # If not picked yet, consider pickup (if capacity allows)
-                if sid not in picked:
-                    plat, plng = shp["pickup"].get("lat"), shp["pickup"].get("lng")
-                    if plat is None or plng is None:
-                        continue
-                    if not can_pick(shp):
-                        continue
-                    d = _haversine_m(cur_lat, cur_lng, float(plat), float(plng)) if (cur_lat is not None and cur_lng is not None) else 0
-                    if d < best_dist:
-                        best_dist = d
-                        best = (sid, "pickup", shp)
-                else:
-                    # picked, consider delivery
-                    dlat, dlng = shp["delivery"].get("lat"), shp["delivery"].get("lng")
-                    if dlat is None or dlng is None:
-                        continue
-                    d = _haversine_m(cur_lat, cur_lng, float(dlat), float(dlng)) if (cur_lat is not None and cur_lng is not None) else 0
-                    if d < best_dist:
-                        best_dist = d
-                        best = (sid, "delivery", shp)
-
-            if best is None:
-                break
-
-            sid, action, shp = best
+        stop_open: List[float] = []
+        if start_lat[vi] is not None:
+            stops.append({"type": "start", "lat": start_lat[vi], "lng": start_lng[vi], "eta": problem.shift_start[vi]})
+            stop_open.append(math.nan)
+
+        cur_lat = start_lat[vi] or end_lat[vi]
+        cur_lng = start_lng[vi] or end_lng[vi]
+        assigned = assignments_idx[vi]
+        for k, action in _nearest_neighbor_order(problem, assigned, cur_lat, cur_lng, capacity[vi] or None):
+            si = assigned[k]
             if action == "pickup":
-                plat, plng = float(shp["pickup"]["lat"]), float(shp["pickup"]["lng"])
-                stops.append({"type": "pickup", "id": shp["pickup"]["id"], "lat": plat, "lng": plng, "eta": shp["pickup"].get("time_window", [None])[0]})
-                cur_lat, cur_lng = plat, plng
-                picked.add(sid)
-                try:
-                    load += int(shp.get("quantity") or 0)
-                except Exception:
-                    pass
+                stops.append({"type": "pickup", "id": problem.pickup_ids[si], "lat": pickup_lat[si], "lng": pickup_lng[si], "eta": problem.pickup_tw[si][0]})
+                stop_open.append(pickup_open[si])
             else:
-                dlat, dlng = float(shp["delivery"]["lat"]), float(shp["delivery"]["lng"])
-                stops.append({"type": "delivery", "id": shp["delivery"]["id"], "lat": dlat, "lng": dlng, "eta": shp["delivery"].get("time_window", [None, None])[0]})
-                cur_lat, cur_lng = dlat, dlng
-                delivered.add(sid)
-                try:
-                    load -= int(shp.get("quantity") or 0)
-                except Exception:
-                    pass
-
-        if v.get("end", {}).get("lat") is not None:
-            stops.append({"type": "end", **v["end"], "eta": v.get("shift", {}).get("end")})
+                stops.append({"type": "delivery", "id": problem.delivery_ids[si], "lat": delivery_lat[si], "lng": delivery_lng[si], "eta": problem.delivery_tw[si][0]})
+                stop_open.append(delivery_open[si])
+
+        if end_lat[vi] is not None:
+            stops.append({"type": "end", "lat": end_lat[vi], "lng": end_lng[vi], "eta": problem.shift_end[vi]})
+            stop_open.append(math.nan)
+        opens.append(stop_open)
 
         coords = []
         for st in stops:
             if st.get("lat") is not None and st.get("lng") is not None:
                 coords.append([st["lng"], st["lat"]])
         route = {"type": "LineString", "coordinates": coords}
-        assignments.append({"vehicle_id": v.get("id") or f"veh-{vi+1}", "stops": stops, "route": route})
+        assignments.append({"vehicle_id": problem.vehicle_ids[vi] or f"veh-{vi+1}", "stops": stops, "route": route})
+
+    total_m, total_s = _time_mock_routes(problem, assignments, opens)
+    summary: Dict[str, Any] = {"total_distance_km": round(total_m / 1000.0, 3), "total_time_min": int(total_s / 60)}
+    if index_stats is not None:
+        summary["spatial_index"] = index_stats
+    return {"summary": summary, "assignments": assignments}
+
 
-    return {"summary": {"total_distance_km": 0.0, "total_time_min": 0}, "assignments": assignments}
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(round(ts), tz=timezone.utc).replace(tzinfo=None).isoformat() + "Z"
 
 
-def _build_nextbillion_payload(vehicles: List[Dict[str, Any]], shipments: List[Dict[str, Any]], zones: List[Dict[str, Any]], options: Dict[str, Any]) -> Dict[str, Any]:
+def _time_mock_routes(problem: Problem, assignments: List[Dict[str, Any]], opens: List[List[float]]) -> Tuple[float, float]:
+    """
+    Set ETAs on the mock's routes with the travel model and return total (road metres, driving seconds).
+    Road distances for every leg of the fleet come from one batch lookup; each vehicle then drives from
+    its shift start, timing legs by departure hour and waiting at stops whose window hasn't opened.
+    Vehicles without a shift start keep the window-start ETAs.
+    """
+    lat1: List[float] = []
+    lng1: List[float] = []
+    lat2: List[float] = []
+    lng2: List[float] = []
+    for a in assignments:
+        stops = a["stops"]
+        for prev, st in zip(stops, stops[1:]):
+            lat1.append(prev["lat"])
+            lng1.append(prev["lng"])
+            lat2.append(st["lat"])
+            lng2.append(st["lng"])
+    if not lat1:
+        return 0.0, 0.0
+    model = get_travel_model()
+    road = model.estimate(lat1, lng1, lat2, lng2)[0].tolist()
+    total_m = total_s = 0.0
+    k = 0
+    for vi, a in enumerate(assignments):
+        stops = a["stops"]
+        clock = float(problem.shift_ts[vi, 0])
+        if stops and stops[0]["type"] != "start" and opens[vi][0] == opens[vi][0]:
+            clock = max(clock, opens[vi][0]) if clock == clock else opens[vi][0]
+            stops[0]["eta"] = _iso(clock)
+        for j in range(1, len(stops)):
+            d = road[k]
+            k += 1
+            t = model.travel_time_s(stops[j - 1]["lat"], stops[j - 1]["lng"], d, local_hour(clock))
+            total_m += d
+            total_s += t
+            if clock != clock:
+                continue
+            clock += t
+            if opens[vi][j] > clock:
+                clock = opens[vi][j]  # wait for the window to open
+            stops[j]["eta"] = _iso(clock)
+    return total_m, total_s
+
+
+def _nullable(col: np.ndarray) -> List[Any]:
+    """Column as Python values with NaN -> None, for JSON output."""
+    return [None if x != x else x for x in col.tolist()]
+
+
+# Above this many shipment x vehicle pairs the nearest-vehicle pass uses a spatial index
+MOCK_INDEX_MIN_CELLS = 250_000
+
+# Above this many stop-to-stop cells a vehicle's matrix is computed row by row instead of up front
+MOCK_MATRIX_MAX_CELLS = 4_000_000
+
+
+def _nearest_neighbor_order(problem: Problem, assigned: List[int], cur_lat, cur_lng, capacity) -> List[Tuple[int, str]]:
+    """
+    Greedy visiting order for one vehicle over shipments `assigned` (rows of `problem`): repeatedly go to the
+    closest feasible stop, where a shipment's pickup is feasible if capacity allows and its delivery once
+    picked up. Returns [(position in assigned, "pickup"|"delivery")].
+    Node 0 is the vehicle's position; shipment i has its pickup at node 1+2i and its delivery at node 2+2i,
+    so argmin ties resolve to the earlier shipment like the original sequential scan.
+    """
+    k = len(assigned)
+    if k == 0:
+        return []
+    idx = np.asarray(assigned, dtype=np.int64)
+    lat = np.full(2 * k + 1, np.nan)
+    lng = np.full(2 * k + 1, np.nan)
+    lat[1::2], lng[1::2] = problem.pickup_lat[idx], problem.pickup_lng[idx]
+    lat[2::2], lng[2::2] = problem.delivery_lat[idx], problem.delivery_lng[idx]
+    lat[np.isnan(lng)] = np.nan
+    qty = np.nan_to_num(problem.quantity[idx], nan=0.0).astype(np.int64)
+    try:
+        cap = int(capacity) if capacity is not None else None
+    except Exception:
+        cap = None
+    has_origin = cur_lat is not None and cur_lng is not None
+    if has_origin:
+        lat[0], lng[0] = float(cur_lat), float(cur_lng)
+
+    # Stops without coordinates are never candidates; make their distances inf so they can't poison argmin
+    matrix = None
+    if (2 * k + 1) * 2 * k <= MOCK_MATRIX_MAX_CELLS:
+        matrix = np.nan_to_num(_haversine_matrix_m(lat, lng, lat[1:], lng[1:]), nan=np.inf)
+
+    else:
+        # Too large to hold: compute one row per step from precomputed radians
+        phi = np.radians(lat)
+        lam = np.radians(lng)
+        cos_phi = np.cos(phi)
+
+    def row(node: int) -> np.ndarray:
+        if matrix is not None:
+            return matrix[node]
+        a = np.sin((phi[1:] - phi[node]) / 2) ** 2 + cos_phi[node] * cos_phi[1:] * np.sin((lam[1:] - lam[node]) / 2) ** 2
+        return np.nan_to_num(6371000.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)), nan=np.inf)
+
+    # Additive mask over stop nodes: 0 for current candidates, inf otherwise
+    valid = ~np.isnan(lat[1:])
+    mask = np.full(2 * k, np.inf)
+    mask[0::2][valid[0::2]] = 0.0  # every pickup with coordinates starts as a candidate
+    pick_mask = mask[0::2]  # view
+    load = 0
+    cur = 0 if has_origin else None
+    order: List[Tuple[int, str]] = []
+    while True:
+        cost = mask + row(cur) if cur is not None else mask.copy()
+        if cap is not None:
+            # Pickups that would overflow the vehicle are out for this step
+            cost[0::2] = np.where(qty > cap - load, np.inf, cost[0::2])
+        j = int(np.argmin(cost))
+        if not np.isfinite(cost[j]):
+            break
+        i = j // 2
+        if j % 2 == 0:
+            pick_mask[i] = np.inf
+            if valid[j + 1]:
+                mask[j + 1] = 0.0
+            load += int(qty[i])
+            order.append((i, "pickup"))
+        else:
+            mask[j] = np.inf
+            load -= int(qty[i])
+            order.append((i, "delivery"))
+        cur = j + 1
+    return order
+
+
+def _build_nextbillion_payload(problem: Problem, zones: List[Dict[str, Any]], options: Dict[str, Any]) -> Dict[str, Any]:
     """Best-effort mapping to NextBillion payload shape. Adjust fields as required by your NB account."""
+    start_lat, start_lng = _nullable(problem.start_lat), _nullable(problem.start_lng)
+    end_lat, end_lng = _nullable(problem.end_lat), _nullable(problem.end_lng)
+    capacity, max_tasks = _nullable(problem.capacity), _nullable(problem.max_tasks)
     nb_vehicles = []
-    for v in vehicles:
+    for v in range(problem.n_vehicles):
         nb_vehicles.append({
-            "id": v.get("id"),
-            "start_location": {"lat": v.get("start", {}).get("lat"), "lng": v.get("start", {}).get("lng")},
-            "end_location": {"lat": v.get("end", {}).get("lat"), "lng": v.get("end", {}).get("lng")},
-            "capacity": v.get("capacity"),
-            "time_window": [v.get("shift", {}).get("start"), v.get("shift", {}).get("end")],
-            "max_tasks": v.get("max_tasks"),
+            "id": problem.vehicle_ids[v],
+            "start_location": {"lat": start_lat[v], "lng": start_lng[v]},
+            "end_location": {"lat": end_lat[v], "lng": end_lng[v]},
+            "capacity": int(capacity[v]) if capacity[v] is not None else None,
+            "time_window": [problem.shift_start[v], problem.shift_end[v]],
+            "max_tasks": int(max_tasks[v]) if max_tasks[v] is not None else None,
         })
+    pickup_lat, pickup_lng = _nullable(problem.pickup_lat), _nullable(problem.pickup_lng)
+    delivery_lat, delivery_lng = _nullable(problem.delivery_lat), _nullable(problem.delivery_lng)
+    quantity, priority = _nullable(problem.quantity), _nullable(problem.priority)
     nb_shipments = []
-    for s in shipments:
+    for i in range(problem.n_shipments):
         nb_shipments.append({
-            "id": s.get("pickup", {}).get("id") or s.get("delivery", {}).get("id"),
+            "id": problem.shipment_id(i),
             "pickup": {
-                "location": {"lat": s.get("pickup", {}).get("lat"), "lng": s.get("pickup", {}).get("lng")},
-                "time_window": s.get("pickup", {}).get("time_window"),
+                "location": {"lat": pickup_lat[i], "lng": pickup_lng[i]},
+                "time_window": problem.pickup_tw[i],
             },
             "delivery": {
-                "location": {"lat": s.get("delivery", {}).get("lat"), "lng": s.get("delivery", {}).get("lng")},
-                "time_window": s.get("delivery", {}).get("time_window"),
+                "location": {"lat": delivery_lat[i], "lng": delivery_lng[i]},
+                "time_window": problem.delivery_tw[i],
             },
-            "quantity": s.get("quantity"),
-            "priority": s.get("priority"),
+            "quantity": int(quantity[i]) if quantity[i] is not None else None,
+            "priority": int(priority[i]) if priority[i] is not None else None,
         })
     nb_constraints = {
         "no_go_zones": [z for z in zones if (z.get("type") == "nogo")],
@@ -208,92 +287,143 @@ def _build_nextbillion_payload(vehicles: List[Dict[str, Any]], shipments: List[D
     }
 
 
-def _enrich_routes_with_tomtom(result: Dict[str, Any], zones: List[Dict[str, Any]], options: Dict[str, Any], tt_key: str | None) -> Dict[str, Any]:
+def _enrich_routes_with_tomtom(result: Dict[str, Any], zones: List[Dict[str, Any]], options: Dict[str, Any], tt_key: str | None, problem: Optional[Problem] = None) -> Dict[str, Any]:
+    """Blocking wrapper around _enrich_routes_with_tomtom_async for thread/CLI callers."""
+    return run_sync(_enrich_routes_with_tomtom_async(result, zones, options, tt_key, problem=problem))
+
+
+async def _enrich_routes_with_tomtom_async(result: Dict[str, Any], zones: List[Dict[str, Any]], options: Dict[str, Any], tt_key: str | None, progress: Optional[Callable[[str, Dict[str, Any]], None]] = None, problem: Optional[Problem] = None, on_assignment: Optional[Callable[[int, Dict[str, Any]], None]] = None, zone_index: Optional[ZoneIndex] = None) -> Dict[str, Any]:
     """
     For each assignment, replace straight-line geometry with TomTom routing-based polyline across consecutive stops,
     honoring avoidAreas (from no-go zones) and basic vehicle restriction params when available.
+
+    options.enrichment_mode (or env TOMTOM_ENRICH_MODE):
+      - "multi" (default): one multi-waypoint calculateRoute call per vehicle, split at TOMTOM_MAX_WAYPOINTS
+      - "legs": one calculateRoute call per consecutive stop pair
+    Up to options.enrichment_workers (env TOMTOM_ENRICH_WORKERS, 8) vehicles are enriched concurrently;
+    `progress("enrich", {...})` is called as each vehicle finishes, and `on_assignment(index, assignment)`
+    once that assignment's route, legs and ETAs are final.
+    When `problem` is given, routes whose first stop carries no ETA are timed from the vehicle's shift start;
+    pass the request's `zone_index` to reuse it instead of rebuilding one from `zones`.
+
+    options.routing_provider (or env ROUTING_PROVIDER) "local" routes on the offline road graph
+    (ROAD_GRAPH_PATH, see road_network.py) instead of TomTom and needs no key; without a loadable graph
+    it falls back to TomTom.
     """
+    router: Optional[RoadRouter] = None
+    if str(options.get("routing_provider") or os.environ.get("ROUTING_PROVIDER") or "tomtom").lower() == "local":
+        network = await asyncio.to_thread(get_road_network)
+        if network is not None:
+            router = RoadRouter(network, zone_index if zone_index is not None else ZoneIndex(zones))
     # prefer explicit key
     tt_key = tt_key or os.environ.get("TOMTOM_API_KEY")
-    if not tt_key:
+    if router is None and not tt_key:
         return result
 
-    avoid_param = _build_tomtom_avoid_areas(zones)
+    avoid_param = _build_tomtom_avoid_areas(zones, zone_index)
     vehicle_params = _build_vehicle_params(options.get("vehicle_restrictions") or {})
+    mode = str(options.get("enrichment_mode") or os.environ.get("TOMTOM_ENRICH_MODE") or "multi").lower()
+    try:
+        workers = int(options.get("enrichment_workers") or os.environ.get("TOMTOM_ENRICH_WORKERS") or 8)
+    except (TypeError, ValueError):
+        workers = 8
+    sem = asyncio.Semaphore(max(1, workers))
 
     assignments = result.get("assignments") or []
-    total_distance_m = 0.0
-    total_time_s = 0.0
-    for a in assignments:
-        stops = a.get("stops") or []
-        coords: List[List[float]] = []  # [lon, lat]
-        legs: List[Dict[str, Any]] = []
-        prev = None
-        leg_idx = 0
-        assign_dist_m = 0.0
-        assign_time_s = 0.0
-        for i, st in enumerate(stops):
-            if st.get("lat") is None or st.get("lng") is None:
-                prev = None
-                continue
-            cur = {"lat": float(st["lat"]), "lng": float(st["lng"]) }
-            if prev is not None:
-                seg_coords, seg_dist_m, seg_time_s = _tomtom_route_segment(prev, cur, tt_key, avoid_param, vehicle_params)
-                if seg_coords:
-                    if coords:
-                        seg_coords = seg_coords[1:]  # skip duplicate
-                    coords.extend(seg_coords)
-                legs.append({
-                    "index": leg_idx,
-                    "from": {"lat": prev["lat"], "lng": prev["lng"]},
-                    "to": {"lat": cur["lat"], "lng": cur["lng"]},
-                    "distance_m": seg_dist_m,
-                    "time_s": seg_time_s,
-                })
-                leg_idx += 1
-                assign_dist_m += seg_dist_m
-                assign_time_s += seg_time_s
-            else:
-                coords.append([cur["lng"], cur["lat"]])
-            prev = cur
-        if coords:
-            a["route"] = {"type": "LineString", "coordinates": coords}
-        a["metrics"] = {"distance_m": round(assign_dist_m, 1), "time_s": int(assign_time_s)}
-        a["legs"] = legs
-        total_distance_m += assign_dist_m
-        total_time_s += assign_time_s
-
-        # Compute fallback ETAs if not supplied, from start stop eta or now
-        _compute_fallback_etas(a)
+    done = 0
+
+    async def run(index: int, a: Dict[str, Any]) -> Tuple[float, float]:
+        nonlocal done
+        shift_start = None
+        if problem is not None:
+            pos = problem.vehicle_position(a.get("vehicle_id"))
+            shift_start = problem.shift_start[pos] if pos is not None else None
+        async with sem:
+            totals = await _enrich_assignment(a, tt_key, avoid_param, vehicle_params, mode, shift_start, router=router)
+        done += 1
+        if progress is not None:
+            progress("enrich", {"vehicle_id": a.get("vehicle_id"), "done": done, "total": len(assignments)})
+        if on_assignment is not None:
+            on_assignment(index, a)
+        return totals
+
+    totals = await asyncio.gather(*(run(i, a) for i, a in enumerate(assignments)))
+    total_distance_m = sum(d for d, _ in totals)
+    total_time_s = sum(t for _, t in totals)
     # Update overall summary if present
     if isinstance(result.get("summary"), dict):
         result["summary"]["total_distance_km"] = round(total_distance_m / 1000.0, 3)
         result["summary"]["total_time_min"] = int(total_time_s / 60)
+        result["summary"]["routing"] = "local" if router is not None else "tomtom"
     return result
 
 
-def _build_tomtom_avoid_areas(zones: List[Dict[str, Any]]) -> str:
-    polys: List[str] = []
-    for z in zones:
-        if (z.get("type") != "nogo"):
-            continue
-        poly = z.get("polygon") or []
-        if len(poly) < 3:
+async def _enrich_assignment(a: Dict[str, Any], tt_key: str, avoid_param: str, vehicle_params: Dict[str, Any], mode: str, shift_start: Any = None, router: Optional[RoadRouter] = None) -> Tuple[float, float]:
+    """
+    Route one assignment's stops in place (route, legs, metrics, ETAs); returns (distance_m, time_s).
+    With a `router`, legs come from the offline road graph instead of TomTom.
+    """
+    stops = a.get("stops") or []
+    # Consecutive stops with coordinates form a run; a stop without coordinates breaks the route
+    runs: List[List[Dict[str, float]]] = []
+    run: List[Dict[str, float]] = []
+    for st in stops:
+        if st.get("lat") is None or st.get("lng") is None:
+            if run:
+                runs.append(run)
+            run = []
             continue
-        # TomTom expects polygons with prefix 'poly:' then lat,lon pairs separated by ':'
-        # Multiple polygons separated by '|'. Ensure ring is closed.
-        parts = []
-        for lat, lng in poly:
-            try:
-                parts.append(f"{float(lat)},{float(lng)}")
-            except Exception:
-                pass
-        # Close ring if not closed
-        if parts and parts[0] != parts[-1]:
-            parts.append(parts[0])
-        if parts:
-            polys.append("poly:" + ":".join(parts))
-    return "|".join(polys) if polys else ""
+        run.append({"lat": float(st["lat"]), "lng": float(st["lng"])})
+    if run:
+        runs.append(run)
+
+    coords: List[List[float]] = []  # [lon, lat]
+    legs: List[Dict[str, Any]] = []
+    for run in runs:
+        coords.append([run[0]["lng"], run[0]["lat"]])
+        if router is not None:
+            with timed("road_network"):
+                segs = await asyncio.to_thread(router.route_run, run)
+        elif mode == "legs":
+            segs = await asyncio.gather(*(
+                _tomtom_route_segment_async(run[i], run[i + 1], tt_key, avoid_param, vehicle_params, fallback=False)
+                for i in range(len(run) - 1)
+            ))
+        else:
+            segs = await _tomtom_route_run(run, tt_key, avoid_param, vehicle_params)
+        failed = [i for i, seg in enumerate(segs) if seg is None]
+        for i, seg in zip(failed, _straight_segments([(run[i], run[i + 1]) for i in failed])):
+            segs[i] = seg
+        failed_set = set(failed)
+        for i, (seg_coords, seg_dist_m, seg_time_s) in enumerate(segs):
+            if seg_coords:
+                coords.extend(seg_coords[1:])  # skip duplicate
+            leg = {
+                "index": len(legs),
+                "from": {"lat": run[i]["lat"], "lng": run[i]["lng"]},
+                "to": {"lat": run[i + 1]["lat"], "lng": run[i + 1]["lng"]},
+                "distance_m": seg_dist_m,
+                "time_s": seg_time_s,
+            }
+            if i in failed_set:
+                leg["estimated"] = True  # travel model, re-timed for its departure below
+            legs.append(leg)
+    if coords:
+        a["route"] = {"type": "LineString", "coordinates": coords}
+    a["legs"] = legs
+
+    # Compute fallback ETAs if not supplied, from start stop eta, the vehicle's shift start or now
+    with timed("eta"):
+        _compute_fallback_etas(a, shift_start)
+    assign_dist_m = sum(leg["distance_m"] for leg in legs)
+    assign_time_s = sum(leg["time_s"] for leg in legs)
+    a["metrics"] = {"distance_m": round(assign_dist_m, 1), "time_s": int(assign_time_s)}
+    return assign_dist_m, assign_time_s
+
+
+def _build_tomtom_avoid_areas(zones: List[Dict[str, Any]], zone_index: Optional[ZoneIndex] = None) -> str:
+    """avoidAreas for the no-go zones, simplified to fit TOMTOM_AVOID_MAX_CHARS (see ZoneIndex.avoid_areas)."""
+    return (zone_index if zone_index is not None else ZoneIndex(zones)).avoid_areas()
 
 
 def _build_vehicle_params(vr: Dict[str, Any]) -> Dict[str, Any]:
@@ -312,42 +442,165 @@ def _build_vehicle_params(vr: Dict[str, Any]) -> Dict[str, Any]:
     return params
 
 
-def _tomtom_route_segment(start: Dict[str, float], end: Dict[str, float], key: str, avoid_param: str, vehicle_params: Dict[str, Any]) -> Tuple[List[List[float]], float, float]:
-    """Call TomTom routing for a segment and return (coords [ [lon,lat], ... ], distance_m, time_s)."""
-    lat1, lon1 = start["lat"], start["lng"]
-    lat2, lon2 = end["lat"], end["lng"]
-    path = f"{lat1},{lon1}:{lat2},{lon2}"
+def _tomtom_route_url(points: List[Dict[str, float]], key: str, avoid_param: str, vehicle_params: Dict[str, Any]) -> str:
+    path = ":".join(f"{p['lat']},{p['lng']}" for p in points)
     qs = {"key": key, "traffic": "true"}
     if avoid_param:
         qs["avoidAreas"] = avoid_param
     qs.update(vehicle_params)
-    url = "https://api.tomtom.com/routing/1/calculateRoute/" + path + "/json?" + urllib.parse.urlencode(qs)
+    return provider_url("tomtom", "/routing/1/calculateRoute/" + path + "/json?") + urllib.parse.urlencode(qs)
+
+
+def _parse_route_leg(leg: Dict[str, Any]) -> Tuple[List[List[float]], float, float]:
+    coords: List[List[float]] = []
+    for p in leg.get("points") or []:
+        lat = p.get("latitude") if isinstance(p, dict) else None
+        lon = p.get("longitude") if isinstance(p, dict) else None
+        if lat is not None and lon is not None:
+            coords.append([float(lon), float(lat)])
+    summ = leg.get("summary") or {}
+    return coords, float(summ.get("lengthInMeters") or 0), float(summ.get("travelTimeInSeconds") or 0)
+
+
+def _straight_segment(start: Dict[str, float], end: Dict[str, float]) -> Tuple[List[List[float]], float, float]:
+    """Fallback leg: straight geometry with road distance and all-day travel time from the travel model."""
+    return _straight_segments([(start, end)])[0]
+
+
+def _straight_segments(pairs: List[Tuple[Dict[str, float], Dict[str, float]]]) -> List[Tuple[List[List[float]], float, float]]:
+    """_straight_segment for many legs in one travel-model lookup."""
+    if not pairs:
+        return []
+    lat1 = [p[0]["lat"] for p in pairs]
+    lng1 = [p[0]["lng"] for p in pairs]
+    lat2 = [p[1]["lat"] for p in pairs]
+    lng2 = [p[1]["lng"] for p in pairs]
+    road_m, time_s = get_travel_model().estimate(lat1, lng1, lat2, lng2)
+    return [
+        ([[lng1[k], lat1[k]], [lng2[k], lat2[k]]], d, t)
+        for k, (d, t) in enumerate(zip(road_m.tolist(), time_s.tolist()))
+    ]
+
+
+def _calibrate(points: List[Dict[str, float]], legs: List[Tuple[List[List[float]], float, float]]) -> None:
+    """Feed routed legs between consecutive `points` to the travel model."""
+    if not legs or not calibration_enabled():
+        return
+    get_travel_model().observe(
+        [p["lat"] for p in points[:-1]], [p["lng"] for p in points[:-1]],
+        [p["lat"] for p in points[1:]], [p["lng"] for p in points[1:]],
+        [leg[1] for leg in legs], [leg[2] for leg in legs],
+    )
+
+
+def _tomtom_route_segment(start: Dict[str, float], end: Dict[str, float], key: str, avoid_param: str, vehicle_params: Dict[str, Any]) -> Tuple[List[List[float]], float, float]:
+    """Blocking wrapper around _tomtom_route_segment_async."""
+    return run_sync(_tomtom_route_segment_async(start, end, key, avoid_param, vehicle_params))
+
+
+async def _tomtom_route_segment_async(start: Dict[str, float], end: Dict[str, float], key: str, avoid_param: str, vehicle_params: Dict[str, Any], fallback: bool = True) -> Tuple[List[List[float]], float, float] | None:
+    """Call TomTom routing for a segment and return (coords [ [lon,lat], ... ], distance_m, time_s).
+    Successful responses are served from / stored in the segment cache; straight-line fallbacks are not cached.
+    With `fallback=False` a failed call returns None instead, for callers that estimate legs in batch.
+    """
+    cache = get_segment_cache()
+    cache_key = cache.make_key(start, end, avoid_param, vehicle_params) if cache is not None else None
+    if cache is not None:
+        hit = cache.get(cache_key)
+        if hit is not None:
+            return hit
+    url = _tomtom_route_url([start, end], key, avoid_param, vehicle_params)
+    t0 = time.perf_counter()
     try:
-        with urllib.request.urlopen(url, timeout=15) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
+        data = await get_client("tomtom").get_json(url, timeout=15, op="segment")
         coords: List[List[float]] = []
         distance_m = 0.0
         time_s = 0.0
         routes = data.get("routes") or []
         if routes:
             r0 = routes[0]
-            legs = r0.get("legs") or []
             summ = r0.get("summary") or {}
             distance_m = float(summ.get("lengthInMeters") or 0)
             time_s = float(summ.get("travelTimeInSeconds") or 0)
-            for leg in legs:
-                pts = leg.get("points") or []
-                for p in pts:
-                    lat = p.get("latitude") if isinstance(p, dict) else None
-                    lon = p.get("longitude") if isinstance(p, dict) else None
-                    if lat is not None and lon is not None:
-                        coords.append([float(lon), float(lat)])
-        return coords, distance_m, time_s
+            for leg in r0.get("legs") or []:
+                coords.extend(_parse_route_leg(leg)[0])
     except Exception as e:
-        # fallback: straight segment with haversine distance and assumed speed 40 km/h
-        dist_m = _haversine_m(lat1, lon1, lat2, lon2)
-        time_s = dist_m / (40_000/3600)  # 40 km/h
-        return [[lon1, lat1], [lon2, lat2]], dist_m, time_s
+        PROVIDER_ERRORS.inc(provider="tomtom")
+        return _straight_segment(start, end) if fallback else None
+    finally:
+        elapsed = time.perf_counter() - t0
+        PROVIDER_CALL_SECONDS.observe(elapsed, provider="tomtom", call="segment")
+        record("tomtom_segment", elapsed)
+    if routes:
+        _calibrate([start, end], [(coords, distance_m, time_s)])
+    if cache is not None and routes:
+        cache.put(cache_key, (coords, distance_m, time_s))
+    return coords, distance_m, time_s
+
+
+async def _tomtom_route_multi(points: List[Dict[str, float]], key: str, avoid_param: str, vehicle_params: Dict[str, Any]) -> List[Tuple[List[List[float]], float, float]] | None:
+    """One multi-waypoint calculateRoute call through `points` (at most TOMTOM_MAX_WAYPOINTS).
+    Returns one (coords, distance_m, time_s) per leg, or None if the call failed or legs don't line up.
+    """
+    url = _tomtom_route_url(points, key, avoid_param, vehicle_params)
+    t0 = time.perf_counter()
+    try:
+        data = await get_client("tomtom").get_json(url, timeout=15 + len(points) // 10, op="route")
+        routes = data.get("routes") or []
+        legs = (routes[0].get("legs") or []) if routes else []
+        if len(legs) != len(points) - 1:
+            return None
+        parsed = [_parse_route_leg(leg) for leg in legs]
+    except (ProviderHTTPError, ProviderTransportError, AttributeError, TypeError, ValueError):
+        PROVIDER_ERRORS.inc(provider="tomtom")
+        return None
+    finally:
+        elapsed = time.perf_counter() - t0
+        PROVIDER_CALL_SECONDS.observe(elapsed, provider="tomtom", call="multi")
+        record("tomtom_segment", elapsed)
+    _calibrate(points, parsed)
+    return parsed
+
+
+async def _tomtom_route_run(run: List[Dict[str, float]], key: str, avoid_param: str, vehicle_params: Dict[str, Any]) -> List[Tuple[List[List[float]], float, float] | None]:
+    """
+    Route every leg of a stop sequence. Legs already in the segment cache are reused; each stretch of
+    uncached legs goes out as one multi-waypoint call (chunked at the waypoint limit) and the returned
+    legs are cached individually. Chunks are requested concurrently; legs of failed ones are None.
+    """
+    n_legs = len(run) - 1
+    if n_legs <= 0:
+        return []
+    cache = get_segment_cache()
+    keys: List[str] = []
+    segs: List[Tuple[List[List[float]], float, float] | None] = [None] * n_legs
+    if cache is not None:
+        keys = [cache.make_key(run[i], run[i + 1], avoid_param, vehicle_params) for i in range(n_legs)]
+        segs = [cache.get(k) for k in keys]
+
+    chunks: List[Tuple[int, int]] = []  # [i, j) leg ranges to fetch
+    i = 0
+    while i < n_legs:
+        if segs[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j < n_legs and segs[j] is None and j - i < TOMTOM_MAX_WAYPOINTS - 1:
+            j += 1
+        chunks.append((i, j))
+        i = j
+
+    fetched_all = await asyncio.gather(*(
+        _tomtom_route_multi(run[i:j + 1], key, avoid_param, vehicle_params) for i, j in chunks
+    ))
+    for (i, j), fetched in zip(chunks, fetched_all):
+        if fetched is None:
+            fetched = [None] * (j - i)
+        elif cache is not None:
+            for k, seg in zip(range(i, j), fetched):
+                cache.put(keys[k], seg)
+        segs[i:j] = fetched
+    return segs
 
 
 def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -361,19 +614,47 @@ def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     return R * c
 
 
-def _compute_fallback_etas(assignment: Dict[str, Any]) -> None:
+def _haversine_matrix_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Vectorized _haversine_m: metres between every point of set 1 (rows) and set 2 (columns); NaN where a coordinate is missing."""
+    R = 6371000.0
+    phi1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    phi2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    l1 = np.radians(np.asarray(lon1, dtype=float))[:, None]
+    l2 = np.radians(np.asarray(lon2, dtype=float))[None, :]
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((l2 - l1) / 2) ** 2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def _compute_fallback_etas(assignment: Dict[str, Any], shift_start: Any = None) -> None:
+    """
+    Chain leg times from the first stop's ETA (or shift start, or now) into eta_calc for stops without
+    an ETA. Estimated legs are re-timed by the travel model for the hour they depart: the stop's own
+    ETA when it has one, the chained time otherwise.
+    """
     stops = assignment.get("stops") or []
     legs = assignment.get("legs") or []
     if not stops or not legs:
         return
     # Base time from first stop's eta if parseable, otherwise now
-    base_time = _parse_dt(stops[0].get("eta")) or datetime.utcnow()
+    base_time = _parse_dt(stops[0].get("eta")) or _parse_dt(shift_start) or datetime.utcnow()
+    if base_time.tzinfo is not None:
+        # ETAs are written as naive UTC + "Z"; an aware base would render as "+00:00Z"
+        base_time = base_time.astimezone(timezone.utc).replace(tzinfo=None)
     t = base_time
     # first stop gets base eta if not present
     if not stops[0].get("eta"):
         stops[0]["eta_calc"] = t.isoformat() + "Z"
+    model = get_travel_model()
     for i in range(len(legs)):
-        dt = timedelta(seconds=float(legs[i].get("time_s") or 0))
+        leg = legs[i]
+        if leg.get("estimated"):
+            hour = local_hour(stops[i].get("eta")) if i < len(stops) else None
+            src = leg.get("from") or {}
+            leg["time_s"] = float(round(model.travel_time_s(
+                src.get("lat", math.nan), src.get("lng", math.nan), float(leg.get("distance_m") or 0),
+                local_hour(t) if hour is None else hour,
+            )))
+        dt = timedelta(seconds=float(leg.get("time_s") or 0))
         t = t + dt
         if i+1 < len(stops) and not stops[i+1].get("eta"):
             stops[i+1]["eta_calc"] = t.isoformat() + "Z"
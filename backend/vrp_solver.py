@@ -0,0 +1,669 @@
+"""
+Local pickup-and-delivery VRP solver used when NextBillion is unavailable.
+
+Routes are built with regret-2 insertion and then improved by relocate, or-opt and 2-opt moves
+until a wall-clock budget runs out. Every route respects vehicle capacity, max_tasks, the vehicle
+shift, stop time windows and pickup-before-delivery precedence; shipments that fit nowhere are
+reported under "unassigned". Travel times are haversine distance at a constant average speed, or a
+road travel matrix when the caller supplies one (see travel_matrix.py).
+"""
+import heapq
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from spatial_index import GridIndex, neighbour_lists
+from problem import Problem
+from utils import _iso, _nullable
+from zones import ZoneIndex
+
+INF = float("inf")
+EPS = 1e-6
+
+
+class _MatrixRows(dict):
+    """
+    Haversine matrix over (lat, lng) as a dict of row lists, each computed on first access. Indexing is
+    a plain dict lookup, as fast as nested lists from Python loops, and a solve that only looks at a few
+    routes (plan repairs) never pays for the full N^2 matrix. Values match _haversine_matrix_m / divisor
+    with NaN (missing coordinates) as 0.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, divisor: float = 1.0):
+        super().__init__()
+        self._phi = np.radians(lat)
+        self._lam = np.radians(lng)
+        self._cos = np.cos(self._phi)
+        self._divisor = divisor
+
+    def __missing__(self, a: int) -> List[float]:
+        phi, lam = self._phi, self._lam
+        h = np.sin((phi - phi[a]) / 2) ** 2 + self._cos[a] * self._cos * np.sin((lam - lam[a]) / 2) ** 2
+        row = 6371000.0 * 2 * np.arctan2(np.sqrt(h), np.sqrt(1 - h))
+        row[np.isnan(row)] = 0.0
+        if self._divisor != 1.0:
+            row /= self._divisor
+        self[a] = out = row.tolist()
+        return out
+
+
+class _DenseRows(dict):
+    """Rows of a precomputed node x node matrix (e.g. travel_matrix.TravelMatrix), listed on first access."""
+
+    def __init__(self, matrix: np.ndarray):
+        super().__init__()
+        self._matrix = matrix
+
+    def __missing__(self, a: int) -> List[float]:
+        self[a] = out = self._matrix[a].tolist()
+        return out
+
+
+def node_coordinates(problem: Problem) -> Tuple[np.ndarray, np.ndarray]:
+    """(lat, lng) per PDPInstance node; NaN for missing points and for both stops of unroutable shipments."""
+    n, m = problem.n_shipments, problem.n_vehicles
+    size = 2 * n + 2 * m
+    routable = problem.routable
+    lat = np.full(size, np.nan)
+    lng = np.full(size, np.nan)
+    lat[0:2 * n:2] = np.where(routable, problem.pickup_lat, np.nan)
+    lng[0:2 * n:2] = np.where(routable, problem.pickup_lng, np.nan)
+    lat[1:2 * n:2] = np.where(routable, problem.delivery_lat, np.nan)
+    lng[1:2 * n:2] = np.where(routable, problem.delivery_lng, np.nan)
+    for offset, vlat, vlng in ((0, problem.start_lat, problem.start_lng), (1, problem.end_lat, problem.end_lng)):
+        ok = ~(np.isnan(vlat) | np.isnan(vlng))
+        lat[2 * n + offset::2] = np.where(ok, vlat, np.nan)
+        lng[2 * n + offset::2] = np.where(ok, vlng, np.nan)
+    return lat, lng
+
+
+class PDPInstance:
+    """
+    Flat arrays for one solve. Shipment i owns pickup node 2i and delivery node 2i+1; vehicle v owns
+    start node 2N+2v and end node 2N+2v+1. A missing vehicle start/end becomes a zero-distance node.
+    With a `zone_index`, shipments with a stop inside a no-go zone are left out (see `blocked`).
+    `matrix`, if given, is (distance_m, time_s) over the nodes in node_coordinates order, e.g. road
+    travel from travel_matrix; otherwise both come from haversine distance at speed_kmh.
+    """
+
+    def __init__(
+        self,
+        problem: Problem,
+        *,
+        speed_kmh: float = 40.0,
+        service_time_s: float = 0.0,
+        zone_index: Optional[ZoneIndex] = None,
+        matrix: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ):
+        self.problem = problem
+        n, m = problem.n_shipments, problem.n_vehicles
+        self.n_ship = n
+        self.n_veh = m
+        size = 2 * n + 2 * m
+        self.routable = problem.routable.tolist()  # both stops have coordinates
+        lat, lng = node_coordinates(problem)
+        self.blocked: Set[int] = set()
+        if zone_index is not None and zone_index.nogo and n:
+            inside = zone_index.nogo_mask(lat[:2 * n], lng[:2 * n])
+            self.blocked = set(np.flatnonzero(inside[0::2] | inside[1::2]).tolist())
+            for s in self.blocked:
+                self.routable[s] = False
+
+        tw_s = np.full(size, -INF)
+        tw_e = np.full(size, INF)
+        tw_s[0:2 * n:2], tw_e[0:2 * n:2] = problem.pickup_tw_ts[:, 0], problem.pickup_tw_ts[:, 1]
+        tw_s[1:2 * n:2], tw_e[1:2 * n:2] = problem.delivery_tw_ts[:, 0], problem.delivery_tw_ts[:, 1]
+        tw_s = np.nan_to_num(tw_s, nan=-INF, neginf=-INF, posinf=INF)
+        tw_e = np.nan_to_num(tw_e, nan=INF, neginf=-INF, posinf=INF)
+        # Vehicles without shift_start leave at the earliest shipment window, else the earliest shift.
+        # With neither there is no clock: schedules are relative to 0 and carry no ETAs (see `timed`).
+        ship_starts = tw_s[:2 * n]
+        anchors = ship_starts[np.isfinite(ship_starts)]
+        if not anchors.size:
+            anchors = problem.shift_ts[:, 0][np.isfinite(problem.shift_ts[:, 0])]
+        self.timed = bool(anchors.size)
+        default_start = float(anchors.min()) if anchors.size else 0.0
+        self.shift_s = np.nan_to_num(problem.shift_ts[:, 0], nan=default_start).tolist()
+        self.shift_e = np.nan_to_num(problem.shift_ts[:, 1], nan=INF).tolist()
+        tw_e[2 * n + 1::2] = self.shift_e
+        self.tw_s = tw_s.tolist()
+        self.tw_e = tw_e.tolist()
+        self.svc = [float(service_time_s)] * (2 * n) + [0.0] * (2 * m)
+        self.qty = np.clip(np.nan_to_num(problem.quantity, nan=0.0), 0, None).astype(int).tolist()
+        self.cap = np.nan_to_num(problem.capacity, nan=INF).tolist()
+        self.max_tasks = np.nan_to_num(problem.max_tasks, nan=INF).tolist()
+
+        if matrix is not None:
+            self.dist = _DenseRows(matrix[0])
+            self.time = _DenseRows(matrix[1])
+        else:
+            self.dist = _MatrixRows(lat, lng)
+            mps = max(float(speed_kmh), 1e-3) * 1000.0 / 3600.0
+            self.time = _MatrixRows(lat, lng, mps)
+        self.lat = lat
+        self.lng = lng
+
+    def start(self, v: int) -> int:
+        return 2 * self.n_ship + 2 * v
+
+    def end(self, v: int) -> int:
+        return 2 * self.n_ship + 2 * v + 1
+
+
+class _RouteState:
+    """Schedule of one vehicle's route with the forward/backward arrays used for O(1) insertion checks."""
+
+    __slots__ = ("v", "stops", "nodes", "st", "load", "latest", "cost")
+
+    def __init__(self, inst: PDPInstance, v: int, stops: List[int]):
+        self.v = v
+        self.stops = stops
+        self.refresh(inst)
+
+    def refresh(self, inst: PDPInstance) -> None:
+        v = self.v
+        nodes = [inst.start(v)] + self.stops + [inst.end(v)]
+        T, D, svc, tw_s = inst.time, inst.dist, inst.svc, inst.tw_s
+        st = [inst.shift_s[v]]
+        load = [0.0]
+        cost = 0.0
+        for k in range(1, len(nodes)):
+            a, b = nodes[k - 1], nodes[k]
+            st.append(max(st[-1] + svc[a] + T[a][b], tw_s[b]))
+            cost += D[a][b]
+            if b < 2 * inst.n_ship:
+                q = inst.qty[b // 2]
+                load.append(load[-1] + (q if b % 2 == 0 else -q))
+            else:
+                load.append(load[-1])
+        latest = [0.0] * len(nodes)
+        latest[-1] = inst.tw_e[nodes[-1]]
+        for k in range(len(nodes) - 2, -1, -1):
+            a, b = nodes[k], nodes[k + 1]
+            latest[k] = min(inst.tw_e[a], latest[k + 1] - T[a][b] - svc[a])
+        self.nodes, self.st, self.load, self.latest, self.cost = nodes, st, load, latest, cost
+
+
+def _schedule_ok(inst: PDPInstance, v: int, stops: List[int]) -> Tuple[bool, float]:
+    """Full O(L) check of an arbitrary stop order: windows, shift, capacity, max_tasks, precedence."""
+    if len(stops) > inst.max_tasks[v]:
+        return False, INF
+    seen = set()
+    for node in stops:
+        if node % 2 == 1 and node - 1 not in seen:
+            return False, INF
+        seen.add(node)
+    T, D, svc = inst.time, inst.dist, inst.svc
+    prev = inst.start(v)
+    t = inst.shift_s[v]
+    load = 0.0
+    cost = 0.0
+    for node in stops + [inst.end(v)]:
+        t = max(t + svc[prev] + T[prev][node], inst.tw_s[node])
+        if t > inst.tw_e[node] + EPS:
+            return False, INF
+        cost += D[prev][node]
+        if node < 2 * inst.n_ship:
+            q = inst.qty[node // 2]
+            load += q if node % 2 == 0 else -q
+            if load > inst.cap[v] + EPS:
+                return False, INF
+        prev = node
+    return True, cost
+
+
+def _best_insertion(inst: PDPInstance, r: _RouteState, s: int) -> Tuple[float, int, int]:
+    """
+    Cheapest feasible insertion of shipment s into route r as (delta_cost, i, j): pickup goes after
+    position i and delivery after position j (j == i means directly after the pickup). INF if none.
+    """
+    v = r.v
+    if len(r.stops) + 2 > inst.max_tasks[v]:
+        return INF, -1, -1
+    p, d = 2 * s, 2 * s + 1
+    q = inst.qty[s]
+    cap = inst.cap[v]
+    nodes, st, load, latest = r.nodes, r.st, r.load, r.latest
+    T, D, svc, tw_s, tw_e = inst.time, inst.dist, inst.svc, inst.tw_s, inst.tw_e
+    L = len(nodes) - 2
+    best = (INF, -1, -1)
+    for i in range(0, L + 1):
+        if load[i] + q > cap + EPS:
+            continue
+        a, an = nodes[i], nodes[i + 1]
+        t_p = max(st[i] + svc[a] + T[a][p], tw_s[p])
+        if t_p > tw_e[p] + EPS:
+            continue
+        add_p = D[a][p] + D[p][an] - D[a][an]
+        if add_p >= best[0]:
+            continue
+        # Delivery straight after the pickup
+        t_d = max(t_p + svc[p] + T[p][d], tw_s[d])
+        if t_d <= tw_e[d] + EPS:
+            t_b = max(t_d + svc[d] + T[d][an], tw_s[an])
+            if t_b <= latest[i + 1] + EPS:
+                delta = D[a][p] + D[p][d] + D[d][an] - D[a][an]
+                if delta < best[0]:
+                    best = (delta, i, i)
+        # Delivery later: push the shifted schedule forward one existing stop at a time
+        prev, t_prev = p, t_p
+        for k in range(i + 1, L + 1):
+            n = nodes[k]
+            t_k = max(t_prev + svc[prev] + T[prev][n], tw_s[n])
+            # The shipment rides through stop k: it must still be on time and leave room for q
+            if t_k > tw_e[n] + EPS or load[k] + q > cap + EPS:
+                break
+            b = nodes[k + 1]
+            t_d = max(t_k + svc[n] + T[n][d], tw_s[d])
+            if t_d <= tw_e[d] + EPS:
+                t_b = max(t_d + svc[d] + T[d][b], tw_s[b])
+                if t_b <= latest[k + 1] + EPS:
+                    delta = add_p + D[n][d] + D[d][b] - D[n][b]
+                    if delta < best[0]:
+                        best = (delta, i, k)
+            prev, t_prev = n, t_k
+    return best
+
+
+def _insert(inst: PDPInstance, r: _RouteState, s: int, i: int, j: int) -> None:
+    stops = r.stops
+    stops.insert(i, 2 * s)
+    stops.insert(j + 1, 2 * s + 1)
+    r.refresh(inst)
+
+
+def _remove(inst: PDPInstance, r: _RouteState, s: int) -> None:
+    r.stops = [n for n in r.stops if n // 2 != s]
+    r.refresh(inst)
+
+
+class LocalSolver:
+    """Regret-2 construction followed by local search, bounded by `time_budget_s` of wall clock."""
+
+    def __init__(
+        self,
+        inst: PDPInstance,
+        *,
+        time_budget_s: float = 2.0,
+        candidate_vehicles: int = 6,
+        granular_neighbours: int = 8,
+        seed: int = 0,
+    ):
+        self.inst = inst
+        self.deadline = time.monotonic() + max(0.05, float(time_budget_s))
+        self.rng = random.Random(seed)
+        self.routes = [_RouteState(inst, v, []) for v in range(inst.n_veh)]
+        self.where: Dict[int, int] = {}  # shipment -> vehicle
+        self.unassigned: List[int] = []
+        self.touched: Set[int] = set()  # vehicles whose stops changed since construction or load
+        self.index_stats: Dict[str, Any] = {}
+        self.candidates = self._nearest_vehicles(max(1, min(int(candidate_vehicles), inst.n_veh)))
+        self.neighbours = self._shipment_neighbours(max(0, int(granular_neighbours)))
+
+    def _nearest_vehicles(self, k: int) -> List[List[int]]:
+        """Per shipment, the k vehicles whose start (or end) is nearest its pickup, via a grid index."""
+        inst = self.inst
+        starts = [inst.start(v) for v in range(inst.n_veh)]
+        ends = [inst.end(v) for v in range(inst.n_veh)]
+        vlat = np.where(np.isnan(inst.lat[starts]), inst.lat[ends], inst.lat[starts])
+        vlng = np.where(np.isnan(inst.lng[starts]), inst.lng[ends], inst.lng[starts])
+        # Vehicles without any position run open routes; they are a candidate for everyone
+        floating = np.nonzero(np.isnan(vlat) | np.isnan(vlng))[0].tolist()
+        index = GridIndex(vlat, vlng)
+        pickups = np.arange(0, 2 * inst.n_ship, 2)
+        hits = index.knn_many(inst.lat[pickups], inst.lng[pickups], k)
+        self.index_stats["vehicles"] = index.stats()
+        return [[v for v, _ in row] + floating for row in hits]
+
+    def _shipment_neighbours(self, k: int) -> List[List[int]]:
+        """Granular neighbour lists: the k shipments with the nearest pickups to each shipment's pickup."""
+        inst = self.inst
+        if k == 0 or inst.n_ship < 2:
+            return [[] for _ in range(inst.n_ship)]
+        pickups = np.arange(0, 2 * inst.n_ship, 2)
+        index = GridIndex(inst.lat[pickups], inst.lng[pickups])
+        near = neighbour_lists(index, k)
+        self.index_stats["shipments"] = index.stats()
+        return [near.get(s, []) for s in range(inst.n_ship)]
+
+    def time_left(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    def total_cost(self) -> float:
+        return sum(r.cost for r in self.routes if r.stops)
+
+    def construct(self) -> None:
+        inst = self.inst
+        self.unassigned = [s for s in range(inst.n_ship) if not inst.routable[s]]
+        self.unassigned.extend(self._regret_insert([s for s in range(inst.n_ship) if inst.routable[s]]))
+
+    def _regret_insert(self, pending: List[int]) -> List[int]:
+        """
+        Regret-2 insertion of `pending` shipments over their candidate vehicles; returns those that fit
+        nowhere. Regret keys live in a lazy heap, so each step re-evaluates only the shipments that
+        have the route just inserted into among their candidates. If the time budget runs out, the
+        rest go in with one cheapest-insertion pass.
+        """
+        inst = self.inst
+        order = {s: k for k, s in enumerate(pending)}
+        left = set(pending)
+        best: Dict[int, Dict[int, Tuple[float, int, int]]] = {}
+        by_route: Dict[int, List[int]] = {}
+        for s in pending:
+            best[s] = {v: _best_insertion(inst, self.routes[v], s) for v in self.candidates[s]}
+            for v in best[s]:
+                by_route.setdefault(v, []).append(s)
+        version = dict.fromkeys(pending, 0)
+        heap: List[Tuple[float, float, int, int, int]] = []
+
+        def push(s: int) -> None:
+            version[s] += 1
+            costs = sorted(c[0] for c in best[s].values())
+            if not costs or costs[0] == INF:
+                return
+            second = costs[1] if len(costs) > 1 else INF
+            # Shipments with a single feasible route go first; otherwise largest regret, then cheapest
+            regret = second - costs[0] if second < INF else INF
+            heapq.heappush(heap, (-regret, costs[0], order[s], s, version[s]))
+
+        for s in pending:
+            push(s)
+        while heap and self.time_left():
+            _, _, _, pick, ver = heapq.heappop(heap)
+            if pick not in left or ver != version[pick]:
+                continue
+            v = min(best[pick], key=lambda vv: best[pick][vv][0])
+            _, i, j = best[pick][v]
+            self._place(pick, v, i, j)
+            left.discard(pick)
+            for s in by_route[v]:
+                if s in left:
+                    best[s][v] = _best_insertion(inst, self.routes[v], s)
+                    push(s)
+        remaining = [s for s in pending if s in left]
+        if not heap:
+            return remaining
+        # Out of time: cached insertions are current except on routes this pass changes
+        unplaced = []
+        changed: Set[int] = set()
+        for s in remaining:
+            for v in changed.intersection(best[s]):
+                best[s][v] = _best_insertion(inst, self.routes[v], s)
+            v = min(best[s], key=lambda vv: best[s][vv][0])
+            delta, i, j = best[s][v]
+            if delta < INF:
+                self._place(s, v, i, j)
+                changed.add(v)
+            else:
+                unplaced.append(s)
+        return unplaced
+
+    def _place(self, s: int, v: int, i: int, j: int) -> None:
+        _insert(self.inst, self.routes[v], s, i, j)
+        self.where[s] = v
+        self.touched.add(v)
+
+    def _try_unassigned(self) -> bool:
+        improved = False
+        for s in list(self.unassigned):
+            if not self.inst.routable[s]:
+                continue
+            options = [(_best_insertion(self.inst, self.routes[v], s), v) for v in range(self.inst.n_veh)]
+            (delta, i, j), v = min(options, key=lambda o: o[0][0])
+            if delta < INF:
+                _insert(self.inst, self.routes[v], s, i, j)
+                self.where[s] = v
+                self.touched.add(v)
+                self.unassigned.remove(s)
+                improved = True
+        return improved
+
+    def _relocate(self, ships: Optional[Iterable[int]] = None) -> bool:
+        inst = self.inst
+        improved = False
+        ships = list(self.where if ships is None else ships)
+        self.rng.shuffle(ships)
+        for s in ships:
+            if not self.time_left():
+                break
+            v0 = self.where[s]
+            r0 = self.routes[v0]
+            before = r0.cost
+            saved = list(r0.stops)
+            _remove(inst, r0, s)
+            gain = before - r0.cost
+            best = (INF, -1, -1, -1)
+            # Granular neighbourhood: nearby vehicles plus whichever routes serve the nearest shipments
+            targets = set(self.candidates[s]) | {self.where[t] for t in self.neighbours[s] if t in self.where}
+            targets.add(v0)
+            for v in targets:
+                delta, i, j = _best_insertion(inst, self.routes[v], s)
+                if delta < best[0]:
+                    best = (delta, i, j, v)
+            if best[0] < gain - EPS:
+                _insert(inst, self.routes[best[3]], s, best[1], best[2])
+                self.where[s] = best[3]
+                self.touched.update((v0, best[3]))
+                improved = True
+            else:
+                r0.stops = saved
+                r0.refresh(inst)
+        return improved
+
+    def _intra_route(self, r: _RouteState) -> bool:
+        """First-improvement or-opt (segments of 1-3 stops) and 2-opt within one route."""
+        inst = self.inst
+        stops = r.stops
+        L = len(stops)
+        for seg in (1, 2, 3):
+            for i in range(0, L - seg + 1):
+                if not self.time_left():
+                    return False
+                block = stops[i:i + seg]
+                rest = stops[:i] + stops[i + seg:]
+                for j in range(0, len(rest) + 1):
+                    if j == i:
+                        continue
+                    cand = rest[:j] + block + rest[j:]
+                    ok, cost = _schedule_ok(inst, r.v, cand)
+                    if ok and cost < r.cost - EPS:
+                        r.stops = cand
+                        r.refresh(inst)
+                        self.touched.add(r.v)
+                        return True
+        for i in range(0, L - 1):
+            if not self.time_left():
+                return False
+            for j in range(i + 1, L):
+                cand = stops[:i] + stops[i:j + 1][::-1] + stops[j + 1:]
+                ok, cost = _schedule_ok(inst, r.v, cand)
+                if ok and cost < r.cost - EPS:
+                    r.stops = cand
+                    r.refresh(inst)
+                    self.touched.add(r.v)
+                    return True
+        return False
+
+    def improve(self) -> None:
+        while self.time_left():
+            improved = self._relocate()
+            for r in self.routes:
+                while r.stops and self.time_left() and self._intra_route(r):
+                    improved = True
+            if self.unassigned and self._try_unassigned():
+                improved = True
+            if not improved:
+                break
+
+    def solve(self) -> "LocalSolver":
+        self.construct()
+        self.improve()
+        return self
+
+    def load(self, routes: Sequence[Sequence[int]]) -> "LocalSolver":
+        """Start from existing per-vehicle stop sequences (pickup 2s, delivery 2s+1) instead of constructing."""
+        for v, stops in enumerate(routes):
+            self.routes[v] = _RouteState(self.inst, v, list(stops))
+            for node in stops:
+                self.where[node // 2] = v
+        self.touched = set()
+        return self
+
+    def repair(self, pending: Sequence[int], touched: Iterable[int] = ()) -> "LocalSolver":
+        """
+        Insert `pending` shipments into the loaded routes (regret-2, then any vehicle for leftovers) and
+        run local search on just the routes touched by the change, so untouched vehicles keep their stops.
+        """
+        inst = self.inst
+        self.touched.update(touched)
+        self.unassigned = [s for s in pending if not inst.routable[s]]
+        self.unassigned.extend(self._regret_insert([s for s in pending if inst.routable[s]]))
+        if self.unassigned:
+            self._try_unassigned()
+        while self.time_left():
+            ships = [s for s, v in self.where.items() if v in self.touched]
+            improved = self._relocate(ships)
+            for v in list(self.touched):
+                r = self.routes[v]
+                while r.stops and self.time_left() and self._intra_route(r):
+                    improved = True
+            if not improved:
+                break
+        return self
+
+
+def solve_pdp(
+    problem: Problem,
+    options: Optional[Dict[str, Any]] = None,
+    zone_index: Optional[ZoneIndex] = None,
+    matrix: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Dict[str, Any]:
+    """
+    Solve with the local engine and return the same {summary, assignments} shape as _mock_optimize,
+    with computed ETAs on every stop plus an "unassigned" list.
+
+    options: time_budget_s (2.0), avg_speed_kmh (40), service_time_s (0), candidate_vehicles (6),
+    granular_neighbours (8), seed (0). Shipments with a stop inside one of `zone_index`'s no-go zones
+    are reported unassigned rather than routed. `matrix` replaces haversine travel (see PDPInstance).
+    """
+    options = options or {}
+    if not problem.n_vehicles:
+        return {"summary": {}, "assignments": []}
+    t0 = time.monotonic()
+    inst = PDPInstance(
+        problem,
+        speed_kmh=float(options.get("avg_speed_kmh") or 40.0),
+        service_time_s=float(options.get("service_time_s") or 0.0),
+        zone_index=zone_index,
+        matrix=matrix,
+    )
+    solver = LocalSolver(
+        inst,
+        time_budget_s=float(options.get("time_budget_s") or 2.0),
+        candidate_vehicles=int(options.get("candidate_vehicles") or 6),
+        granular_neighbours=int(options.get("granular_neighbours") or 8),
+        seed=int(options.get("seed") or 0),
+    ).solve()
+    return _to_result(inst, solver, int((time.monotonic() - t0) * 1000))
+
+
+def repair_pdp(
+    problem: Problem,
+    routes: Sequence[Sequence[int]],
+    pending: Sequence[int],
+    touched: Iterable[int] = (),
+    options: Optional[Dict[str, Any]] = None,
+    zone_index: Optional[ZoneIndex] = None,
+) -> Tuple[Dict[str, Any], List[List[int]], Set[int]]:
+    """
+    Re-optimize an existing plan after a change. `routes[v]` is vehicle v's stop sequence in `problem`
+    as shipment nodes (2s pickup, 2s+1 delivery); `pending` shipments are inserted by cheapest feasible
+    insertion and `touched` vehicles (e.g. ones that lost stops) are improved alongside those receiving
+    them. Returns (result shaped like solve_pdp's, new routes, vehicles whose stops changed).
+
+    options: as solve_pdp, with repair_budget_s (0.5) bounding the search instead of time_budget_s.
+    """
+    options = options or {}
+    t0 = time.monotonic()
+    inst = PDPInstance(
+        problem,
+        speed_kmh=float(options.get("avg_speed_kmh") or 40.0),
+        service_time_s=float(options.get("service_time_s") or 0.0),
+        zone_index=zone_index,
+    )
+    solver = LocalSolver(
+        inst,
+        time_budget_s=float(options.get("repair_budget_s") or 0.5),
+        candidate_vehicles=int(options.get("candidate_vehicles") or 6),
+        granular_neighbours=int(options.get("granular_neighbours") or 8),
+        seed=int(options.get("seed") or 0),
+    ).load(routes).repair(pending, touched)
+    new_routes = [list(r.stops) for r in solver.routes]
+    changed = {v for v in solver.touched if new_routes[v] != list(routes[v])}
+    return _to_result(inst, solver, int((time.monotonic() - t0) * 1000)), new_routes, changed
+
+
+def _to_result(inst: PDPInstance, solver: LocalSolver, elapsed_ms: int) -> Dict[str, Any]:
+    problem = inst.problem
+    start_lat, start_lng = _nullable(problem.start_lat), _nullable(problem.start_lng)
+    end_lat, end_lng = _nullable(problem.end_lat), _nullable(problem.end_lng)
+    stop_cols = {
+        "pickup": (problem.pickup_ids, problem.pickup_lat.tolist(), problem.pickup_lng.tolist(), problem.pickup_tw),
+        "delivery": (problem.delivery_ids, problem.delivery_lat.tolist(), problem.delivery_lng.tolist(), problem.delivery_tw),
+    }
+
+    def eta(t: float) -> Optional[str]:
+        return _iso(t) if inst.timed and t > -INF else None
+
+    assignments = []
+    total_dist = 0.0
+    total_time = 0.0
+    for r in solver.routes:
+        v = r.v
+        stops: List[Dict[str, Any]] = []
+        if start_lat[v] is not None:
+            stops.append({"type": "start", "lat": start_lat[v], "lng": start_lng[v], "eta": eta(r.st[0])})
+        for k, node in enumerate(r.stops, start=1):
+            s = node // 2
+            kind = "pickup" if node % 2 == 0 else "delivery"
+            ids, lats, lngs, tws = stop_cols[kind]
+            stops.append({
+                "type": kind,
+                "id": ids[s],
+                "lat": lats[s],
+                "lng": lngs[s],
+                "eta": eta(r.st[k]) or tws[s][0],
+            })
+        if end_lat[v] is not None:
+            stops.append({"type": "end", "lat": end_lat[v], "lng": end_lng[v], "eta": eta(r.st[-1])})
+        coords = [[st["lng"], st["lat"]] for st in stops if st.get("lat") is not None and st.get("lng") is not None]
+        if r.stops:
+            total_dist += r.cost
+            total_time += max(0.0, r.st[-1] - r.st[0])
+        assignments.append({
+            "vehicle_id": problem.vehicle_ids[v] or f"veh-{v+1}",
+            "stops": stops,
+            "route": {"type": "LineString", "coordinates": coords},
+        })
+    unassigned = [
+        {
+            "id": problem.shipment_id(s),
+            "reason": "stop inside no-go zone" if s in inst.blocked
+            else "missing coordinates" if not inst.routable[s] else "no feasible vehicle",
+        }
+        for s in sorted(solver.unassigned)
+    ]
+    return {
+        "summary": {
+            "total_distance_km": round(total_dist / 1000.0, 3),
+            "total_time_min": int(total_time / 60),
+            "unassigned": len(unassigned),
+            "solver": "local",
+            "solve_ms": elapsed_ms,
+            "spatial_index": solver.index_stats,
+        },
+        "assignments": assignments,
+        "unassigned": unassigned,
+    }
@@ -0,0 +1,309 @@
+"""
+Zone index for no-go zones and geofences, built once per request.
+
+Zones arrive as {type: 'nogo'|'fence', polygon: [[lat, lng], ...]}. Each polygon keeps its edges in
+latitude bands, so a point-in-polygon ray cast or a segment crossing test only looks at the few
+edges near the query, and a coarse grid over all zones' bounding boxes picks the candidate polygons.
+Tests are planar in lat/lng degrees, which is how straight-line legs are drawn anyway.
+
+The same index renders TomTom's avoidAreas parameter, simplifying polygons until the encoded string
+fits a URL budget.
+"""
+import logging
+import math
+import os
+import urllib.parse
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from geometry import simplify
+
+# Encoded length budget for avoidAreas; the waypoint path shares the same URL
+DEFAULT_AVOID_MAX_CHARS = 4000
+# Douglas-Peucker tolerances (m) tried in turn before falling back to bounding boxes
+_AVOID_TOLERANCES_M = (5.0, 10.0, 25.0, 50.0, 100.0, 250.0)
+# Stop listing individual violations past this many; the count stays exact
+MAX_VIOLATIONS = 200
+
+logger = logging.getLogger("optimizer")
+
+
+class Zone:
+    """One polygon ring (closing vertex dropped) with its edges bucketed into latitude bands."""
+
+    __slots__ = ("index", "kind", "id", "lats", "lngs", "bbox", "_lat0", "_band_h", "_bands")
+
+    def __init__(self, index: int, kind: str, zone_id: Any, lats: List[float], lngs: List[float]):
+        self.index = index
+        self.kind = kind
+        self.id = zone_id
+        self.lats = lats
+        self.lngs = lngs
+        self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+        n = len(lats)
+        n_bands = max(1, int(math.sqrt(n)))
+        self._lat0 = self.bbox[0]
+        self._band_h = (self.bbox[2] - self.bbox[0]) / n_bands or 1.0
+        self._bands: List[List[int]] = [[] for _ in range(n_bands)]
+        for i in range(n):
+            j = (i + 1) % n
+            lo, hi = self._band(min(lats[i], lats[j])), self._band(max(lats[i], lats[j]))
+            for b in range(lo, hi + 1):
+                self._bands[b].append(i)
+
+    def _band(self, lat: float) -> int:
+        return min(len(self._bands) - 1, max(0, int((lat - self._lat0) / self._band_h)))
+
+    def contains(self, lat: float, lng: float) -> bool:
+        """Even-odd ray cast eastwards from (lat, lng)."""
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        lats, lngs, n = self.lats, self.lngs, len(self.lats)
+        inside = False
+        for i in self._bands[self._band(lat)]:
+            j = (i + 1) % n
+            y1, y2 = lats[i], lats[j]
+            if (y1 > lat) != (y2 > lat):
+                x = lngs[i] + (lat - y1) * (lngs[j] - lngs[i]) / (y2 - y1)
+                if lng < x:
+                    inside = not inside
+        return inside
+
+    def crosses(self, lat1: float, lng1: float, lat2: float, lng2: float) -> bool:
+        """True if the segment starts, ends or passes through the polygon (touching the boundary counts)."""
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if max(lat1, lat2) < min_lat or min(lat1, lat2) > max_lat or max(lng1, lng2) < min_lng or min(lng1, lng2) > max_lng:
+            return False
+        if self.contains(lat1, lng1) or self.contains(lat2, lng2):
+            return True
+        lats, lngs, n = self.lats, self.lngs, len(self.lats)
+        seen = set()
+        for b in range(self._band(min(lat1, lat2)), self._band(max(lat1, lat2)) + 1):
+            for i in self._bands[b]:
+                if i in seen:
+                    continue
+                seen.add(i)
+                j = (i + 1) % n
+                if _segments_meet(lng1, lat1, lng2, lat2, lngs[i], lats[i], lngs[j], lats[j]):
+                    return True
+        return False
+
+    def describe(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"zone": self.index, "zone_type": self.kind}
+        if self.id is not None:
+            out["zone_id"] = self.id
+        return out
+
+
+def _orient(ax: float, ay: float, bx: float, by: float, cx: float, cy: float) -> float:
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def _segments_meet(ax, ay, bx, by, cx, cy, dx, dy) -> bool:
+    d1, d2 = _orient(cx, cy, dx, dy, ax, ay), _orient(cx, cy, dx, dy, bx, by)
+    d3, d4 = _orient(ax, ay, bx, by, cx, cy), _orient(ax, ay, bx, by, dx, dy)
+    if ((d1 > 0 and d2 < 0) or (d1 < 0 and d2 > 0)) and ((d3 > 0 and d4 < 0) or (d3 < 0 and d4 > 0)):
+        return True
+
+    def on(px, py, qx, qy, rx, ry):  # r on segment p-q, given collinear
+        return min(px, qx) <= rx <= max(px, qx) and min(py, qy) <= ry <= max(py, qy)
+
+    return (
+        (d1 == 0 and on(cx, cy, dx, dy, ax, ay)) or (d2 == 0 and on(cx, cy, dx, dy, bx, by))
+        or (d3 == 0 and on(ax, ay, bx, by, cx, cy)) or (d4 == 0 and on(ax, ay, bx, by, dx, dy))
+    )
+
+
+def _parse_ring(polygon: Any) -> Optional[Tuple[List[float], List[float]]]:
+    lats: List[float] = []
+    lngs: List[float] = []
+    for pt in polygon or []:
+        try:
+            lat, lng = float(pt[0]), float(pt[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        if math.isfinite(lat) and math.isfinite(lng):
+            lats.append(lat)
+            lngs.append(lng)
+    if len(lats) > 1 and lats[0] == lats[-1] and lngs[0] == lngs[-1]:
+        lats.pop()
+        lngs.pop()
+    return (lats, lngs) if len(lats) >= 3 else None
+
+
+def _format_poly(lats: Sequence[float], lngs: Sequence[float], ndigits: Optional[int] = None) -> str:
+    if ndigits is None:
+        parts = [f"{lat},{lng}" for lat, lng in zip(lats, lngs)]
+    else:
+        parts = [f"{round(lat, ndigits)},{round(lng, ndigits)}" for lat, lng in zip(lats, lngs)]
+    parts.append(parts[0])
+    return "poly:" + ":".join(parts)
+
+
+def _encoded_len(s: str) -> int:
+    return len(urllib.parse.quote_plus(s))
+
+
+class ZoneIndex:
+    """
+    Polygons from a request's `zones` (entries with fewer than 3 valid vertices are skipped) under a
+    uniform grid of about `grid_cells` x `grid_cells` cells over their combined bounding box.
+    Zones are reported by their position in the input list.
+    """
+
+    def __init__(self, zones: Optional[List[Dict[str, Any]]], *, grid_cells: int = 32):
+        self.zones: List[Zone] = []
+        for k, z in enumerate(zones or []):
+            if not isinstance(z, dict) or z.get("type") not in ("nogo", "fence"):
+                continue
+            ring = _parse_ring(z.get("polygon"))
+            if ring is not None:
+                self.zones.append(Zone(k, z["type"], z.get("id", z.get("name")), *ring))
+        self.nogo = [z for z in self.zones if z.kind == "nogo"]
+        self.fences = [z for z in self.zones if z.kind == "fence"]
+
+        self._cells: Dict[Tuple[int, int], List[Zone]] = {}
+        if self.zones:
+            self._lat0 = min(z.bbox[0] for z in self.zones)
+            self._lng0 = min(z.bbox[1] for z in self.zones)
+            span = max(max(z.bbox[2] for z in self.zones) - self._lat0, max(z.bbox[3] for z in self.zones) - self._lng0)
+            self._cell = (span / max(1, int(grid_cells))) or 1e-3
+            for z in self.zones:
+                (i0, j0), (i1, j1) = self._cell_of(z.bbox[0], z.bbox[1]), self._cell_of(z.bbox[2], z.bbox[3])
+                for i in range(i0, i1 + 1):
+                    for j in range(j0, j1 + 1):
+                        self._cells.setdefault((i, j), []).append(z)
+
+    def __len__(self) -> int:
+        return len(self.zones)
+
+    def _cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor((lat - self._lat0) / self._cell)), int(math.floor((lng - self._lng0) / self._cell))
+
+    def zones_at(self, lat: float, lng: float, kind: Optional[str] = None) -> List[Zone]:
+        """Zones containing the point, optionally only those of `kind`."""
+        if not self.zones or lat is None or lng is None or math.isnan(lat) or math.isnan(lng):
+            return []
+        return [z for z in self._cells.get(self._cell_of(lat, lng), ()) if (kind is None or z.kind == kind) and z.contains(lat, lng)]
+
+    def in_nogo(self, lat: float, lng: float) -> Optional[Zone]:
+        hits = self.zones_at(lat, lng, "nogo")
+        return hits[0] if hits else None
+
+    def outside_fences(self, lat: float, lng: float) -> bool:
+        """True when geofences exist and the point lies in none of them."""
+        return bool(self.fences) and not self.zones_at(lat, lng, "fence")
+
+    def nogo_mask(self, lats: Sequence[float], lngs: Sequence[float]) -> np.ndarray:
+        """Boolean per point: inside some no-go zone (NaN coordinates are never inside)."""
+        lat = np.asarray(lats, dtype=float)
+        lng = np.asarray(lngs, dtype=float)
+        out = np.zeros(lat.shape, dtype=bool)
+        for z in self.nogo:
+            min_lat, min_lng, max_lat, max_lng = z.bbox
+            cand = np.flatnonzero(~out & (lat >= min_lat) & (lat <= max_lat) & (lng >= min_lng) & (lng <= max_lng))
+            for k in cand.tolist():
+                out[k] = z.contains(float(lat[k]), float(lng[k]))
+        return out
+
+    def crossing(self, lat1: float, lng1: float, lat2: float, lng2: float, kind: str = "nogo") -> List[Zone]:
+        """Zones of `kind` the straight segment touches."""
+        zs = self.nogo if kind == "nogo" else self.fences
+        return [z for z in zs if z.crosses(lat1, lng1, lat2, lng2)]
+
+    def route_crossings(self, coords: Sequence[Sequence[float]]) -> List[Tuple[Zone, int]]:
+        """(no-go zone, first segment index) for each zone a [lon, lat] polyline passes through."""
+        if not self.nogo or len(coords) < 2:
+            return []
+        pts = np.asarray(coords, dtype=float)
+        lng, lat = pts[:, 0], pts[:, 1]
+        seg_min_lat, seg_max_lat = np.minimum(lat[:-1], lat[1:]), np.maximum(lat[:-1], lat[1:])
+        seg_min_lng, seg_max_lng = np.minimum(lng[:-1], lng[1:]), np.maximum(lng[:-1], lng[1:])
+        out: List[Tuple[Zone, int]] = []
+        for z in self.nogo:
+            min_lat, min_lng, max_lat, max_lng = z.bbox
+            cand = np.flatnonzero((seg_max_lat >= min_lat) & (seg_min_lat <= max_lat) & (seg_max_lng >= min_lng) & (seg_min_lng <= max_lng))
+            for k in cand.tolist():
+                if z.crosses(lat[k], lng[k], lat[k + 1], lng[k + 1]):
+                    out.append((z, k))
+                    break
+        return out
+
+    def check_result(self, result: Dict[str, Any]) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Zone violations in an optimize result as (count, first MAX_VIOLATIONS entries):
+          - stop_in_nogo: a stop (including vehicle start/end) inside a no-go zone
+          - stop_outside_fence: a stop outside every geofence, when geofences are given
+          - route_crosses_nogo: the assignment's route geometry enters a no-go zone (at: [lon, lat])
+        """
+        count = 0
+        found: List[Dict[str, Any]] = []
+
+        def add(entry: Dict[str, Any]) -> None:
+            nonlocal count
+            count += 1
+            if len(found) < MAX_VIOLATIONS:
+                found.append(entry)
+
+        if not self.zones:
+            return 0, found
+        for a in result.get("assignments") or []:
+            vid = a.get("vehicle_id")
+            for k, st in enumerate(a.get("stops") or []):
+                lat, lng = st.get("lat"), st.get("lng")
+                if lat is None or lng is None:
+                    continue
+                stop = {"vehicle_id": vid, "stop": k, "stop_type": st.get("type"), "stop_id": st.get("id")}
+                zone = self.in_nogo(float(lat), float(lng))
+                if zone is not None:
+                    add({"kind": "stop_in_nogo", **stop, **zone.describe()})
+                if self.outside_fences(float(lat), float(lng)):
+                    add({"kind": "stop_outside_fence", **stop})
+            route = a.get("route") or {}
+            if route.get("type") == "LineString":
+                coords = route.get("coordinates") or []
+                for zone, seg in self.route_crossings(coords):
+                    add({"kind": "route_crosses_nogo", "vehicle_id": vid, "at": list(coords[seg]), **zone.describe()})
+        return count, found
+
+    def avoid_areas(self, max_chars: Optional[int] = None) -> str:
+        """
+        TomTom avoidAreas for the no-go zones ('poly:lat,lng:...' joined by '|'), at most `max_chars`
+        once URL-encoded (env TOMTOM_AVOID_MAX_CHARS, 4000). Over budget, polygons are simplified with
+        growing Douglas-Peucker tolerances (cutting at most that much off a zone's edge), then replaced by
+        their bounding boxes, which only ever grow the avoided area; zones that still don't fit are left
+        out, smallest first.
+        """
+        if not self.nogo:
+            return ""
+        if max_chars is None:
+            max_chars = int(os.getenv("TOMTOM_AVOID_MAX_CHARS") or DEFAULT_AVOID_MAX_CHARS)
+        param = "|".join(_format_poly(z.lats, z.lngs) for z in self.nogo)
+        if _encoded_len(param) <= max_chars:
+            return param
+        for tol in _AVOID_TOLERANCES_M:
+            polys = []
+            for z in self.nogo:
+                ring = simplify([[lng, lat] for lat, lng in zip(z.lats + z.lats[:1], z.lngs + z.lngs[:1])], tol)[:-1]
+                if len(ring) < 3:
+                    ring = _bbox_ring(z)
+                polys.append(_format_poly([p[1] for p in ring], [p[0] for p in ring], 5))
+            param = "|".join(polys)
+            if _encoded_len(param) <= max_chars:
+                return param
+        boxes = [(z, _format_poly([p[1] for p in _bbox_ring(z)], [p[0] for p in _bbox_ring(z)], 5)) for z in self.nogo]
+        boxes.sort(key=lambda b: (b[0].bbox[2] - b[0].bbox[0]) * (b[0].bbox[3] - b[0].bbox[1]), reverse=True)
+        kept: List[str] = []
+        for _, poly in boxes:
+            if _encoded_len("|".join(kept + [poly])) <= max_chars:
+                kept.append(poly)
+        if len(kept) < len(boxes):
+            logger.warning("avoidAreas: %d of %d no-go zones left out to fit %d chars", len(boxes) - len(kept), len(boxes), max_chars)
+        return "|".join(kept)
+
+
+def _bbox_ring(z: Zone) -> List[List[float]]:
+    min_lat, min_lng, max_lat, max_lng = z.bbox
+    return [[min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat]]
@@ -79,8 +79,9 @@ document.addEventListener('DOMContentLoaded', () => {
   ];
 
   let declaredVehicleCount = null;
-  let vehiclesParsed = null; // { headers, rows }
-  let shipmentsParsed = null; // { headers, rows }
+  let vehiclesParsed = null; // { headers, rows } preview returned by the upload
+  let shipmentsParsed = null; // { headers, rows } preview returned by the upload
+  let problemId = null; // server-side id of the uploaded vehicles + shipments
 
   // Step 1: proceed after entering count
   proceedVehiclesBtn.addEventListener('click', () => {
@@ -112,39 +113,42 @@ document.addEventListener('DOMContentLoaded', () => {
     step2.classList.add('hidden');
     step3.classList.add('hidden');
     declaredVehicleCount = null;
+    problemId = null;
   });
 
-  // Vehicle CSV upload
+  // Vehicle CSV upload: the server stream-parses and validates the file and keeps it under problemId
   vehicleCsvInput?.addEventListener('change', async (e) => {
     const file = e.target.files && e.target.files[0];
     if (!file) return;
+    notify(vehicleCsvStatus, 'Uploading…', '');
     try {
-      const text = await file.text();
-      const { headers, rows } = parseCSV(text);
-      const result = validateHeaders(headers, VEHICLE_HEADERS);
-      renderTable(vehicleTableContainer, headers, rows);
-      if (!result.valid) {
-        notify(
-          vehicleCsvStatus,
-          'Header mismatch. Expected: ' + VEHICLE_HEADERS.join(', '),
-          'error'
-        );
+      const data = await uploadTable('vehicles', file, problemId);
+      problemId = data.problem_id;
+      renderTable(vehicleTableContainer, data.headers, data.preview);
+      if (!data.accepted) {
+        notify(vehicleCsvStatus, 'No valid vehicle rows. ' + describeRowErrors(data), 'error');
+        vehiclesParsed = null;
         toShipmentsBtn.disabled = true;
+        updateMapButtonState();
         return;
       }
-      vehiclesParsed = { headers, rows };
-      let msg = `Loaded ${rows.length} vehicle rows.`;
-      if (declaredVehicleCount != null && rows.length !== declaredVehicleCount) {
-        msg += ` Note: vehicle count (${declaredVehicleCount}) differs from rows (${rows.length}).`;
-        notify(vehicleCsvStatus, msg, 'warn');
-      } else {
-        notify(vehicleCsvStatus, msg, 'success');
+      vehiclesParsed = { headers: data.headers, rows: data.preview };
+      let msg = `Loaded ${data.accepted} vehicle rows.`;
+      let level = 'success';
+      if (data.rejected) {
+        msg += ' ' + describeRowErrors(data);
+        level = 'warn';
       }
+      if (declaredVehicleCount != null && data.accepted !== declaredVehicleCount) {
+        msg += ` Note: vehicle count (${declaredVehicleCount}) differs from rows (${data.accepted}).`;
+        level = 'warn';
+      }
+      notify(vehicleCsvStatus, msg, level);
       toShipmentsBtn.disabled = false;
       updateMapButtonState();
     } catch (err) {
       console.error(err);
-      notify(vehicleCsvStatus, 'Failed to read CSV. Please check the file.', 'error');
+      notify(vehicleCsvStatus, 'Failed to read CSV: ' + err.message, 'error');
       toShipmentsBtn.disabled = true;
       vehiclesParsed = null;
       updateMapButtonState();
@@ -159,29 +163,29 @@ document.addEventListener('DOMContentLoaded', () => {
     window.scrollTo({ top: step3.offsetTop - 10, behavior: 'smooth' });
   });
 
-  // Shipment CSV upload
+  // Shipment CSV upload (attached to the same problemId as the vehicles)
   shipmentCsvInput?.addEventListener('change', async (e) => {
     const file = e.target.files && e.target.files[0];
     if (!file) return;
+    notify(shipmentCsvStatus, 'Uploading…', '');
     try {
-      const text = await file.text();
-      const { headers, rows } = parseCSV(text);
-      const result = validateHeaders(headers, SHIPMENT_HEADERS);
-      renderTable(shipmentTableContainer, headers, rows);
-      if (!result.valid) {
-        notify(
-          shipmentCsvStatus,
-          'Header mismatch. Expected: ' + SHIPMENT_HEADERS.join(', '),
-          'error'
-        );
+      const data = await uploadTable('shipments', file, problemId);
+      problemId = data.problem_id;
+      renderTable(shipmentTableContainer, data.headers, data.preview);
+      if (!data.accepted) {
+        notify(shipmentCsvStatus, 'No valid shipment rows. ' + describeRowErrors(data), 'error');
+        shipmentsParsed = null;
+        updateMapButtonState();
         return;
       }
-      shipmentsParsed = { headers, rows };
-      notify(shipmentCsvStatus, `Loaded ${rows.length} shipment rows.`, 'success');
+      shipmentsParsed = { headers: data.headers, rows: data.preview };
+      let msg = `Loaded ${data.accepted} shipment rows.`;
+      if (data.rejected) msg += ' ' + describeRowErrors(data);
+      notify(shipmentCsvStatus, msg, data.rejected ? 'warn' : 'success');
       updateMapButtonState();
     } catch (err) {
       console.error(err);
-      notify(shipmentCsvStatus, 'Failed to read CSV. Please check the file.', 'error');
+      notify(shipmentCsvStatus, 'Failed to read CSV: ' + err.message, 'error');
       shipmentsParsed = null;
       updateMapButtonState();
     }
@@ -311,11 +315,11 @@ document.addEventListener('DOMContentLoaded', () => {
     try {
       const zones = collectZones();
       const payload = {
-        vehicles: { headers: vehiclesParsed.headers, rows: vehiclesParsed.rows },
-        shipments: { headers: shipmentsParsed.headers, rows: shipmentsParsed.rows },
+        problem_id: problemId,
         zones,
         options: {
           use_road_routes: !!(useRoadRoutes?.checked),
+          geometry: { zoom: ROUTE_SIMPLIFY_ZOOM, format: 'polyline' },
           vehicle_restrictions: {
             long_vehicle: true, // treat commercial for constraints usage
             max_length_m: parseFloat(vehicleLengthM?.value || '') || undefined,
@@ -324,15 +328,24 @@ document.addEventListener('DOMContentLoaded', () => {
         nb_api_key: (nbApiKey?.value || '').trim() || undefined,
         tt_api_key: (ttApiKey?.value || '').trim() || undefined,
       };
-      const res = await fetch('/api/optimize', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload),
+      // Routes are drawn as each vehicle's record arrives; the summary table once totals are final
+      clearOptimizedRoutes();
+      const assignments = [];
+      let total = 0;
+      const data = await streamOptimize(payload, (rec) => {
+        if (rec.type === 'summary') {
+          total = rec.vehicles || 0;
+          notify(optimizeStatus, 'Solved; drawing routes…', '');
+        } else if (rec.type === 'assignment') {
+          assignments[rec.index] = rec.assignment;
+          drawAssignmentRoute(rec.assignment);
+          const done = assignments.filter(Boolean).length;
+          notify(optimizeStatus, `Routing vehicle ${done}${total ? '/' + total : ''}…`, '');
+        }
       });
-      if (!res.ok) throw new Error('Request failed');
-      const data = await res.json();
-      try { console.log('[API] /api/optimize', { status: res.status, assignments: (data.assignments||[]).length, notice: data.notice }); } catch (e) {}
-      renderOptimizedRoutes(data);
+      data.assignments = assignments.filter(Boolean);
+      try { console.log('[API] /api/optimize/stream', { assignments: data.assignments.length, cache: data.cache, notice: data.notice }); } catch (e) {}
+      applyRouteLayerToggles();
       renderOptimizationSummary(data);
       let msg = 'Optimization complete.';
       if (data.notice) msg += ' ' + data.notice;
@@ -352,83 +365,57 @@ document.addEventListener('DOMContentLoaded', () => {
   }
 });
 
-// CSV parser that handles quoted fields, commas, CRLF/LF
-function parseCSV(text) {
-  // Remove UTF-8 BOM if present
-  if (text.charCodeAt(0) === 0xfeff) {
-    text = text.slice(1);
-  }
-  const rows = [];
-  let cur = '';
-  let row = [];
-  let inQuotes = false;
-  for (let i = 0; i < text.length; i++) {
-    const c = text[i];
-    const next = text[i + 1];
-    if (inQuotes) {
-      if (c === '"') {
-        if (next === '"') {
-          // Escaped quote
-          cur += '"';
-          i++;
-        } else {
-          inQuotes = false;
-        }
-      } else {
-        cur += c;
-      }
-    } else {
-      if (c === '"') {
-        inQuotes = true;
-      } else if (c === ',') {
-        row.push(cur);
-        cur = '';
-      } else if (c === '\n') {
-        row.push(cur);
-        rows.push(row);
-        row = [];
-        cur = '';
-      } else if (c === '\r') {
-        // Handle CRLF by peeking next '\n'
-        if (next === '\n') {
-          // consume next in the loop progression
-        }
-      } else {
-        cur += c;
-      }
+// POST to /api/optimize/stream and hand each NDJSON record to onRecord; resolves with the final "done" record
+async function streamOptimize(payload, onRecord) {
+  const res = await fetch('/api/optimize/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(payload),
+  });
+  if (!res.ok || !res.body) throw new Error('Request failed');
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '';
+  let final = null;
+  const handle = (line) => {
+    if (!line.trim()) return;
+    const rec = JSON.parse(line);
+    if (rec.type === 'error') throw new Error(rec.detail || 'Optimization failed');
+    if (rec.type === 'done') final = rec;
+    onRecord(rec);
+  };
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let nl;
+    while ((nl = buf.indexOf('\n')) >= 0) {
+      handle(buf.slice(0, nl));
+      buf = buf.slice(nl + 1);
     }
   }
-  // Push last cell/row if any
-  if (cur.length > 0 || row.length > 0) {
-    row.push(cur);
-    rows.push(row);
-  }
-
-  // Trim possible empty trailing row
-  while (rows.length && rows[rows.length - 1].every((x) => x === '')) {
-    rows.pop();
-  }
+  handle(buf + decoder.decode());
+  if (!final) throw new Error('Optimization stream ended early');
+  return final;
+}
 
-  if (rows.length === 0) return { headers: [], rows: [] };
-  const headers = rows[0].map((h) => (h ?? '').trim());
-  const dataRows = rows.slice(1).map((r) => {
-    const arr = Array.from({ length: headers.length }, (_, i) => (r[i] ?? '').trim());
-    return arr;
-  });
-  return { headers, rows: dataRows };
+// Upload one CSV to the server; rejects with the server's message on a bad file
+async function uploadTable(kind, file, problemId) {
+  const form = new FormData();
+  form.append('file', file);
+  if (problemId) form.append('problem_id', problemId);
+  const res = await fetch(`/api/problems/${kind}`, { method: 'POST', body: form });
+  const data = await res.json().catch(() => ({}));
+  if (!res.ok) throw new Error(data.detail || `Upload failed (${res.status})`);
+  return data;
 }
 
-function validateHeaders(actual, expected) {
-  const norm = (s) => String(s || '').trim();
-  if (actual.length !== expected.length) {
-    return { valid: false, reason: 'length', actual, expected };
-  }
-  for (let i = 0; i < expected.length; i++) {
-    if (norm(actual[i]) !== norm(expected[i])) {
-      return { valid: false, reason: 'mismatch', index: i, actual, expected };
-    }
-  }
-  return { valid: true };
+function describeRowErrors(data) {
+  if (!data.rejected) return '';
+  const first = (data.errors || []).slice(0, 3).map((e) => `line ${e.line} ${e.column}: ${e.message}`);
+  let msg = `${data.rejected} row(s) skipped`;
+  if (first.length) msg += ' (' + first.join('; ') + (data.errors.length > 3 || data.errors_truncated ? '; …' : '') + ')';
+  return msg + '.';
 }
 
 function renderTable(container, headers, rows, limit = 1000) {
@@ -668,40 +655,76 @@ function collectZones() {
   return zones;
 }
 
-// Render optimized routes
-function renderOptimizedRoutes(resp) {
-  const map = window._mapInstance; if (!map) return;
+// Routes are simplified server-side to ~1px at this zoom (street level) and sent as encoded polylines
+const ROUTE_SIMPLIFY_ZOOM = 16;
+
+// Decode a Google encoded polyline into [lat, lng] pairs
+function decodePolyline(str, precision) {
+  const factor = Math.pow(10, precision || 5);
+  const out = [];
+  let idx = 0, lat = 0, lng = 0;
+  while (idx < str.length) {
+    const vals = [0, 0];
+    for (let k = 0; k < 2; k++) {
+      let shift = 0, result = 0, b;
+      do {
+        b = str.charCodeAt(idx++) - 63;
+        result |= (b & 0x1f) << shift;
+        shift += 5;
+      } while (b >= 0x20);
+      vals[k] = (result & 1) ? ~(result >> 1) : (result >> 1);
+    }
+    lat += vals[0]; lng += vals[1];
+    out.push([lat / factor, lng / factor]);
+  }
+  return out;
+}
+
+function routeLatLngs(route) {
+  if (!route) return [];
+  if (route.type === 'EncodedPolyline') return decodePolyline(route.polyline || '', route.precision);
+  return (route.coordinates || []).map(c => [c[1], c[0]]);
+}
+
+// Reset the optimized-route and step layers; false if the map isn't ready
+function clearOptimizedRoutes() {
+  const map = window._mapInstance; if (!map) return false;
   if (window._routesLayer) { window._routesLayer.remove(); }
   window._routesLayer = L.layerGroup().addTo(map);
   if (window._stepsLayer) { window._stepsLayer.remove(); }
   window._stepsLayer = L.layerGroup().addTo(map);
-  const assigns = resp && resp.assignments ? resp.assignments : [];
-  assigns.forEach(a => {
-    const coords = (a.route && a.route.coordinates) || [];
-    const latlngs = coords.map(c => [c[1], c[0]]);
-    const color = colorForVehicle(a.vehicle_id);
-    if (latlngs.length >= 2) {
-      L.polyline(latlngs, { color, weight: 4, opacity: 0.9 }).addTo(window._routesLayer);
-    }
-    // Stops markers with ETAs and sequence numbers
-    let seq = 1;
-    (a.stops || []).forEach(st => {
-      if (!isFinite(st.lat) || !isFinite(st.lng)) return;
-      const t = st.type;
-      const eta = st.eta || st.eta_calc;
-      const icon = L.divIcon({
-        className: 'seq-marker',
-        html: '<span style="background:' + color + ';display:inline-block;width:100%;height:100%;border-radius:12px;line-height:18px;">' + seq + '</span>',
-        iconSize: [22, 22],
-        iconAnchor: [11, 11]
-      });
-      const m = L.marker([st.lat, st.lng], { icon })
-        .bindPopup('<strong>' + escapeHtml(String(a.vehicle_id)) + ' - ' + escapeHtml(String(t)) + '</strong><br>' + st.lat.toFixed(6) + ', ' + st.lng.toFixed(6) + (eta ? ('<br>ETA: ' + escapeHtml(String(eta))) : ''));
-      m.addTo(window._stepsLayer);
-      seq++;
+  return true;
+}
+
+// Draw one assignment's route line and numbered stop markers
+function drawAssignmentRoute(a) {
+  if (!window._routesLayer || !window._stepsLayer) return;
+  const latlngs = routeLatLngs(a.route);
+  const color = colorForVehicle(a.vehicle_id);
+  if (latlngs.length >= 2) {
+    L.polyline(latlngs, { color, weight: 4, opacity: 0.9 }).addTo(window._routesLayer);
+  }
+  // Stops markers with ETAs and sequence numbers
+  let seq = 1;
+  (a.stops || []).forEach(st => {
+    if (!isFinite(st.lat) || !isFinite(st.lng)) return;
+    const t = st.type;
+    const eta = st.eta || st.eta_calc;
+    const icon = L.divIcon({
+      className: 'seq-marker',
+      html: '<span style="background:' + color + ';display:inline-block;width:100%;height:100%;border-radius:12px;line-height:18px;">' + seq + '</span>',
+      iconSize: [22, 22],
+      iconAnchor: [11, 11]
     });
+    const m = L.marker([st.lat, st.lng], { icon })
+      .bindPopup('<strong>' + escapeHtml(String(a.vehicle_id)) + ' - ' + escapeHtml(String(t)) + '</strong><br>' + st.lat.toFixed(6) + ', ' + st.lng.toFixed(6) + (eta ? ('<br>ETA: ' + escapeHtml(String(eta))) : ''));
+    m.addTo(window._stepsLayer);
+    seq++;
   });
-  // Respect layer toggles
+}
+
+// Respect layer toggles
+function applyRouteLayerToggles() {
   var stepsToggle = document.getElementById('toggleRouteSteps');
   if (stepsToggle && !stepsToggle.checked && window._stepsLayer) { window._stepsLayer.remove(); }
   var inputToggle = document.getElementById('toggleInputDetail');